@@ -1,6 +1,16 @@
 from django.contrib import admin
 
-from core.models import AppConfig, FeatureFlag, Image, ImageUpload
+from core.models import (
+    AppConfig,
+    CachedImaggaResponse,
+    CircuitBreakerState,
+    FeatureFlag,
+    Image,
+    ImageTag,
+    ImageUpload,
+    Tag,
+    TokenBucketState,
+)
 
 # Register your models here.
 
@@ -8,3 +18,20 @@ admin.site.register(Image)
 admin.site.register(ImageUpload)
 admin.site.register(AppConfig)
 admin.site.register(FeatureFlag)
+admin.site.register(Tag)
+admin.site.register(ImageTag)
+admin.site.register(TokenBucketState)
+# Set the state back to CLOSED here to resume calling Imagga before the reset timeout
+admin.site.register(CircuitBreakerState)
+
+
+@admin.register(CachedImaggaResponse)
+class CachedImaggaResponseAdmin(admin.ModelAdmin):
+    list_display = [
+        "endpoint",
+        "image_url",
+        "hit_count",
+        "date_created",
+        "last_accessed",
+    ]
+    ordering = ["-last_accessed"]
@@ -0,0 +1,151 @@
+import bisect
+import heapq
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from core.models import Tag
+
+# Tags updated this long before the latest update seen are read again on the next refresh, so an update committed
+# late by a slow transaction (or stamped by a process with a lagging clock) is not missed
+REFRESH_OVERLAP = timedelta(seconds=60)
+# Reload every tag this often anyway, to drop tags deleted while others were created
+FULL_RELOAD_INTERVAL_SECONDS = 600
+# Prefixes this short match many tags, so their top tags are kept instead of being picked again on every keystroke
+TOP_TAGS_CACHED_PREFIX_LENGTH = 2
+
+
+class _TagIndexState:
+    """
+    Class to hold one immutable snapshot of the index: tag names in sorted order and their image counts
+    """
+
+    def __init__(self, image_counts):
+        self.image_counts = image_counts
+        self.names = sorted(image_counts)
+        self.top_tags = {}
+
+
+class TagAutocompleteIndex:
+    """
+    Class to suggest tags by prefix from memory, most common first.
+
+    Tags (with at least one image) are kept as a sorted list of names, so the tags starting with a prefix are a
+    contiguous range found by binary search; the most common of those are picked with a heap, and remembered for short
+    prefixes. Like core.config.ConfigCache, the Tag table's version stamp (row count and latest `date_updated`) is only
+    checked once every `ttl` seconds; when it changed, only the tags updated since the last load are read, as
+    services.index_image_tags stamps every tag whose image count it changes.
+    """
+
+    def __init__(self, ttl: float, max_limit: int):
+        self.ttl = ttl
+        self.max_limit = max_limit
+        self._lock = threading.Lock()
+        self._state = _TagIndexState({})
+        self._version = None
+        self._loaded_until = None
+        self._checked_at = None
+        self._fully_loaded_at = None
+
+    def suggest(self, prefix: str, limit: int):
+        """
+        Get the most common tags starting with a prefix.
+
+        :param prefix: start of the tag names, matched case-insensitively
+        :param limit: most tags to return, up to `max_limit`
+        :return: list of (name, image count), most common first and then by name
+        """
+        self._refresh()
+        state = self._state
+        prefix = prefix.strip().lower()
+        limit = min(limit, self.max_limit)
+
+        if len(prefix) <= TOP_TAGS_CACHED_PREFIX_LENGTH:
+            top_tags = state.top_tags.get(prefix)
+            if top_tags is None:
+                top_tags = state.top_tags[prefix] = self._get_top_tags(
+                    state, prefix, self.max_limit
+                )
+            return top_tags[:limit]
+        return self._get_top_tags(state, prefix, limit)
+
+    def invalidate(self):
+        """
+        Force the next suggestion to check the version stamp against the database.
+        """
+        self._checked_at = None
+
+    def _get_top_tags(self, state, prefix, limit):
+        start = bisect.bisect_left(state.names, prefix)
+        # Every name starting with the prefix sorts before the prefix followed by the highest code point
+        end = bisect.bisect_left(state.names, prefix + "\U0010ffff", lo=start)
+        return [
+            (name, state.image_counts[name])
+            for name in heapq.nsmallest(
+                limit,
+                state.names[start:end],
+                key=lambda name: (-state.image_counts[name], name),
+            )
+        ]
+
+    def _refresh(self):
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.ttl:
+            return
+
+        with self._lock:
+            if self._checked_at is not None and self._checked_at != checked_at:
+                # Another thread refreshed while we waited for the lock
+                return
+            version = tuple(
+                Tag.objects.aggregate(
+                    count=Count("id"), updated=Max("date_updated")
+                ).values()
+            )
+            if version != self._version:
+                full_reload = (
+                    self._version is None
+                    # Fewer tags than last time: some were deleted
+                    or version[0] < self._version[0]
+                    or time.monotonic() - self._fully_loaded_at
+                    > FULL_RELOAD_INTERVAL_SECONDS
+                )
+                self._load(full_reload)
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _load(self, full_reload):
+        tags = Tag.objects.all()
+        if full_reload:
+            image_counts = {}
+            self._fully_loaded_at = time.monotonic()
+        else:
+            image_counts = dict(self._state.image_counts)
+            if self._loaded_until is not None:
+                tags = tags.filter(
+                    date_updated__gte=self._loaded_until - REFRESH_OVERLAP
+                )
+
+        loaded_until = self._loaded_until
+        for name, image_count, date_updated in tags.values_list(
+            "name", "image_count", "date_updated"
+        ):
+            if image_count > 0:
+                image_counts[name] = image_count
+            else:
+                image_counts.pop(name, None)
+            if loaded_until is None or date_updated > loaded_until:
+                loaded_until = date_updated
+
+        self._loaded_until = loaded_until
+        # Readers keep using the previous snapshot until this one is complete
+        self._state = _TagIndexState(image_counts)
+
+
+tag_autocomplete_index = TagAutocompleteIndex(
+    ttl=settings.TAG_AUTOCOMPLETE_REFRESH_SECONDS,
+    max_limit=settings.TAG_AUTOCOMPLETE_MAX_LIMIT,
+)
@@ -0,0 +1,266 @@
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.middleware import QUERY_COUNT_HEADER
+from core.models import Image, ImageTag, SourceType, Tag
+from core.result_cache import IMAGES_GENERATION, bump_generation
+
+BENCHMARK_LABEL_PREFIX = "benchmark-"
+WORKLOADS = ("list", "search", "detail", "create")
+
+
+def seed_benchmark_images(image_count, tag_vocabulary_size, tags_per_image, seed=0):
+    """
+    Create tagged images to benchmark against, with a few queries per thousand images.
+
+    :param image_count: number of images to create
+    :param tag_vocabulary_size: number of distinct tags to draw from
+    :param tags_per_image: tags given to each image
+    :param seed: seed for the tags each image gets, so datasets are repeatable
+    :return: (list of image ids, list of tag names)
+    """
+    rng = random.Random(seed)
+    tag_names = [f"benchmark-tag-{i}" for i in range(tag_vocabulary_size)]
+    with transaction.atomic():
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in tag_names], ignore_conflicts=True
+        )
+        tag_ids = dict(Tag.objects.filter(name__in=tag_names).values_list("name", "id"))
+        images = Image.objects.bulk_create(
+            [
+                Image(
+                    label=f"{BENCHMARK_LABEL_PREFIX}{i}",
+                    source_type=SourceType.URL.name,
+                    source_url=f"https://example.com/benchmark/{i}.jpg",
+                    detected_objects=rng.sample(
+                        tag_names, min(tags_per_image, len(tag_names))
+                    ),
+                )
+                for i in range(image_count)
+            ],
+            batch_size=1000,
+        )
+        ImageTag.objects.bulk_create(
+            [
+                ImageTag(image_id=image.id, tag_id=tag_ids[name])
+                for image in images
+                for name in image.detected_objects
+            ],
+            batch_size=1000,
+        )
+        # bulk_create skips the post_save signal that invalidates cached results
+        bump_generation(IMAGES_GENERATION)
+        tag_counts = Counter(
+            name for image in images for name in image.detected_objects
+        )
+        for name, count in tag_counts.items():
+            Tag.objects.filter(id=tag_ids[name]).update(
+                image_count=F("image_count") + count, date_updated=timezone.now()
+            )
+    return [image.id for image in images], tag_names
+
+
+def delete_benchmark_images(image_ids, tag_names=()):
+    """
+    Delete the images created for or by a benchmark run, and the seeded tags that no other image has.
+
+    :param image_ids: ids of the images to delete
+    :param tag_names: names of the tags seeded by seed_benchmark_images
+    """
+    with transaction.atomic():
+        Image.objects.filter(id__in=image_ids).delete()
+        Tag.objects.filter(name__in=tag_names, image_tags__isnull=True).delete()
+
+
+def run_workload(
+    base_url, workload, auth, image_ids, tag_names, concurrency, request_count, seed=0
+):
+    """
+    Send `request_count` requests of one workload to a running app from `concurrency` threads, each with its own
+    logged-in keep-alive session. Basic authentication would hash the password on every request and swamp what is
+    being measured.
+
+    :param base_url: URL the app is served at, e.g. http://127.0.0.1:8000
+    :param workload: one of WORKLOADS
+    :param auth: (username, password) to log in with
+    :param image_ids: ids of existing images, for the detail workload
+    :param tag_names: tag names to search for, for the search workload
+    :return: (summary dict, list of ids of images created by the create workload)
+    """
+    base_url = base_url.rstrip("/")
+    remaining = iter(range(request_count))
+    lock = threading.Lock()
+    samples = []
+    created_ids = []
+
+    def work(worker_index):
+        rng = random.Random(seed * 1000 + worker_index)
+        session = _login(base_url, *auth)
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    break
+            method, url, kwargs = _build_request(
+                workload, base_url, rng, image_ids, tag_names
+            )
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=60, **kwargs)
+                status_code = response.status_code
+            except requests.RequestException:
+                response, status_code = None, None
+            elapsed = time.perf_counter() - started
+
+            query_count = response.headers.get(QUERY_COUNT_HEADER) if response else None
+            with lock:
+                samples.append(
+                    (elapsed, status_code, int(query_count) if query_count else None)
+                )
+                if workload == "create" and status_code in (200, 202):
+                    created_ids.append(response.json()["id"])
+        session.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(work, range(concurrency)))
+    duration = time.perf_counter() - started
+    return summarize_samples(samples, duration), created_ids
+
+
+def summarize_samples(samples, duration):
+    """
+    Summarize request samples as throughput, latency percentiles (in milliseconds) and DB queries per request.
+
+    :param samples: list of (latency in seconds, status code or None, query count or None)
+    :param duration: wall-clock seconds the requests took
+    """
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    query_counts = [sample[2] for sample in samples if sample[2] is not None]
+    status_counts = {}
+    for _, status_code, _ in samples:
+        key = str(status_code) if status_code is not None else "failed"
+        status_counts[key] = status_counts.get(key, 0) + 1
+    errors = sum(
+        1 for _, status_code, _ in samples if status_code is None or status_code >= 400
+    )
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "status_codes": status_counts,
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+        "db_queries_per_request": (
+            {
+                "mean": round(sum(query_counts) / len(query_counts), 2),
+                "max": max(query_counts),
+            }
+            if query_counts
+            else None
+        ),
+    }
+
+
+def compare_results(baseline, results):
+    """
+    Compare two benchmark results, as the relative change of throughput, p95 latency and mean queries per workload.
+
+    :return: dict of {workload: {metric: change}}, where a change of 0.1 means 10% higher than the baseline
+    """
+    comparison = {}
+    for workload, summary in results["workloads"].items():
+        baseline_summary = baseline.get("workloads", {}).get(workload)
+        if not baseline_summary:
+            continue
+        comparison[workload] = {
+            "throughput_rps": _relative_change(
+                baseline_summary["throughput_rps"], summary["throughput_rps"]
+            ),
+            "p95_ms": _relative_change(
+                baseline_summary["latency_ms"]["p95"], summary["latency_ms"]["p95"]
+            ),
+            "db_queries_per_request": _relative_change(
+                (baseline_summary["db_queries_per_request"] or {}).get("mean"),
+                (summary["db_queries_per_request"] or {}).get("mean"),
+            ),
+        }
+    return comparison
+
+
+def _login(base_url, username, password):
+    session = requests.Session()
+    login_url = f"{base_url}/api-auth/login/"
+    session.get(login_url, timeout=60)
+    csrf_token = session.cookies.get("csrftoken")
+    response = session.post(
+        login_url,
+        data={
+            "username": username,
+            "password": password,
+            "csrfmiddlewaretoken": csrf_token,
+        },
+        headers={"Referer": login_url},
+        allow_redirects=False,
+        timeout=60,
+    )
+    if "sessionid" not in session.cookies:
+        raise ValueError(
+            f"Could not log in as {username} (status {response.status_code})."
+        )
+    # Django rotates the CSRF token on login
+    session.headers["X-CSRFToken"] = session.cookies.get("csrftoken")
+    return session
+
+
+def _build_request(workload, base_url, rng, image_ids, tag_names):
+    if workload == "list":
+        return "GET", f"{base_url}/images/", {}
+    if workload == "search":
+        objects = ",".join(rng.sample(tag_names, min(2, len(tag_names))))
+        return "GET", f"{base_url}/images/", {"params": {"objects": objects}}
+    if workload == "detail":
+        return "GET", f"{base_url}/images/{rng.choice(image_ids)}/", {}
+    if workload == "create":
+        return (
+            "POST",
+            f"{base_url}/images/",
+            {
+                "json": {
+                    "label": f"{BENCHMARK_LABEL_PREFIX}{uuid.uuid4().hex}",
+                    "source_type": SourceType.URL.name,
+                    "source_url": f"https://example.com/benchmark/{uuid.uuid4().hex}.jpg",
+                    "detect_objects": "true",
+                }
+            },
+        )
+    raise ValueError(f"Unknown workload: {workload}")
+
+
+def _percentile(sorted_values, percentile):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percentile / 100 * len(sorted_values)), 1)
+    return round(sorted_values[rank - 1], 2)
+
+
+def _relative_change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before, 4)
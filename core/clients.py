@@ -1,41 +1,82 @@
-from django.conf import settings
+import os
+import random
+import time
 import requests
 from logging import Logger
+from requests.adapters import HTTPAdapter
 from core.constants import (
     DEFAULT_IMAGGA_NSFW_CATORIZER_ID,
     IMAGGA_NSFW_CATORIZER_ID_APP_CONFIG_KEY,
 )
 
-from core.models import AppConfig
+from core.config import config_cache
+from core.resilience import ImaggaUnavailable
+from core.metrics import (
+    imagga_request_duration,
+    imagga_requests_in_flight,
+    imagga_response_cache,
+)
 
 log = Logger(__name__)
 
 IMAGA_API_URL = "https://api.imagga.com/v2/"
-TAG_URL = IMAGA_API_URL + "tags"
-UPLOAD_URL = IMAGA_API_URL + "uploads"
-CATEGORIES_CHECK_URL = IMAGA_API_URL + "categories"
+
+# Imagga answers 429 when the plan's rate limit is hit and 5xx while degraded; both are worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Longest wait between two attempts, as urllib3 allowed
+RETRY_BACKOFF_MAX = 120
 
 
 class ImaggaClient:
 
-    def __init__(self, api_key, api_secret):
+    def __init__(
+        self,
+        api_key,
+        api_secret,
+        api_url=IMAGA_API_URL,
+        connect_timeout=3.05,
+        read_timeout=30.0,
+        pool_maxsize=10,
+        max_retries=3,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        response_cache=None,
+        rate_limiter=None,
+        circuit_breaker=None,
+    ):
         self.api_key = api_key
         self.api_secret = api_secret
+        # Base URL of the v2 API, e.g. a local simulator (see core.simulator)
+        self.tag_url = api_url + "tags"
+        self.upload_url = api_url + "uploads"
+        self.categories_check_url = api_url + "categories"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.session = self._build_session(pool_maxsize)
+        # Optional ImaggaResponseCache consulted before any call made for an image URL
+        self.response_cache = response_cache
+        # Optional TokenBucket and CircuitBreaker (see core.resilience), shared with every other process
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
 
     def get_tag_image(self, image_url):
-        response = requests.get(
-            f"{TAG_URL}?image_url={image_url}", auth=(self.api_key, self.api_secret)
+        if cached_response := self._get_cached_response(self.tag_url, image_url):
+            return cached_response
+
+        response = self._request(
+            "GET", self.tag_url, "tags", params={"image_url": image_url}
         )
 
         if response.status_code == 200:
-            return response.json()
+            return self._cache_response(self.tag_url, image_url, response.json())
         else:
             self._error_response_handler(response)
 
     def get_tag_image_for_upload(self, upload_id):
-        response = requests.get(
-            f"{TAG_URL}?image_upload_id={upload_id}",
-            auth=(self.api_key, self.api_secret),
+        response = self._request(
+            "GET", self.tag_url, "tags", params={"image_upload_id": upload_id}
         )
 
         if response.status_code == 200:
@@ -43,12 +84,19 @@ class ImaggaClient:
         else:
             self._error_response_handler(response)
 
-    def upload_image(self, image_path):
-        response = requests.post(
-            UPLOAD_URL,
-            auth=(self.api_key, self.api_secret),
-            files={"image": open(f"{settings.MEDIA_ROOT}/{image_path}", "rb")},
-        )
+    def upload_image(self, image_file):
+        """
+        Upload an image to Imagga, reading it through the storage backend.
+
+        :param image_file: File (e.g. Image.source) to upload
+        """
+        with image_file.open("rb") as image:
+            response = self._request(
+                "POST",
+                self.upload_url,
+                "uploads",
+                files={"image": (os.path.basename(image_file.name), image)},
+            )
 
         if response.status_code == 200:
             return response.json()
@@ -56,26 +104,160 @@ class ImaggaClient:
             self._error_response_handler(response)
 
     def check_nsfw_categories(self, image):
-        try:
-            imagga_nsfw_catorizer_id = AppConfig.objects.filter(
-                key=IMAGGA_NSFW_CATORIZER_ID_APP_CONFIG_KEY
-            ).get()
-        except AppConfig.DoesNotExist:
+        imagga_nsfw_catorizer_id = config_cache.get_value(
+            IMAGGA_NSFW_CATORIZER_ID_APP_CONFIG_KEY
+        )
+        if not imagga_nsfw_catorizer_id:
             log.warn(
                 f"Key of `{IMAGGA_NSFW_CATORIZER_ID_APP_CONFIG_KEY}` in AppConfig not found. Defaulting to hard-coded value."
             )
             imagga_nsfw_catorizer_id = DEFAULT_IMAGGA_NSFW_CATORIZER_ID
 
-        response = requests.get(
-            f"{CATEGORIES_CHECK_URL}/{imagga_nsfw_catorizer_id}?{f"image_url={image.source_url}" if image.source_url else f"image_upload_id={image.image_upload.upload_id}"}",
-            auth=(self.api_key, self.api_secret),
+        if image.source_url and (
+            cached_response := self._get_cached_response(
+                self.categories_check_url, image.source_url, imagga_nsfw_catorizer_id
+            )
+        ):
+            return cached_response
+
+        response = self._request(
+            "GET",
+            f"{self.categories_check_url}/{imagga_nsfw_catorizer_id}",
+            "categories",
+            params=(
+                {"image_url": image.source_url}
+                if image.source_url
+                else {"image_upload_id": image.image_upload.upload_id}
+            ),
         )
 
         if response.status_code == 200:
-            return response.json()
+            if not image.source_url:
+                return response.json()
+            return self._cache_response(
+                self.categories_check_url,
+                image.source_url,
+                response.json(),
+                imagga_nsfw_catorizer_id,
+            )
         else:
             self._error_response_handler(response)
 
+    def cache_stats(self):
+        """
+        Get the response cache hit and miss counters of this process.
+        """
+        if self.response_cache is None:
+            return {"hits": 0, "misses": 0}
+        return self.response_cache.stats()
+
+    def _get_cached_response(self, endpoint, image_url, categorizer_id=""):
+        if self.response_cache is None:
+            return None
+        response_json = self.response_cache.get(endpoint, image_url, categorizer_id)
+        imagga_response_cache.labels(
+            endpoint.rsplit("/", 1)[-1], "miss" if response_json is None else "hit"
+        ).inc()
+        return response_json
+
+    def _cache_response(self, endpoint, image_url, response_json, categorizer_id=""):
+        if self.response_cache is not None:
+            self.response_cache.set(endpoint, image_url, response_json, categorizer_id)
+        return response_json
+
+    def _request(self, method, url, endpoint, **kwargs):
+        """
+        Call Imagga, retrying throttled or failed calls up to `max_retries` times with jittered exponential backoff
+        (or after the response's Retry-After). Retries are made here rather than by the session, so every attempt
+        waits for its own rate limiter token and counts for the circuit breaker, which stops the retries once it opens.
+        """
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            if attempt:
+                # Uploads are retried as well, rewound after the previous attempt read them; a duplicate upload only
+                # costs an extra upload_id on Imagga's side
+                for _, file in kwargs.get("files", {}).values():
+                    file.seek(0)
+            try:
+                response = self._attempt(method, url, endpoint, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if is_last_attempt:
+                    raise
+                time.sleep(self._get_backoff(attempt))
+                continue
+            if response.status_code not in RETRY_STATUS_CODES or is_last_attempt:
+                return response
+            time.sleep(self._get_backoff(attempt, response))
+
+    def _get_backoff(self, attempt, response=None):
+        """
+        :return: seconds to wait before retrying after the given attempt (counted from 0)
+        """
+        try:
+            return min(float(response.headers.get("Retry-After")), RETRY_BACKOFF_MAX)
+        except (AttributeError, TypeError, ValueError):
+            # No response, or no Retry-After in seconds
+            pass
+        backoff = (
+            self.backoff_factor * 2**attempt + random.random() * self.backoff_jitter
+        )
+        return min(backoff, RETRY_BACKOFF_MAX)
+
+    def _attempt(self, method, url, endpoint, **kwargs):
+        """
+        Make a single call to Imagga, recording its latency by endpoint name and status code. Calls wait for the rate
+        limiter and fail fast with ImaggaUnavailable while the circuit breaker is open.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_call()
+        if self.rate_limiter is not None:
+            try:
+                self.rate_limiter.acquire()
+            except ImaggaUnavailable:
+                if self.circuit_breaker is not None:
+                    # Let another caller probe instead of holding the probe until the reset timeout
+                    self.circuit_breaker.release_probe()
+                raise
+
+        status = "error"
+        started = time.perf_counter()
+        try:
+            with imagga_requests_in_flight.labels().track_in_progress():
+                response = self.session.request(
+                    method,
+                    url,
+                    auth=(self.api_key, self.api_secret),
+                    timeout=self.timeout,
+                    **kwargs,
+                )
+            status = response.status_code
+            return response
+        finally:
+            imagga_request_duration.labels(endpoint, status).observe(
+                time.perf_counter() - started
+            )
+            if self.circuit_breaker is not None:
+                # Timeouts, connection errors, throttling and server errors count against Imagga; other responses show it is up
+                if status == "error" or status in RETRY_STATUS_CODES:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+
+    def _build_session(self, pool_maxsize):
+        """
+        Build a session that keeps up to `pool_maxsize` connections to Imagga alive, so calls reuse the TCP+TLS
+        handshake. It makes no retries of its own; see _request.
+        """
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
     def _error_response_handler(self, response):
         if response.status_code == 401:
             msg = "Unauthorized. Please check your API key and secret for Imagga."
@@ -83,6 +265,8 @@ class ImaggaClient:
             msg = "Resource not found. Please check the URL."
         elif response.status_code == 400:
             msg = "Bad Request. Please check the request parameters."
+        elif response.status_code == 429:
+            msg = "Imagga rate limit exceeded. Please try again later."
         else:
-            msg = f"An unexpected error occurred. Please try again later. Message: {response.message}"
+            msg = f"An unexpected error occurred. Please try again later. Message: {response.text}"
         raise ValueError(msg)
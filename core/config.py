@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from core.models import AppConfig, FeatureFlag
+
+
+class ConfigCache:
+    """
+    Class to serve AppConfig values and FeatureFlag states from memory.
+
+    Both tables are reloaded whenever their version stamp (row count and latest `date_updated`) changes. The stamp is
+    only checked once every `ttl` seconds, so a change made in Django-Admin reaches every worker process within `ttl`
+    seconds without a restart. Writes made by the current process invalidate the cache immediately (see core.signals).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._app_config = {}
+        self._feature_flags = {}
+        self._version = None
+        self._checked_at = None
+
+    def get_value(self, key: str) -> Optional[str]:
+        """
+        Get the raw value of an AppConfig entry, or None if the key does not exist.
+        """
+        self._refresh()
+        return self._app_config.get(key)
+
+    def get_float(self, key: str) -> Optional[float]:
+        """
+        Get an AppConfig value as a float, or None if the key does not exist or is not a number.
+        """
+        value = self.get_value(key)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def get_list(self, key: str) -> Optional[list[str]]:
+        """
+        Get a comma-separated AppConfig value as a list, or None if the key does not exist.
+        """
+        value = self.get_value(key)
+        if value is None:
+            return None
+        return [item for item in value.split(",") if item]
+
+    def is_feature_active(self, name: str) -> Optional[bool]:
+        """
+        Get the state of a FeatureFlag, or None if the flag does not exist.
+        """
+        self._refresh()
+        return self._feature_flags.get(name)
+
+    def invalidate(self):
+        """
+        Force the next read to check the version stamp against the database.
+        """
+        self._checked_at = None
+
+    def _refresh(self):
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.ttl:
+            return
+
+        with self._lock:
+            if self._checked_at is not None and self._checked_at != checked_at:
+                # Another thread refreshed while we waited for the lock
+                return
+            version = self._get_version()
+            if version != self._version:
+                self._app_config = dict(AppConfig.objects.values_list("key", "value"))
+                self._feature_flags = dict(
+                    FeatureFlag.objects.values_list("name", "active")
+                )
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _get_version(self):
+        return (
+            tuple(
+                AppConfig.objects.aggregate(
+                    count=Count("id"), updated=Max("date_updated")
+                ).values()
+            ),
+            tuple(
+                FeatureFlag.objects.aggregate(
+                    count=Count("id"), updated=Max("date_updated")
+                ).values()
+            ),
+        )
+
+
+config_cache = ConfigCache(ttl=settings.CONFIG_CACHE_TTL_SECONDS)
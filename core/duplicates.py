@@ -0,0 +1,79 @@
+from itertools import combinations
+
+from django.db.models import Q
+
+from core.models import Image, ImageHashBand
+
+HASH_BITS = 64
+BAND_COUNT = 4
+BAND_BITS = HASH_BITS // BAND_COUNT
+
+
+def index_perceptual_hash(image: Image):
+    """
+    Sync the ImageHashBand index with the image's perceptual hash.
+
+    :param image: Image object
+    """
+    ImageHashBand.objects.filter(image_id=image.id).delete()
+    if not image.perceptual_hash:
+        return
+    ImageHashBand.objects.bulk_create(
+        [
+            ImageHashBand(image_id=image.id, band=band, value=value)
+            for band, value in enumerate(_get_bands(int(image.perceptual_hash, 16)))
+        ]
+    )
+
+
+def find_near_duplicates(perceptual_hash: str, max_distance: int, exclude_id=None):
+    """
+    Find the images whose perceptual hash is within `max_distance` bits of the given hash.
+
+    If two hashes differ in at most `max_distance` bits, at least one of their BAND_COUNT bands differs in at most
+    `max_distance // BAND_COUNT` bits. So only images with a band within that radius are fetched and compared.
+
+    :param perceptual_hash: hash as 16 hex digits
+    :param max_distance: largest Hamming distance to match
+    :param exclude_id: id of an image to leave out, usually the one being matched
+    :return: list of (image id, distance), closest first
+    """
+    target = int(perceptual_hash, 16)
+    band_radius = max_distance // BAND_COUNT
+    band_lookups = Q()
+    for band, value in enumerate(_get_bands(target)):
+        band_lookups |= Q(
+            band=band, value__in=_get_values_within(value, band_radius, BAND_BITS)
+        )
+
+    candidates = Image.objects.filter(
+        id__in=ImageHashBand.objects.filter(band_lookups).values("image_id")
+    )
+    if exclude_id is not None:
+        candidates = candidates.exclude(id=exclude_id)
+
+    near_duplicates = []
+    for image_id, candidate_hash in candidates.values_list("id", "perceptual_hash"):
+        distance = (int(candidate_hash, 16) ^ target).bit_count()
+        if distance <= max_distance:
+            near_duplicates.append((image_id, distance))
+    return sorted(near_duplicates, key=lambda match: (match[1], match[0]))
+
+
+def _get_bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BAND_COUNT)]
+
+
+def _get_values_within(value, radius, bits):
+    """
+    Get every value that differs from `value` in at most `radius` of its `bits` bits.
+    """
+    values = [value]
+    for distance in range(1, radius + 1):
+        for flipped_bits in combinations(range(bits), distance):
+            flipped = value
+            for bit in flipped_bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
@@ -0,0 +1,80 @@
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.models import Image
+from core.serializers import IMAGE_VALUES_FIELDS, image_values_to_dict
+from core.query import parse_object_query, plan_object_query
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def parse_export_filters(objects=None, created_after=None, created_before=None):
+    """
+    Parse the export filters from their query string or command line form.
+
+    :param objects: object query the images must match (see core.query), e.g. comma-separated tag names
+    :param created_after: ISO 8601 datetime, in the current time zone unless it has an offset; only images created at
+        or after it
+    :param created_before: ISO 8601 datetime, like `created_after`; only images created before it
+    :return: dict of filters for iter_image_export
+    :raises ValueError: if the object query or a datetime is invalid
+    """
+    filters = {"query": parse_object_query(objects) if objects else None}
+    for name, value in [
+        ("created_after", created_after),
+        ("created_before", created_before),
+    ]:
+        if not value:
+            continue
+        parsed_value = parse_datetime(value)
+        if parsed_value is None:
+            raise ValueError(f"{name} must be an ISO 8601 datetime.")
+        if timezone.is_naive(parsed_value):
+            parsed_value = timezone.make_aware(parsed_value)
+        filters[name] = parsed_value
+    return filters
+
+
+def iter_image_export(query=None, created_after=None, created_before=None):
+    """
+    Stream the image catalog as newline-delimited JSON, one Image.to_dict per line. Rows are read in chunks from a
+    single `values()` query, so memory use does not grow with the table size.
+
+    :return: iterator of bytes, one line each
+    """
+    queryset = Image.objects.order_by("id")
+    if query is not None:
+        condition = plan_object_query(query)
+        queryset = (
+            queryset.filter(condition) if condition is not None else queryset.none()
+        )
+    if created_after:
+        queryset = queryset.filter(date_created__gte=created_after)
+    if created_before:
+        queryset = queryset.filter(date_created__lt=created_before)
+
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for row in queryset.values(*IMAGE_VALUES_FIELDS).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    ):
+        yield (encoder.encode(image_values_to_dict(row)) + "\n").encode()
+
+
+def gzip_stream(chunks, batch_size=64 * 1024):
+    """
+    Gzip-compress a stream of bytes, yielding compressed output about every `batch_size` bytes of input.
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    pending = 0
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= batch_size:
+            compressed += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if compressed:
+            yield compressed
+    yield compressor.flush()
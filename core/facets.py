@@ -0,0 +1,40 @@
+from django.db.models import Count
+
+from core.models import Image, ImageTag, Tag
+
+
+def get_tag_facets(image_condition, blacklisted=False, exclude_names=(), limit=10):
+    """
+    Count the tags of the images matching a search, most common first.
+
+    Searches over every image that is not blacklisted are answered from the precomputed Tag.image_count. Otherwise the
+    matching image ids (the planned posting list intersection of core.query) are joined to ImageTag and counted by tag
+    in the database, so no image row is loaded.
+
+    :param image_condition: Q object on Image from core.query.plan_object_query; None when nothing matches
+    :param blacklisted: whether to count the blacklisted images instead of the others
+    :param exclude_names: tag names to leave out, e.g. those searched for
+    :param limit: most tags to return
+    :return: list of (tag name, image count)
+    """
+    if image_condition is None:
+        return []
+    if not image_condition and not blacklisted:
+        return list(
+            Tag.objects.filter(image_count__gt=0)
+            .exclude(name__in=exclude_names)
+            .order_by("-image_count", "name")
+            .values_list("name", "image_count")[:limit]
+        )
+
+    image_tags = ImageTag.objects.filter(blacklisted=blacklisted)
+    if image_condition:
+        image_tags = image_tags.filter(
+            image_id__in=Image.objects.filter(image_condition).values("id")
+        )
+    return list(
+        image_tags.exclude(tag__name__in=exclude_names)
+        .values_list("tag__name")
+        .annotate(image_count=Count("id"))
+        .order_by("-image_count", "tag__name")[:limit]
+    )
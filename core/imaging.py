@@ -0,0 +1,138 @@
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage
+from PIL import ImageOps, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+# EXIF tag holding the camera orientation; images with it set need rotating before they are resized
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Size of the grid compared by get_dhash; 8x8 comparisons give a 64-bit hash
+DHASH_WIDTH = 8
+DHASH_HEIGHT = 8
+
+# Errors Pillow raises for truncated, corrupt or unsupported files
+IMAGE_ERRORS = (UnidentifiedImageError, OSError, SyntaxError, ValueError)
+
+
+def prepare_detection_upload(image_file, max_dimension: int, quality: int):
+    """
+    Prepare a stored image for upload to Imagga: validate it, apply its EXIF orientation, and shrink it to fit
+    within `max_dimension` pixels as a JPEG. Object detection does not need more resolution than that, and a smaller
+    upload is much faster to send. The stored original is left untouched.
+
+    :param image_file: File (e.g. Image.source) to prepare
+    :param max_dimension: largest width or height to upload; 0 uploads the original file after validating it
+    :param quality: JPEG quality of the re-encoded image
+    :return: File to upload, which is `image_file` itself when it needs no changes
+    :raises ValidationError: if the file is not a valid image
+    """
+    data = _read(image_file)
+    try:
+        _verify(data)
+        with PILImage.open(io.BytesIO(data)) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            if not max_dimension or (
+                max(image.size) <= max_dimension
+                and orientation == 1
+                and image.format in ("JPEG", "PNG")
+            ):
+                return image_file
+            content = _resize(image, max_dimension, "JPEG", quality)
+    except IMAGE_ERRORS as e:
+        raise ValidationError(f"Image file is corrupt or not a supported image: {e}")
+
+    name, _ = os.path.splitext(os.path.basename(image_file.name))
+    return ContentFile(content, name=f"{name}.jpg")
+
+
+def resize_image(image_file, max_dimension: int, image_format: str, quality: int):
+    """
+    Render a copy of a stored image that fits within `max_dimension` pixels, with its EXIF orientation applied.
+
+    :param image_file: File (e.g. Image.source) to resize
+    :param max_dimension: largest width or height of the copy; smaller images are not enlarged
+    :param image_format: Pillow format name, e.g. "JPEG" or "WEBP"
+    :param quality: encoder quality
+    :return: bytes of the encoded copy
+    :raises ValidationError: if the file is not a valid image
+    """
+    data = _read(image_file)
+    try:
+        _verify(data)
+        with PILImage.open(io.BytesIO(data)) as image:
+            return _resize(image, max_dimension, image_format, quality)
+    except IMAGE_ERRORS as e:
+        raise ValidationError(f"Image file is corrupt or not a supported image: {e}")
+
+
+def get_dhash(image_file):
+    """
+    Get the 64-bit difference hash (dHash) of a stored image: whether each pixel of a 9x8 grayscale thumbnail is
+    brighter than its right neighbour. It barely changes when the same photo is resized, re-encoded or lightly
+    edited, so the Hamming distance between two hashes measures how alike the images look.
+
+    :param image_file: File (e.g. Image.source) to hash
+    :return: hash as 16 hex digits
+    :raises ValidationError: if the file is not a valid image
+    """
+    data = _read(image_file)
+    try:
+        with PILImage.open(io.BytesIO(data)) as image:
+            # Let JPEG decode at a reduced scale; the hash only needs a tiny thumbnail
+            image.draft("L", (DHASH_WIDTH * 8, DHASH_HEIGHT * 8))
+            image = ImageOps.exif_transpose(image)
+            pixels = list(
+                image.convert("L")
+                .resize((DHASH_WIDTH + 1, DHASH_HEIGHT), PILImage.LANCZOS)
+                .getdata()
+            )
+    except IMAGE_ERRORS as e:
+        raise ValidationError(f"Image file is corrupt or not a supported image: {e}")
+
+    dhash = 0
+    for row in range(DHASH_HEIGHT):
+        for column in range(DHASH_WIDTH):
+            left = pixels[row * (DHASH_WIDTH + 1) + column]
+            right = pixels[row * (DHASH_WIDTH + 1) + column + 1]
+            dhash = (dhash << 1) | (left > right)
+    return f"{dhash:016x}"
+
+
+def _read(image_file):
+    with image_file.open("rb") as f:
+        return f.read()
+
+
+def _verify(data):
+    # verify() checks the file's structure without decoding it, but leaves the image unusable
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.verify()
+
+
+def _resize(image, max_dimension, image_format, quality):
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension), PILImage.LANCZOS)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = _to_rgb(image)
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    output = io.BytesIO()
+    image.save(output, image_format, quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _to_rgb(image):
+    """
+    Flatten transparency onto white, since JPEG has no alpha channel.
+    """
+    if image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+        background = PILImage.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
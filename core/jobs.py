@@ -0,0 +1,170 @@
+from datetime import timedelta
+from logging import Logger
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from core.models import Image, ImageUpload, TaggingJob, UploadStatusType
+from core.resilience import ImaggaUnavailable
+from core.services import process_image_upload
+from core.variants import generate_image_variants
+
+log = Logger(__name__)
+
+
+def enqueue_tagging_job(image: Image):
+    """
+    Queue object detection for the image and mark its ImageUpload as PENDING, creating the ImageUpload if needed.
+
+    :param image: Image object
+    :return: TaggingJob object
+    """
+    with transaction.atomic():
+        if image.image_upload is None:
+            image.image_upload = ImageUpload.objects.create(
+                status=UploadStatusType.PENDING.name
+            )
+            image.save(update_fields=["image_upload"])
+        else:
+            _set_upload_status(image, UploadStatusType.PENDING)
+        return TaggingJob.objects.create(image=image)
+
+
+def enqueue_tagging_jobs(images):
+    """
+    Queue object detection for many new images with one insert per table.
+
+    :param images: list of saved Image objects without an ImageUpload
+    :return: list of TaggingJob objects
+    """
+    if not images:
+        return []
+    with transaction.atomic():
+        image_uploads = ImageUpload.objects.bulk_create(
+            [ImageUpload(status=UploadStatusType.PENDING.name) for _ in images]
+        )
+        for image, image_upload in zip(images, image_uploads):
+            image.image_upload = image_upload
+        Image.objects.bulk_update(images, ["image_upload"])
+        return TaggingJob.objects.bulk_create(
+            [TaggingJob(image=image) for image in images]
+        )
+
+
+def claim_next_tagging_job():
+    """
+    Claim the oldest runnable job. A job is claimed with a conditional UPDATE, so concurrent workers (on any
+    database backend) never run the same job twice; jobs whose worker died are reclaimed once their lock expires.
+
+    :return: TaggingJob object, or None when the queue is empty
+    """
+    now = timezone.now()
+    lock_expired_before = now - timedelta(
+        seconds=settings.TAGGING_JOB_LOCK_TIMEOUT_SECONDS
+    )
+    candidates = (
+        TaggingJob.objects.filter(
+            status=UploadStatusType.PENDING.name, run_after__lte=now
+        )
+        .filter(Q(locked_at__isnull=True) | Q(locked_at__lt=lock_expired_before))
+        .order_by("run_after", "id")
+        .values_list("id", "locked_at")[: settings.TAGGING_WORKER_CLAIM_BATCH_SIZE]
+    )
+    for job_id, locked_at in candidates:
+        claimed = TaggingJob.objects.filter(
+            id=job_id, status=UploadStatusType.PENDING.name, locked_at=locked_at
+        ).update(locked_at=now, attempts=F("attempts") + 1)
+        if claimed:
+            return TaggingJob.objects.select_related(
+                "image", "image__image_upload"
+            ).get(id=job_id)
+    return None
+
+
+def run_tagging_job(job: TaggingJob):
+    """
+    Run object detection for a claimed job and record the outcome on the job and the image's ImageUpload.
+
+    :param job: TaggingJob object claimed by claim_next_tagging_job
+    """
+    image = job.image
+    try:
+        process_image_upload(image)
+    except ImaggaUnavailable as e:
+        # Imagga is throttled or its circuit is open; wait it out without using up an attempt
+        log.info(
+            f"Deferring tagging job {job.id} for image {image.id} by {e.retry_after:.1f}s. {e}"
+        )
+        job.locked_at = None
+        job.attempts -= 1
+        job.run_after = timezone.now() + timedelta(seconds=e.retry_after)
+        job.save(update_fields=["locked_at", "attempts", "run_after"])
+    except ValidationError as e:
+        _finish_tagging_job(job, UploadStatusType.REJECTED, _error_message(e))
+    except Exception as e:
+        if job.attempts < settings.TAGGING_JOB_MAX_ATTEMPTS:
+            log.warn(
+                f"Tagging job {job.id} for image {image.id} failed on attempt {job.attempts}. Retrying. Error: {e}"
+            )
+            job.locked_at = None
+            job.error_message = str(e)
+            job.run_after = timezone.now() + timedelta(
+                seconds=settings.TAGGING_JOB_RETRY_DELAY_SECONDS * job.attempts
+            )
+            job.save(update_fields=["locked_at", "error_message", "run_after"])
+        else:
+            log.warn(
+                f"Tagging job {job.id} for image {image.id} failed after {job.attempts} attempts. Error: {e}"
+            )
+            _finish_tagging_job(job, UploadStatusType.ERROR, str(e))
+    else:
+        _finish_tagging_job(job, UploadStatusType.SUCCESS)
+        if settings.IMAGE_VARIANTS_EAGER:
+            _generate_image_variants(image)
+
+
+def process_next_tagging_job():
+    """
+    Claim and run the next job in the queue.
+
+    :return: True if a job was run, False if the queue was empty
+    """
+    job = claim_next_tagging_job()
+    if job is None:
+        return False
+    run_tagging_job(job)
+    return True
+
+
+def _generate_image_variants(image):
+    # Variants are also generated on first request, so a failure here only costs that request some latency
+    try:
+        generate_image_variants(image)
+    except Exception as e:
+        log.warn(f"Could not generate variants for image {image.id}. Error: {e}")
+
+
+def _finish_tagging_job(job, status: UploadStatusType, error_message=None):
+    job.status = status.name
+    job.locked_at = None
+    job.error_message = error_message
+    job.save(update_fields=["status", "locked_at", "error_message"])
+    _set_upload_status(job.image, status, error_message)
+
+
+def _set_upload_status(image, status: UploadStatusType, error_message=None):
+    if image.image_upload is None:
+        return
+    image.image_upload.status = status.name
+    image.image_upload.error_message = error_message
+    image.image_upload.save(update_fields=["status", "error_message", "date_updated"])
+
+
+def _error_message(validation_error: ValidationError):
+    detail = validation_error.detail
+    if isinstance(detail, list) and len(detail) == 1:
+        return str(detail[0])
+    return str(detail)
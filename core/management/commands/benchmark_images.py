@@ -0,0 +1,160 @@
+import json
+import subprocess
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import (
+    WORKLOADS,
+    compare_results,
+    delete_benchmark_images,
+    run_workload,
+    seed_benchmark_images,
+)
+from core.models import Image, Tag
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the image endpoints of a running app under concurrent load. Start the app with "
+        "QUERY_COUNT_HEADER_ENABLED to record DB queries per request, and point IMAGGA_API_URL at "
+        "`run_imagga_simulator` so the worker never calls Imagga."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", default="http://127.0.0.1:8000", help="URL the app is served at"
+        )
+        parser.add_argument(
+            "--workloads",
+            default=",".join(WORKLOADS),
+            help=f"Comma-separated workloads to run, out of {', '.join(WORKLOADS)}",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Requests per workload"
+        )
+        parser.add_argument(
+            "--seed-images",
+            type=int,
+            default=1000,
+            help="Tagged images to create before running; 0 benchmarks the existing images",
+        )
+        parser.add_argument("--tag-vocabulary", type=int, default=200)
+        parser.add_argument("--tags-per-image", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--username",
+            default="benchmark",
+            help="User to authenticate as; created if it does not exist",
+        )
+        parser.add_argument("--password", default="benchmark")
+        parser.add_argument("--output", help="File to write the results to as JSON")
+        parser.add_argument(
+            "--baseline", help="Results file of an earlier run to compare against"
+        )
+        parser.add_argument(
+            "--keep-data",
+            action="store_true",
+            help="Keep the seeded and created images instead of deleting them",
+        )
+
+    def handle(self, *args, **options):
+        workloads = [name.strip() for name in options["workloads"].split(",")]
+        unknown_workloads = set(workloads) - set(WORKLOADS)
+        if unknown_workloads:
+            raise CommandError(f"Unknown workloads: {', '.join(unknown_workloads)}")
+
+        if not User.objects.filter(username=options["username"]).exists():
+            User.objects.create_user(
+                username=options["username"], password=options["password"]
+            )
+
+        image_ids, tag_names = [], []
+        if options["seed_images"]:
+            image_ids, tag_names = seed_benchmark_images(
+                options["seed_images"],
+                options["tag_vocabulary"],
+                options["tags_per_image"],
+                seed=options["seed"],
+            )
+        else:
+            image_ids = list(Image.objects.values_list("id", flat=True)[:10_000])
+            tag_names = list(Tag.objects.values_list("name", flat=True)[:1_000])
+        if not image_ids and "detail" in workloads:
+            raise CommandError("The detail workload needs images to fetch.")
+        if not tag_names and "search" in workloads:
+            raise CommandError("The search workload needs tagged images.")
+
+        results = {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "commit": _get_git_commit(),
+            "config": {
+                key: options[key]
+                for key in [
+                    "url",
+                    "concurrency",
+                    "requests",
+                    "seed_images",
+                    "tag_vocabulary",
+                    "tags_per_image",
+                    "seed",
+                ]
+            },
+            "workloads": {},
+        }
+        created_ids = []
+        try:
+            for workload in workloads:
+                summary, workload_created_ids = run_workload(
+                    options["url"],
+                    workload,
+                    (options["username"], options["password"]),
+                    image_ids,
+                    tag_names,
+                    options["concurrency"],
+                    options["requests"],
+                    seed=options["seed"],
+                )
+                created_ids += workload_created_ids
+                results["workloads"][workload] = summary
+                self._write_summary(workload, summary)
+        finally:
+            if not options["keep_data"]:
+                delete_benchmark_images(
+                    (image_ids if options["seed_images"] else []) + created_ids,
+                    tag_names if options["seed_images"] else [],
+                )
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                results["comparison"] = compare_results(json.load(f), results)
+            self.stdout.write(json.dumps(results["comparison"], indent=2))
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+    def _write_summary(self, workload, summary):
+        latency = summary["latency_ms"]
+        queries = summary["db_queries_per_request"]
+        self.stdout.write(
+            f"{workload}: {summary['throughput_rps']} req/s, "
+            f"p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+            f"{summary['errors']} error(s), "
+            f"{queries['mean'] if queries else 'n/a'} queries/request"
+        )
+
+
+def _get_git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
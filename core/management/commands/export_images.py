@@ -0,0 +1,52 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.export import gzip_stream, iter_image_export, parse_export_filters
+
+
+class Command(BaseCommand):
+    help = "Export the image catalog as newline-delimited JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            help="File to write the export to. Defaults to stdout",
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="Gzip-compress the export",
+        )
+        parser.add_argument(
+            "--objects",
+            help="Only export images matching this object query, e.g. 'dog,cat' or 'dog AND NOT indoor'",
+        )
+        parser.add_argument(
+            "--created-after",
+            help="Only export images created at or after this ISO 8601 datetime",
+        )
+        parser.add_argument(
+            "--created-before",
+            help="Only export images created before this ISO 8601 datetime",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters(
+                objects=options["objects"],
+                created_after=options["created_after"],
+                created_before=options["created_before"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = iter_image_export(**filters)
+        if options["gzip"]:
+            chunks = gzip_stream(chunks)
+
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                output.writelines(chunks)
+        else:
+            sys.stdout.buffer.writelines(chunks)
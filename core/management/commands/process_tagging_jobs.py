@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core.jobs import process_next_tagging_job
+
+
+class Command(BaseCommand):
+    help = "Run object detection for images queued by POST /images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new jobs",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.TAGGING_WORKER_POLL_INTERVAL_SECONDS,
+            help="Seconds to wait before polling an empty queue again",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of jobs to run at the same time, each on its own thread",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        concurrency = max(options["concurrency"], 1)
+        if concurrency == 1:
+            processed = self._work(stop, options)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=concurrency, thread_name_prefix="tagging-worker"
+            ) as executor:
+                workers = [
+                    executor.submit(self._work_on_thread, stop, options)
+                    for _ in range(concurrency)
+                ]
+                try:
+                    processed = sum(worker.result() for worker in workers)
+                except KeyboardInterrupt:
+                    stop.set()
+                    processed = sum(worker.result() for worker in workers)
+        self.stdout.write(f"Processed {processed} tagging job(s).")
+
+    def _work(self, stop, options):
+        processed = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                if process_next_tagging_job():
+                    processed += 1
+                elif options["once"]:
+                    break
+                else:
+                    stop.wait(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        return processed
+
+    def _work_on_thread(self, stop, options):
+        try:
+            return self._work(stop, options)
+        finally:
+            connections.close_all()
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+
+from core.simulator import ImaggaSimulator, build_simulator_server
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Imagga API; set IMAGGA_API_URL to http://<host>:<port>/v2/ to use it"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--latency-median-ms",
+            type=float,
+            default=200.0,
+            help="Median latency of a call, in milliseconds",
+        )
+        parser.add_argument(
+            "--latency-sigma",
+            type=float,
+            default=0.5,
+            help="Sigma of the log-normal latency distribution; larger values give a longer tail",
+        )
+        parser.add_argument(
+            "--upload-latency-median-ms",
+            type=float,
+            help="Median latency of an upload, in milliseconds. Defaults to --latency-median-ms",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of calls that fail with 503",
+        )
+        parser.add_argument(
+            "--rate-limit-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of calls that fail with 429",
+        )
+        parser.add_argument(
+            "--nsfw-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of images the NSFW categorizer flags",
+        )
+        parser.add_argument(
+            "--tag-count",
+            type=int,
+            default=5,
+            help="Most tags returned per image",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Seed for latency and error sampling, to replay a run",
+        )
+
+    def handle(self, *args, **options):
+        simulator = ImaggaSimulator(
+            latency_median_ms=options["latency_median_ms"],
+            latency_sigma=options["latency_sigma"],
+            upload_latency_median_ms=options["upload_latency_median_ms"],
+            error_rate=options["error_rate"],
+            rate_limit_rate=options["rate_limit_rate"],
+            nsfw_rate=options["nsfw_rate"],
+            tag_count=options["tag_count"],
+            seed=options["seed"],
+        )
+        server = build_simulator_server(simulator, options["host"], options["port"])
+        self.stdout.write(
+            f"Imagga simulator listening on http://{options['host']}:{server.server_port}/v2/"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Handled {simulator.stats()['requests']} request(s).")
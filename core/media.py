@@ -0,0 +1,128 @@
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+# Stored files are never overwritten (Django picks a new name instead) and variants are named by content hash, so a
+# URL always refers to the same bytes. They are private to authenticated users, so shared caches must not keep them.
+CACHE_CONTROL = "private, max-age={max_age}, immutable"
+
+
+def serve_file(request, path, content_type=None, accel_redirect_url=None):
+    """
+    Serve a file with caching headers, answering conditional and Range requests. When MEDIA_SENDFILE_BACKEND is set,
+    the transfer is handed to the front proxy instead of streaming through Python.
+
+    :param request: request for the file, already authorized
+    :param path: absolute path of the file
+    :param content_type: content type; guessed from the file name if not given
+    :param accel_redirect_url: internal proxy URL of the file, used with the "x-accel-redirect" backend
+    :return: HttpResponse (200, 206, 304, 412 or 416)
+    """
+    stat = os.stat(path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    last_modified = int(stat.st_mtime)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Cache-Control": CACHE_CONTROL.format(
+            max_age=settings.MEDIA_CACHE_MAX_AGE_SECONDS
+        ),
+    }
+
+    conditional_response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if conditional_response is not None:
+        _set_headers(conditional_response, headers)
+        return conditional_response
+
+    content_type = (
+        content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    if backend == "x-sendfile":
+        # The proxy answers Range requests itself
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+        return _set_headers(response, headers)
+    if backend == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = accel_redirect_url
+        return _set_headers(response, headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    byte_range = _get_byte_range(request, etag, stat.st_size)
+    if byte_range is None:
+        response = StreamingHttpResponse(
+            _read_file(path, 0, stat.st_size), content_type=content_type
+        )
+        response["Content-Length"] = stat.st_size
+    elif byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_file(path, start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = end - start + 1
+    return _set_headers(response, headers)
+
+
+def _get_byte_range(request, etag, size):
+    """
+    Parse a single-range Range header. Multiple ranges are answered with the whole file, which RFC 9110 allows.
+
+    :return: (start, end) inclusive, None to send the whole file, or False if the range cannot be satisfied
+    """
+    range_header = request.headers.get("Range")
+    if not range_header:
+        return None
+    if_range = request.headers.get("If-Range")
+    if if_range and if_range != etag:
+        return None
+    match = RANGE_RE.match(range_header.strip())
+    if not match or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last `last` bytes
+        if int(last) == 0 or size == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # Invalid rather than unsatisfiable, so the header is ignored (RFC 9110, section 14.1.1)
+        return None
+    if start >= size:
+        return False
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _read_file(path, start, length):
+    # The file is closed when the response closes the generator
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _set_headers(response, headers):
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,240 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from fast DB reads up to slow Imagga uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsRegistry:
+    """
+    Class to hold the metrics of this process and render them in the Prometheus text exposition format.
+
+    Each process (e.g. the web server and the tagging worker) keeps its own values, so scrape every process.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render_samples())
+        return "\n".join(lines) + "\n"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or metrics_registry).register(self)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        """
+        Get the child metric for a set of label values, creating it on first use.
+        """
+        if labelkwargs:
+            labelvalues = tuple(str(labelkwargs[name]) for name in self.labelnames)
+        else:
+            labelvalues = tuple(str(value) for value in labelvalues)
+        child = self._children.get(labelvalues)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def render_samples(self):
+        with self._lock:
+            children = sorted(self._children.items())
+        lines = []
+        for labelvalues, child in children:
+            labels = dict(zip(self.labelnames, labelvalues))
+            for suffix, extra_labels, value in child.samples():
+                lines.append(
+                    f"{self.name}{suffix}{_format_labels({**labels, **extra_labels})} {_format_value(value)}"
+                )
+        return lines
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def samples(self):
+        return [("_total", {}, self._value)]
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = float(value)
+
+    @contextmanager
+    def track_in_progress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self):
+        return [("", {}, self._value)]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        samples = []
+        cumulative = 0
+        for upper_bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append(("_bucket", {"le": _format_value(upper_bound)}, cumulative))
+        samples.append(("_sum", {}, total))
+        samples.append(("_count", {}, cumulative))
+        return samples
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+        + "}"
+    )
+
+
+def _escape(label_value):
+    return label_value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics_registry = MetricsRegistry()
+
+http_request_duration = Histogram(
+    "imagesearch_http_request_duration_seconds",
+    "Time to handle an HTTP request, by view, method and status code",
+    ["view", "method", "status"],
+)
+http_requests_in_flight = Gauge(
+    "imagesearch_http_requests_in_flight", "HTTP requests being handled"
+)
+imagga_request_duration = Histogram(
+    "imagesearch_imagga_request_duration_seconds",
+    "Time of a single call (attempt) to Imagga, by endpoint and status code",
+    ["endpoint", "status"],
+)
+imagga_requests_in_flight = Gauge(
+    "imagesearch_imagga_requests_in_flight", "Calls to Imagga waiting for a response"
+)
+imagga_response_cache = Counter(
+    "imagesearch_imagga_response_cache",
+    "Lookups in the Imagga response cache, by endpoint and result (hit or miss)",
+    ["endpoint", "result"],
+)
+image_result_cache = Counter(
+    "imagesearch_image_result_cache",
+    "Lookups in the GET /images result cache, by result (hit or miss)",
+    ["result"],
+)
+image_processing_stage_duration = Histogram(
+    "imagesearch_image_processing_stage_duration_seconds",
+    "Time spent in each stage of object detection for an image",
+    ["stage"],
+)
+image_processing = Counter(
+    "imagesearch_image_processing",
+    "Images run through object detection, by outcome",
+    ["outcome"],
+)
+imagga_circuit_state = Gauge(
+    "imagesearch_imagga_circuit_state",
+    "State of the Imagga circuit breaker as last seen by this process: 0 closed, 1 half open, 2 open",
+    ["name"],
+)
+imagga_rejected_calls = Counter(
+    "imagesearch_imagga_rejected_calls",
+    "Calls to Imagga not made, by reason (circuit_open or rate_limited)",
+    ["reason"],
+)
@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from core.metrics import http_request_duration, http_requests_in_flight
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+
+
+class QueryCountMiddleware:
+    """
+    Class to report how many database queries each request ran in an `X-DB-Query-Count` response header, for the
+    benchmark command. Only loaded when QUERY_COUNT_HEADER_ENABLED is set, so it costs nothing otherwise.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_COUNT_HEADER_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            response = self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(query_count)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Class to record the latency of each request by view name, method and status code, and the requests in flight.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.in_flight = http_requests_in_flight.labels()
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with self.in_flight.track_in_progress():
+            response = self.get_response(request)
+        view = (
+            request.resolver_match.view_name if request.resolver_match else "unmatched"
+        )
+        http_request_duration.labels(
+            view, request.method, response.status_code
+        ).observe(time.perf_counter() - started)
+        return response
@@ -0,0 +1,88 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_image_tags(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+    Tag = apps.get_model("core", "Tag")
+    ImageTag = apps.get_model("core", "ImageTag")
+
+    tag_ids = {}
+    images = Image.objects.exclude(detected_objects__isnull=True).values_list(
+        "id", "detected_objects"
+    )
+    for image_id, detected_objects in images.iterator(chunk_size=2000):
+        if isinstance(detected_objects, str):
+            detected_objects = detected_objects.split(",")
+        names = {str(name).strip().lower() for name in detected_objects or []}
+        names.discard("")
+        for name in names - tag_ids.keys():
+            tag_ids[name] = Tag.objects.get_or_create(name=name)[0].id
+        ImageTag.objects.bulk_create(
+            [ImageTag(image_id=image_id, tag_id=tag_ids[name]) for name in names],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_appconfig_featureflag"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ImageTag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_tags",
+                        to="core.image",
+                    ),
+                ),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_tags",
+                        to="core.tag",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="imagetag",
+            constraint=models.UniqueConstraint(
+                fields=("tag", "image"), name="unique_tag_image"
+            ),
+        ),
+        migrations.RunPython(backfill_image_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:02
+
+import core.models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def normalize_upload_statuses(apps, schema_editor):
+    # Rows were written with the Imagga status value ("success") or the enum's str() by the old default
+    ImageUpload = apps.get_model("core", "ImageUpload")
+    for status in core.models.UploadStatusType:
+        ImageUpload.objects.filter(status__in=[status.value, str(status)]).update(
+            status=status.name
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_tag_imagetag"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="imageupload",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("SUCCESS", "success"),
+                    ("ERROR", "error"),
+                    ("PENDING", "pending"),
+                    ("REJECTED", "rejected"),
+                ],
+                default="PENDING",
+                max_length=15,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="imageupload",
+            name="upload_id",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.CreateModel(
+            name="TaggingJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("SUCCESS", "success"),
+                            ("ERROR", "error"),
+                            ("PENDING", "pending"),
+                            ("REJECTED", "rejected"),
+                        ],
+                        default="PENDING",
+                        max_length=15,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("run_after", models.DateTimeField(default=django.utils.timezone.now)),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("error_message", models.TextField(blank=True, null=True)),
+                ("date_created", models.DateTimeField(auto_now_add=True)),
+                ("date_updated", models.DateTimeField(auto_now=True)),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tagging_jobs",
+                        to="core.image",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "run_after"], name="tagging_job_queue_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(normalize_upload_statuses, migrations.RunPython.noop),
+    ]
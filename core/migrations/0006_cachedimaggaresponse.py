@@ -0,0 +1,40 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_image_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedImaggaResponse",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("endpoint", models.CharField(max_length=200)),
+                ("image_url", models.TextField()),
+                ("response", models.JSONField()),
+                ("hit_count", models.PositiveIntegerField(default=0)),
+                ("date_created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "last_accessed",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+        ),
+    ]
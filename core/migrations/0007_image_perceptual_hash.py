@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_cachedimaggaresponse"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="perceptual_hash",
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+        migrations.CreateModel(
+            name="ImageHashBand",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("band", models.PositiveSmallIntegerField()),
+                ("value", models.PositiveIntegerField()),
+                (
+                    "image",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hash_bands",
+                        to="core.image",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["band", "value"], name="image_hash_band_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:25
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_image_perceptual_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CircuitBreakerState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("CLOSED", "closed"),
+                            ("OPEN", "open"),
+                            ("HALF_OPEN", "half open"),
+                        ],
+                        default="CLOSED",
+                        max_length=15,
+                    ),
+                ),
+                ("consecutive_failures", models.PositiveIntegerField(default=0)),
+                ("opened_at", models.DateTimeField(blank=True, null=True)),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TokenBucketState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("tokens", models.FloatField()),
+                (
+                    "refilled_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
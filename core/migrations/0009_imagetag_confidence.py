@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_imagga_rate_limit_and_circuit_breaker"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imagetag",
+            name="confidence",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name="imagetag",
+            index=models.Index(
+                fields=["tag", "-confidence", "image"], name="image_tag_confidence_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_tag_images(apps, schema_editor):
+    Tag = apps.get_model("core", "Tag")
+    ImageTag = apps.get_model("core", "ImageTag")
+    Tag.objects.update(
+        image_count=Coalesce(
+            Subquery(
+                ImageTag.objects.filter(tag_id=OuterRef("id"))
+                .values("tag_id")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_imagetag_confidence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tag",
+            name="image_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_tag_images, migrations.RunPython.noop),
+    ]
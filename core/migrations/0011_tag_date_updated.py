@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_tag_image_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tag",
+            name="date_updated",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def copy_blacklisted_and_recount_tags(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+    ImageTag = apps.get_model("core", "ImageTag")
+    Tag = apps.get_model("core", "Tag")
+    ImageTag.objects.filter(
+        image_id__in=Image.objects.filter(blacklisted=True).values("id")
+    ).update(blacklisted=True)
+    # Tag.image_count now leaves out blacklisted images
+    Tag.objects.update(
+        image_count=Coalesce(
+            Subquery(
+                ImageTag.objects.filter(tag_id=OuterRef("id"), blacklisted=False)
+                .values("tag_id")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        ),
+        date_updated=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_tag_date_updated"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imagetag",
+            name="blacklisted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(
+            copy_blacklisted_and_recount_tags, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+def create_images_generation(apps, schema_editor):
+    CacheGeneration = apps.get_model("core", "CacheGeneration")
+    CacheGeneration.objects.get_or_create(name="images")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_imagetag_blacklisted"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CacheGeneration",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("value", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_images_generation, migrations.RunPython.noop),
+    ]
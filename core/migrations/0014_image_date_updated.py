@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0013_cache_generation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="date_updated",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from enum import Enum
+from django.conf import settings
 from django.db import models
+from django.urls import reverse
+from django.utils import timezone
 from django.core.validators import FileExtensionValidator
 
 
@@ -15,6 +18,34 @@ class UploadStatusType(Enum):
     REJECTED = "rejected"  # Image is blacklisted and therefore not persisted
 
 
+def get_variant_urls(image_id, has_source, request=None):
+    """
+    Get the URLs of every resized variant of an image (see core.variants), as `{size: {format: url}}`.
+
+    :param image_id: id of the Image
+    :param has_source: whether the image has an uploaded file; images only known by URL have no variants
+    :param request: request used to build absolute URLs
+    :return: dict of URLs, or None if the image has no variants
+    """
+    if not has_source:
+        return None
+    variant_urls = {}
+    for size in settings.IMAGE_VARIANT_SIZES:
+        variant_urls[size] = {}
+        for image_format in settings.IMAGE_VARIANT_FORMATS:
+            url = reverse("image-variant", args=[image_id, size, image_format])
+            variant_urls[size][image_format] = (
+                request.build_absolute_uri(url) if request is not None else url
+            )
+    return variant_urls
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"  # Calls fail fast until the reset timeout passes
+    HALF_OPEN = "half open"  # A single probe call decides whether to close or reopen
+
+
 class Image(models.Model):
     label = models.CharField(max_length=100, null=True, blank=True)
     image_upload = models.ForeignKey(
@@ -31,7 +62,13 @@ class Image(models.Model):
         blank=True,
         validators=[FileExtensionValidator(["jpg", "jpeg", "png"])],
     )
+    # SHA-256 of the uploaded file; not unique, as the same file can be uploaded by several users or with other labels
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # 64-bit dHash as 16 hex digits; close for the same photo resized or re-encoded (see core.duplicates)
+    perceptual_hash = models.CharField(max_length=16, null=True, blank=True)
     date_created = models.DateTimeField(auto_now_add=True)
+    # Stamped by every save, and used in the ETag and Last-Modified of GET /images/{id}; QuerySet.update() skips it
+    date_updated = models.DateTimeField(auto_now=True)
     detected_objects = models.JSONField(null=True, blank=True)
     uploaded_by = models.ForeignKey(
         "auth.User", on_delete=models.CASCADE, null=True, blank=True
@@ -49,29 +86,97 @@ Image: {self.label}
         return {
             "id": self.id,
             "label": self.label,
-            "image_upload_id": self.image_upload.id if self.image_upload else None,
+            # Read the foreign key columns directly so no related row is fetched for them
+            "image_upload_id": self.image_upload_id,
             "source_type": self.get_source_type_display(),  # Gets the human-readable name for the Enum choice
             "source_url": self.source_url,
             "source": (self.source.url if self.source else None),
+            "variants": get_variant_urls(self.id, bool(self.source)),
             "date_created": self.date_created.isoformat(),  # Convert datetime to ISO format string
             "detected_objects": self.detected_objects,
-            "uploaded_by_id": self.uploaded_by.id if self.uploaded_by else None,
+            "uploaded_by_id": self.uploaded_by_id,
             "uploaded_by_username": (
                 self.uploaded_by.username if self.uploaded_by else None
             ),
             "blacklisted": self.blacklisted,
+            "image_upload_status": (
+                self.image_upload.get_status_display() if self.image_upload else None
+            ),
         }
 
 
+class Tag(models.Model):
+    """
+    Class to dictionary-encode the object names detected in images, so searches can match on integer ids
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    # Number of images that are not blacklisted indexed with the tag, used by core.query to plan searches rarest tag
+    # first and as the facet counts of unfiltered searches. Kept in step by services.index_image_tags and
+    # services.sync_image_tags_blacklisted, and decremented when ImageTag rows are deleted (see core.signals).
+    image_count = models.IntegerField(default=0)
+    # Also set by the queryset updates of image_count, so core.autocomplete can reload only the changed tags
+    date_updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ImageTag(models.Model):
+    """
+    Class to index which tags were detected in which images; kept in sync with Image.detected_objects
+    """
+
+    image = models.ForeignKey(
+        "Image", on_delete=models.CASCADE, related_name="image_tags"
+    )
+    tag = models.ForeignKey("Tag", on_delete=models.CASCADE, related_name="image_tags")
+    # Imagga's confidence (0-100) that the tag is in the image; 0 when unknown (e.g. objects sent by the client)
+    confidence = models.FloatField(default=0.0)
+    # Copy of Image.blacklisted, so searches and facets can leave out blacklisted images without joining Image
+    blacklisted = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Leading with tag lets `?objects=` lookups resolve from the index alone
+            models.UniqueConstraint(fields=["tag", "image"], name="unique_tag_image"),
+        ]
+        indexes = [
+            # Each tag's images, most confident first: the sorted lists read by the `?objects=` relevance ranking
+            models.Index(
+                fields=["tag", "-confidence", "image"], name="image_tag_confidence_idx"
+            ),
+        ]
+
+
+class ImageHashBand(models.Model):
+    """
+    Class to index 16-bit slices of each image's perceptual hash, so near-duplicates can be looked up by exact
+    matches on a slice (multi-index hashing) instead of comparing against every image
+    """
+
+    image = models.ForeignKey(
+        "Image", on_delete=models.CASCADE, related_name="hash_bands"
+    )
+    band = models.PositiveSmallIntegerField()
+    value = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["band", "value"], name="image_hash_band_idx"),
+        ]
+
+
 class ImageUpload(models.Model):
     """
-    Class to track the Image Upload, since Imagga has a 24 hr TTL for the uploaded image
+    Class to track the Image Upload, since Imagga has a 24 hr TTL for the uploaded image.
+    Its status follows the image's object detection from PENDING to SUCCESS, REJECTED or ERROR.
     """
 
-    upload_id = models.CharField(max_length=100)
+    upload_id = models.CharField(max_length=100, blank=True)
     status = models.CharField(
         choices=[(tag.name, tag.value) for tag in UploadStatusType],
-        default=UploadStatusType.PENDING,
+        default=UploadStatusType.PENDING.name,
         max_length=15,
     )
     error_message = models.TextField(null=True, blank=True)
@@ -79,6 +184,101 @@ class ImageUpload(models.Model):
     date_updated = models.DateTimeField(auto_now=True)
 
 
+class TaggingJob(models.Model):
+    """
+    Class to queue object detection for an Image, so it runs in the `process_tagging_jobs` worker instead of the request
+    """
+
+    image = models.ForeignKey(
+        "Image", on_delete=models.CASCADE, related_name="tagging_jobs"
+    )
+    status = models.CharField(
+        choices=[(tag.name, tag.value) for tag in UploadStatusType],
+        default=UploadStatusType.PENDING.name,
+        max_length=15,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="tagging_job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"Image: {self.image_id} -- Status: {self.status} -- Attempts: {self.attempts}"
+
+
+class CachedImaggaResponse(models.Model):
+    """
+    Class to cache Imagga responses for image URLs, so a URL tagged recently is not sent to Imagga again
+    """
+
+    # SHA-256 of the endpoint, categorizer id and normalized image URL
+    key = models.CharField(max_length=64, unique=True)
+    endpoint = models.CharField(max_length=200)
+    image_url = models.TextField()
+    response = models.JSONField()
+    hit_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"Endpoint: {self.endpoint} -- Image Url: {self.image_url} -- Hits: {self.hit_count}"
+
+
+class TokenBucketState(models.Model):
+    """
+    Class to share a token bucket rate limit between processes (see core.resilience). Rows are updated with a
+    compare-and-set on `version`.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    refilled_at = models.DateTimeField(default=timezone.now)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Name: {self.name} -- Tokens: {self.tokens}"
+
+
+class CircuitBreakerState(models.Model):
+    """
+    Class to share a circuit breaker between processes (see core.resilience). Rows are updated with a
+    compare-and-set on `version`.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    state = models.CharField(
+        choices=[(tag.name, tag.value) for tag in CircuitState],
+        default=CircuitState.CLOSED.name,
+        max_length=15,
+    )
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Name: {self.name} -- State: {self.state} -- Failures: {self.consecutive_failures}"
+
+
+class CacheGeneration(models.Model):
+    """
+    Class to count the writes to a set of tables, so per-process caches of what was read from them know when their
+    entries are stale (see core.result_cache)
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Name: {self.name} -- Generation: {self.value}"
+
+
 class AppConfig(models.Model):
     """
     Class to store the AppConfig for the application
@@ -0,0 +1,61 @@
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Keyset pagination for images. Pages are fetched with `WHERE id > <cursor> ORDER BY id LIMIT <page size + 1>`,
+    so a deep page costs the same as the first one and no `COUNT(*)` is run.
+
+    `id` is unique and assigned in insertion order, so it gives the same order as `(date_created, id)` while keeping
+    the cursor a single indexed column (DRF falls back to an offset for ties on the first ordering field).
+    """
+
+    ordering = "id"
+    page_size = settings.IMAGE_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.IMAGE_MAX_PAGE_SIZE
+
+
+class ImageRelevancePagination(ImageCursorPagination):
+    """
+    Pagination for images ranked by relevance. The cursor holds the score and id of the last image of the page, where
+    the next page starts reading each tag's images by confidence (see `core.search.rank_images_by_tags`); pages can
+    only be followed forwards.
+    """
+
+    def paginate_ranking(self, rank, request):
+        """
+        :param rank: callable taking `limit` and `after`, as `core.search.rank_images_by_tags`
+        :param request: Request object
+        :return: list of (image id, score) of the page
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        after = None
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            try:
+                score, image_id = cursor.position.split(":")
+                after = (float(score), int(image_id))
+            except (AttributeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = rank(limit=self.page_size + 1, after=after)
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        image_id, score = self.page[-1]
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=f"{score!r}:{image_id}")
+        )
+
+    def get_previous_link(self):
+        return None
@@ -0,0 +1,382 @@
+import json
+import re
+from dataclasses import dataclass
+
+from django.db.models import Exists, OuterRef, Q
+
+from core.models import ImageTag, Tag
+
+# Bounds on a single `?objects=` query, so it compiles to a reasonably sized SQL statement
+QUERY_MAX_TERMS = 20
+QUERY_MAX_DEPTH = 8
+
+OPERATORS = ("AND", "OR", "NOT")
+
+_TOKEN_RE = re.compile(r'\s*(?:([(),])|"([^"]*)"|([^\s(),"]+))')
+
+
+class QuerySyntaxError(ValueError):
+    """
+    Raised when an object query cannot be parsed
+    """
+
+
+@dataclass(frozen=True)
+class Term:
+    name: str
+
+
+@dataclass(frozen=True)
+class And:
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Or:
+    children: tuple
+
+
+@dataclass(frozen=True)
+class Not:
+    child: object
+
+
+def parse_object_query(text):
+    """
+    Parse an object query: tag names combined with AND, OR, NOT and parentheses. A comma is the same as AND, so
+    `dog,cat` still means both, and words not separated by an operator form a single tag name, e.g.
+    `golden retriever AND NOT indoor`. Tag names can also be quoted, e.g. `"and"`. Operators must be uppercase.
+
+    :param text: query string
+    :return: query tree of Term, And, Or and Not nodes, or None if the query is empty
+    :raises QuerySyntaxError: if the query is invalid
+    """
+    tokens = _tokenize(text)
+    if not tokens:
+        return None
+    parser = _Parser(tokens)
+    query = parser.parse()
+    if parser.term_count > QUERY_MAX_TERMS:
+        raise QuerySyntaxError(f"Queries can have at most {QUERY_MAX_TERMS} objects.")
+    return query
+
+
+def get_conjunction_terms(query):
+    """
+    Get the tag names of a query that only ANDs tag names together, the queries that can be ranked by relevance.
+
+    :return: list of tag names, or None if the query uses OR or NOT
+    """
+    if isinstance(query, Term):
+        return [query.name]
+    if isinstance(query, And) and all(
+        isinstance(child, Term) for child in query.children
+    ):
+        return [child.name for child in query.children]
+    return None
+
+
+def get_canonical_query(query):
+    """
+    Write a query tree the same way whatever the order of its ANDed and ORed operands, e.g. for cache keys.
+
+    :param query: query tree from parse_object_query, or None
+    :return: string
+    """
+    if query is None:
+        return ""
+    if isinstance(query, Term):
+        return json.dumps(query.name)
+    if isinstance(query, Not):
+        return f"NOT {get_canonical_query(query.child)}"
+    operator = "AND" if isinstance(query, And) else "OR"
+    operands = sorted(get_canonical_query(child) for child in query.children)
+    return f"{operator}({','.join(operands)})"
+
+
+def plan_object_query(query, min_confidence=0.0):
+    """
+    Compile a query tree into a filter on Image ids, ordered using how many images each tag was detected in
+    (Tag.image_count). Within an AND the rarest positive operand is the driving posting list (`id IN (...)` over its
+    ImageTag rows) and the others are ordered rarest first and checked with `EXISTS`/`NOT EXISTS` probes against the
+    unique (tag, image) index, so a query like `dog AND NOT indoor` never reads the rows of a common tag. A tag that
+    has never been detected matches nothing, and the parts of the query it decides are dropped.
+
+    :param query: query tree from parse_object_query
+    :param min_confidence: lowest confidence a tag must have been detected with to count as detected
+    :return: Q object for Image querysets, or None if nothing can match
+    """
+    names = get_term_names(query)
+    tag_stats = {
+        name: (tag_id, image_count)
+        for name, tag_id, image_count in Tag.objects.filter(name__in=names).values_list(
+            "name", "id", "image_count"
+        )
+    }
+    plan = _simplify(query, tag_stats)
+    if plan is _MATCH_NONE:
+        return None
+    if plan is _MATCH_ALL:
+        return Q()
+    return _Compiler(tag_stats, min_confidence).driver(plan)
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match:
+            raise QuerySyntaxError(f"Unexpected character at position {position}.")
+        punctuation, quoted, word = match.groups()
+        if punctuation:
+            tokens.append(("AND", None) if punctuation == "," else (punctuation, None))
+        elif quoted is not None:
+            tokens.append(("TERM", quoted.strip().lower()))
+        elif word in OPERATORS:
+            tokens.append((word, None))
+        else:
+            tokens.append(("WORD", word.lower()))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Class to parse query tokens by recursive descent, with NOT binding tighter than AND, and AND tighter than OR
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+        self.term_count = 0
+
+    def parse(self):
+        query = self._parse_or()
+        if self.position < len(self.tokens):
+            raise QuerySyntaxError(f"Unexpected {self._describe(self._peek())}.")
+        return query
+
+    def _peek(self):
+        return (
+            self.tokens[self.position][0] if self.position < len(self.tokens) else None
+        )
+
+    def _parse_or(self):
+        children = [self._parse_and()]
+        while self._peek() == "OR":
+            self.position += 1
+            children.append(self._parse_and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _parse_and(self):
+        children = [self._parse_not()]
+        while self._peek() == "AND":
+            self.position += 1
+            children.append(self._parse_not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _parse_not(self):
+        if self._peek() == "NOT":
+            self.position += 1
+            self._enter()
+            query = Not(self._parse_not())
+            self.depth -= 1
+            return query
+        return self._parse_operand()
+
+    def _parse_operand(self):
+        kind = self._peek()
+        if kind == "(":
+            self.position += 1
+            self._enter()
+            query = self._parse_or()
+            if self._peek() != ")":
+                raise QuerySyntaxError("Missing closing parenthesis.")
+            self.position += 1
+            self.depth -= 1
+            return query
+        if kind == "TERM":
+            name = self.tokens[self.position][1]
+            self.position += 1
+        elif kind == "WORD":
+            words = []
+            while self._peek() == "WORD":
+                words.append(self.tokens[self.position][1])
+                self.position += 1
+            name = " ".join(words)
+        else:
+            raise QuerySyntaxError(
+                f"Expected an object name but found {self._describe(kind)}."
+            )
+        if not name:
+            raise QuerySyntaxError("Object names cannot be empty.")
+        self.term_count += 1
+        return Term(name)
+
+    def _enter(self):
+        self.depth += 1
+        if self.depth > QUERY_MAX_DEPTH:
+            raise QuerySyntaxError(
+                f"Queries can nest parentheses and NOTs at most {QUERY_MAX_DEPTH} deep."
+            )
+
+    def _describe(self, kind):
+        if kind is None:
+            return "the end of the query"
+        if kind in ("TERM", "WORD"):
+            return f'"{self.tokens[self.position][1]}"'
+        return f'"{kind}"'
+
+
+# Results of simplifying a query part that does not depend on any image
+_MATCH_ALL = object()
+_MATCH_NONE = object()
+
+
+def get_term_names(query):
+    """
+    Get every tag name a query mentions, negated or not.
+
+    :return: set of tag names
+    """
+    if isinstance(query, Term):
+        return {query.name}
+    if isinstance(query, Not):
+        return get_term_names(query.child)
+    return set().union(*(get_term_names(child) for child in query.children))
+
+
+def _simplify(query, tag_stats):
+    """
+    Fold away the tags that were never detected, and flatten nested ANDs and ORs.
+    """
+    if isinstance(query, Term):
+        return query if query.name in tag_stats else _MATCH_NONE
+    if isinstance(query, Not):
+        child = _simplify(query.child, tag_stats)
+        if child is _MATCH_ALL:
+            return _MATCH_NONE
+        if child is _MATCH_NONE:
+            return _MATCH_ALL
+        return child.child if isinstance(child, Not) else Not(child)
+
+    node_type = type(query)
+    absorbing, identity = (
+        (_MATCH_NONE, _MATCH_ALL) if node_type is And else (_MATCH_ALL, _MATCH_NONE)
+    )
+    children = []
+    for child in query.children:
+        child = _simplify(child, tag_stats)
+        if child is absorbing:
+            return absorbing
+        if child is identity:
+            continue
+        if isinstance(child, node_type):
+            children.extend(child.children)
+        elif child not in children:
+            children.append(child)
+    if not children:
+        return identity
+    return children[0] if len(children) == 1 else node_type(tuple(children))
+
+
+def _estimate(query, tag_stats):
+    """
+    Estimate how many images a query part matches, or None when it is unbounded (a NOT matches most images).
+    """
+    if isinstance(query, Term):
+        return tag_stats[query.name][1]
+    if isinstance(query, Not):
+        return None
+    estimates = [_estimate(child, tag_stats) for child in query.children]
+    if isinstance(query, And):
+        bounded = [estimate for estimate in estimates if estimate is not None]
+        return min(bounded) if bounded else None
+    return None if None in estimates else sum(estimates)
+
+
+class _Compiler:
+    """
+    Class to compile a simplified query tree into Q objects on Image ids
+    """
+
+    def __init__(self, tag_stats, min_confidence):
+        self.tag_stats = tag_stats
+        self.min_confidence = min_confidence
+
+    def _image_tags(self, query):
+        """
+        ImageTag rows of a Term, or of an OR of Terms as a single posting list union.
+        """
+        names = (
+            [query.name]
+            if isinstance(query, Term)
+            else [child.name for child in query.children]
+        )
+        image_tags = ImageTag.objects.filter(
+            tag_id__in=[self.tag_stats[name][0] for name in names]
+        )
+        if self.min_confidence:
+            image_tags = image_tags.filter(confidence__gte=self.min_confidence)
+        return image_tags
+
+    def _is_tag_union(self, query):
+        return isinstance(query, Term) or (
+            isinstance(query, Or)
+            and all(isinstance(child, Term) for child in query.children)
+        )
+
+    def _ordered(self, children):
+        # Rarest first; unbounded parts (NOTs) last, as they filter out the fewest images
+        return sorted(
+            children,
+            key=lambda child: (
+                (0, estimate)
+                if (estimate := _estimate(child, self.tag_stats)) is not None
+                else (1, 0)
+            ),
+        )
+
+    def driver(self, query):
+        """
+        Compile a query part so the database reads its matching images from the tag index.
+        """
+        if self._is_tag_union(query):
+            return Q(id__in=self._image_tags(query).values("image_id"))
+        if isinstance(query, Or):
+            condition = Q()
+            for child in query.children:
+                condition |= self.driver(child)
+            return condition
+        if isinstance(query, And):
+            children = self._ordered(query.children)
+            if _estimate(children[0], self.tag_stats) is None:
+                return self.probe(query)
+            condition = self.driver(children[0])
+            for child in children[1:]:
+                condition &= self.probe(child)
+            return condition
+        return self.probe(query)
+
+    def probe(self, query):
+        """
+        Compile a query part into a check of a single image, resolved by lookups on the (tag, image) index.
+        """
+        if self._is_tag_union(query):
+            return Q(Exists(self._image_tags(query).filter(image_id=OuterRef("id"))))
+        if isinstance(query, Not):
+            return ~self.probe(query.child)
+        children = self._ordered(query.children)
+        condition = Q()
+        if isinstance(query, And):
+            # Rarest first, so most images fail the first check
+            for child in children:
+                condition &= self.probe(child)
+        else:
+            # Most common first, so most images pass the first check
+            for child in reversed(children):
+                condition |= self.probe(child)
+        return condition
@@ -0,0 +1,212 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.metrics import imagga_circuit_state, imagga_rejected_calls
+from core.models import CircuitBreakerState, CircuitState, TokenBucketState
+
+# Value of the imagga_circuit_state gauge for each state
+CIRCUIT_STATE_VALUES = {
+    CircuitState.CLOSED.name: 0,
+    CircuitState.HALF_OPEN.name: 1,
+    CircuitState.OPEN.name: 2,
+}
+
+
+class ImaggaUnavailable(Exception):
+    """
+    Raised instead of calling Imagga while the circuit breaker is open or the rate limit is exhausted.
+    """
+
+    def __init__(self, message, retry_after: float):
+        super().__init__(message)
+        # Seconds after which calling again may succeed
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Class to rate limit calls across every process with a token bucket stored in the database: it holds up to
+    `burst` tokens, refills at `rate` tokens per second, and each call takes one.
+
+    The bucket row is updated with a compare-and-set on its version, like TaggingJob claims, so it works on any
+    database backend without row locks.
+    """
+
+    def __init__(self, name, rate: float, burst: int, max_wait: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+
+    def acquire(self):
+        """
+        Take a token, waiting up to `max_wait` seconds for one.
+
+        :raises ImaggaUnavailable: if no token became available in time
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                imagga_rejected_calls.labels("rate_limited").inc()
+                raise ImaggaUnavailable(
+                    "Imagga rate limit reached. Please try again later.",
+                    retry_after=wait,
+                )
+            time.sleep(wait)
+
+    def _try_acquire(self):
+        """
+        :return: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        while True:
+            bucket = self._get_state()
+            now = timezone.now()
+            elapsed = max((now - bucket.refilled_at).total_seconds(), 0)
+            tokens = min(self.burst, bucket.tokens + elapsed * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            updated = TokenBucketState.objects.filter(
+                id=bucket.id, version=bucket.version
+            ).update(tokens=tokens - 1, refilled_at=now, version=F("version") + 1)
+            if updated:
+                return 0
+            # Another process took a token first; retry with the new state
+
+    def _get_state(self):
+        try:
+            return TokenBucketState.objects.get(name=self.name)
+        except TokenBucketState.DoesNotExist:
+            try:
+                return TokenBucketState.objects.create(
+                    name=self.name, tokens=self.burst
+                )
+            except IntegrityError:
+                return TokenBucketState.objects.get(name=self.name)
+
+
+class CircuitBreaker:
+    """
+    Class to stop calling a failing service, shared by every process through the database.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail fast with ImaggaUnavailable. Once
+    `reset_timeout` seconds pass, one caller is let through as a probe (half open): its success closes the circuit
+    and its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._local = threading.local()
+
+    def before_call(self):
+        """
+        Check whether a call may go ahead, claiming the probe when the reset timeout has passed.
+
+        :raises ImaggaUnavailable: if the circuit is open
+        """
+        breaker = self._get_state()
+        self._local.claimed_probe = False
+        self._local.was_clean = (
+            breaker.state == CircuitState.CLOSED.name
+            and breaker.consecutive_failures == 0
+        )
+        if breaker.state == CircuitState.CLOSED.name:
+            return
+
+        # Open, or half open with a probe that never reported back
+        retry_after = (
+            self.reset_timeout - (timezone.now() - breaker.opened_at).total_seconds()
+        )
+        if retry_after <= 0:
+            claimed = CircuitBreakerState.objects.filter(
+                id=breaker.id, version=breaker.version
+            ).update(
+                state=CircuitState.HALF_OPEN.name,
+                opened_at=timezone.now(),
+                version=F("version") + 1,
+            )
+            if claimed:
+                self._local.claimed_probe = True
+                self._set_gauge(CircuitState.HALF_OPEN.name)
+                return
+            retry_after = self.reset_timeout
+
+        self._set_gauge(breaker.state)
+        imagga_rejected_calls.labels("circuit_open").inc()
+        raise ImaggaUnavailable(
+            "Imagga is unavailable. Please try again later.", retry_after=retry_after
+        )
+
+    def release_probe(self):
+        """
+        Give back the probe claimed by before_call for a call that was never made, so the next caller can probe
+        straight away instead of after another `reset_timeout`.
+        """
+        if not getattr(self._local, "claimed_probe", False):
+            return
+        self._local.claimed_probe = False
+        released = CircuitBreakerState.objects.filter(
+            name=self.name, state=CircuitState.HALF_OPEN.name
+        ).update(
+            state=CircuitState.OPEN.name,
+            opened_at=timezone.now() - timedelta(seconds=self.reset_timeout),
+            version=F("version") + 1,
+        )
+        if released:
+            self._set_gauge(CircuitState.OPEN.name)
+
+    def record_success(self):
+        if getattr(self._local, "was_clean", False):
+            # Nothing to reset, so the common case costs no write
+            return
+        CircuitBreakerState.objects.filter(name=self.name).update(
+            state=CircuitState.CLOSED.name,
+            consecutive_failures=0,
+            opened_at=None,
+            version=F("version") + 1,
+        )
+        self._set_gauge(CircuitState.CLOSED.name)
+
+    def record_failure(self):
+        self._local.was_clean = False
+        CircuitBreakerState.objects.filter(name=self.name).update(
+            consecutive_failures=F("consecutive_failures") + 1,
+            version=F("version") + 1,
+        )
+        # Open once the threshold is reached, or straight away if the probe failed
+        opened = (
+            CircuitBreakerState.objects.filter(name=self.name)
+            .filter(
+                Q(consecutive_failures__gte=self.failure_threshold)
+                | Q(state=CircuitState.HALF_OPEN.name)
+            )
+            .exclude(state=CircuitState.OPEN.name)
+            .update(
+                state=CircuitState.OPEN.name,
+                opened_at=timezone.now(),
+                version=F("version") + 1,
+            )
+        )
+        if opened:
+            self._set_gauge(CircuitState.OPEN.name)
+
+    def _get_state(self):
+        try:
+            return CircuitBreakerState.objects.get(name=self.name)
+        except CircuitBreakerState.DoesNotExist:
+            try:
+                return CircuitBreakerState.objects.create(name=self.name)
+            except IntegrityError:
+                return CircuitBreakerState.objects.get(name=self.name)
+
+    def _set_gauge(self, state):
+        imagga_circuit_state.labels(self.name).set(CIRCUIT_STATE_VALUES[state])
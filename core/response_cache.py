@@ -0,0 +1,134 @@
+import hashlib
+import threading
+from datetime import timedelta
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from core.models import CachedImaggaResponse
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_image_url(image_url: str) -> str:
+    """
+    Normalize an image URL so trivially different spellings of it share a cache entry: lowercase scheme and host,
+    no default port, no fragment, and sorted query parameters.
+    """
+    parts = urlsplit(image_url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{parts.port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+class ImaggaResponseCache:
+    """
+    Class to cache successful Imagga responses for image URLs in the database, so they are shared by every worker
+    process and survive restarts.
+
+    Entries expire after `ttl` seconds. Once more than `max_entries` are stored, the least recently used entries are
+    evicted; the check runs every `eviction_interval` writes to keep it off the hot path.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, eviction_interval: int = 100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+
+    def get(self, endpoint: str, image_url: str, categorizer_id="") -> Optional[dict]:
+        """
+        Get the cached response for an endpoint and image URL, or None if there is no fresh entry.
+        """
+        key = self._get_key(endpoint, image_url, categorizer_id)
+        now = timezone.now()
+        entry = (
+            CachedImaggaResponse.objects.filter(
+                key=key, date_created__gte=now - timedelta(seconds=self.ttl)
+            )
+            .values_list("id", "response")
+            .first()
+        )
+        if entry is None:
+            self._count(misses=1)
+            return None
+
+        entry_id, response = entry
+        CachedImaggaResponse.objects.filter(id=entry_id).update(
+            hit_count=F("hit_count") + 1, last_accessed=now
+        )
+        self._count(hits=1)
+        return response
+
+    def set(self, endpoint: str, image_url: str, response: dict, categorizer_id=""):
+        """
+        Store a response, replacing any expired entry for the same endpoint and image URL.
+        """
+        key = self._get_key(endpoint, image_url, categorizer_id)
+        try:
+            CachedImaggaResponse.objects.update_or_create(
+                key=key,
+                defaults={
+                    "endpoint": f"{endpoint}/{categorizer_id}".rstrip("/"),
+                    "image_url": image_url,
+                    "response": response,
+                    "hit_count": 0,
+                    "date_created": timezone.now(),
+                    "last_accessed": timezone.now(),
+                },
+            )
+        except IntegrityError:
+            # Another worker stored the same response first
+            return
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete expired entries, then the least recently used entries beyond `max_entries`.
+        """
+        CachedImaggaResponse.objects.filter(
+            date_created__lt=timezone.now() - timedelta(seconds=self.ttl)
+        ).delete()
+        overflow_ids = list(
+            CachedImaggaResponse.objects.order_by("-last_accessed").values_list(
+                "id", flat=True
+            )[self.max_entries :]
+        )
+        if overflow_ids:
+            CachedImaggaResponse.objects.filter(id__in=overflow_ids).delete()
+
+    def stats(self):
+        """
+        Get the hit and miss counters of this process.
+        """
+        with self._lock:
+            return {"hits": self._hits, "misses": self._misses}
+
+    def _count(self, hits=0, misses=0):
+        with self._lock:
+            self._hits += hits
+            self._misses += misses
+
+    def _get_key(self, endpoint, image_url, categorizer_id):
+        return hashlib.sha256(
+            "\n".join(
+                [endpoint, categorizer_id or "", normalize_image_url(image_url)]
+            ).encode()
+        ).hexdigest()
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+
+from core.models import CacheGeneration
+
+# Generation bumped by every write that can change a GET /images response (see core.signals)
+IMAGES_GENERATION = "images"
+
+
+def get_generation(name):
+    """
+    Get the current generation of a set of tables.
+
+    :param name: CacheGeneration name
+    :return: generation, 0 until the first write
+    """
+    return (
+        CacheGeneration.objects.filter(name=name)
+        .values_list("value", flat=True)
+        .first()
+        or 0
+    )
+
+
+def bump_generation(name):
+    """
+    Record a write, making every cache entry read at an earlier generation stale.
+
+    :param name: CacheGeneration name
+    """
+    if not CacheGeneration.objects.filter(name=name).update(value=F("value") + 1):
+        generation, created = CacheGeneration.objects.get_or_create(
+            name=name, defaults={"value": 1}
+        )
+        if not created:
+            CacheGeneration.objects.filter(name=name).update(value=F("value") + 1)
+
+
+class ResultCache:
+    """
+    Class to keep the most recently used results of a generation in memory, bounded by entries and total size.
+
+    Every entry belongs to the generation it was read at, so when a lookup or store names a newer generation the whole
+    cache is emptied at once instead of tracking which entries a write affected.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._generation = None
+
+    def get(self, key, generation):
+        """
+        :return: the cached value, or None if it is missing or from an earlier generation
+        """
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None or generation != self._generation:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, generation, value, size):
+        """
+        :param size: approximate size of the value in bytes, counted against `max_bytes`
+        """
+        with self._lock:
+            self._check_generation(generation)
+            if generation != self._generation or size > self.max_bytes:
+                # Read at an older generation than another thread already saw, or too large to keep
+                return
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._generation = None
+
+    def _check_generation(self, generation):
+        if self._generation is None or generation > self._generation:
+            self._entries.clear()
+            self._size = 0
+            self._generation = generation
+
+
+image_result_cache = ResultCache(
+    max_entries=settings.IMAGE_RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=settings.IMAGE_RESULT_CACHE_MAX_BYTES,
+)
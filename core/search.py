@@ -0,0 +1,156 @@
+import heapq
+
+from django.db.models import Q
+
+from core.models import ImageTag, Tag
+
+# Fewest ImageTag rows read from each tag's sorted list per round of ranking
+RANKING_MIN_BATCH_SIZE = 100
+
+
+class _SortedTagImages:
+    """
+    Class to read the images of a tag most confident first, a batch at a time, from `image_tag_confidence_idx`
+    """
+
+    def __init__(self, tag_id, min_confidence, blacklisted, batch_size, start=None):
+        """
+        :param start: (confidence, image id) to read the images after, instead of from the most confident
+        """
+        self.tag_id = tag_id
+        self.min_confidence = min_confidence
+        self.blacklisted = blacklisted
+        self.batch_size = batch_size
+        self.last_confidence, self.last_image_id = start or (None, None)
+        self.exhausted = False
+
+    def next_batch(self):
+        """
+        :return: list of image ids, following the previous batch
+        """
+        image_tags = ImageTag.objects.filter(
+            tag_id=self.tag_id,
+            confidence__gte=self.min_confidence,
+            blacklisted=self.blacklisted,
+        )
+        if self.last_image_id is not None:
+            image_tags = image_tags.filter(
+                Q(confidence__lt=self.last_confidence)
+                | Q(confidence=self.last_confidence, image_id__gt=self.last_image_id)
+            )
+        rows = list(
+            image_tags.order_by("-confidence", "image_id").values_list(
+                "image_id", "confidence"
+            )[: self.batch_size]
+        )
+        if len(rows) < self.batch_size:
+            self.exhausted = True
+        if rows:
+            self.last_image_id, self.last_confidence = rows[-1]
+        return [image_id for image_id, _ in rows]
+
+
+def rank_images_by_tags(
+    tag_names, limit, min_confidence=0.0, blacklisted=False, after=None
+):
+    """
+    Rank the images tagged with every one of the given tag names by relevance, the sum of their tag confidences.
+
+    Only the top `limit` images are computed, with the threshold algorithm: each tag's images are read most confident
+    first, every newly seen image is scored, and reading stops once the last images read from each tag could not add
+    up to a score beating the current top `limit`. Images tied on score are ordered by id.
+
+    Following a cursor costs the same as the first page for a single tag: its score is its confidence, so its images
+    are read from the cursor's position on the index. With several tags, no confidence is negative, so no image ranked
+    after the cursor has a confidence above the cursor's score, and each tag's images are read from that bound on;
+    images ranked before the cursor with every confidence below its score are still read again.
+
+    :param tag_names: list of normalized tag names
+    :param limit: number of images to return
+    :param min_confidence: lowest confidence each of the tags must have been detected with
+    :param blacklisted: whether to rank blacklisted images instead of the others
+    :param after: (score, image id) of the last image of the previous page, to rank the images that follow it
+    :return: list of (image id, score), most relevant first
+    """
+    tag_ids = sorted(
+        Tag.objects.filter(name__in=tag_names).values_list("id", flat=True)
+    )
+    if not tag_ids or len(tag_ids) < len(set(tag_names)):
+        # At least one requested tag has never been detected, so nothing can match
+        return []
+
+    batch_size = max(limit, RANKING_MIN_BATCH_SIZE)
+    start = None
+    if after:
+        # Ids are positive, so starting after id 0 reads every image with a confidence of at most the score
+        start = (after[0], after[1] if len(tag_ids) == 1 else 0)
+    sorted_tag_images = [
+        _SortedTagImages(tag_id, min_confidence, blacklisted, batch_size, start)
+        for tag_id in tag_ids
+    ]
+    after_key = (after[0], -after[1]) if after else None
+    # Min-heap of (score, -image id), so the least relevant of the top images is at the root
+    top = []
+    seen_image_ids = set()
+
+    while True:
+        new_image_ids = []
+        for tag_images in sorted_tag_images:
+            for image_id in tag_images.next_batch():
+                if image_id not in seen_image_ids:
+                    seen_image_ids.add(image_id)
+                    new_image_ids.append(image_id)
+
+        for image_id, score in _score_images(
+            new_image_ids, tag_ids, min_confidence, blacklisted
+        ):
+            key = (score, -image_id)
+            if after_key and key >= after_key:
+                continue
+            if len(top) < limit:
+                heapq.heappush(top, key)
+            elif key > top[0]:
+                heapq.heapreplace(top, key)
+
+        # An image missing from any tag's remaining images cannot match every tag
+        if any(tag_images.exhausted for tag_images in sorted_tag_images):
+            break
+        if len(top) == limit:
+            # No unseen image can score more than the last confidences read from each tag, and one scoring exactly
+            # that much comes after every last image read, so it cannot beat a top image with a lower id either
+            threshold = sum(
+                tag_images.last_confidence for tag_images in sorted_tag_images
+            )
+            lowest_score, lowest_negated_id = top[0]
+            if lowest_score > threshold or (
+                lowest_score == threshold
+                and -lowest_negated_id
+                <= max(tag_images.last_image_id for tag_images in sorted_tag_images)
+            ):
+                break
+
+    return [(-negated_id, score) for score, negated_id in sorted(top, reverse=True)]
+
+
+def _score_images(image_ids, tag_ids, min_confidence, blacklisted):
+    """
+    Score images by the sum of their confidences for the given tags, leaving out those missing any of the tags.
+
+    :return: list of (image id, score)
+    """
+    if not image_ids:
+        return []
+    confidences = {}
+    for image_id, tag_id, confidence in ImageTag.objects.filter(
+        image_id__in=image_ids,
+        tag_id__in=tag_ids,
+        confidence__gte=min_confidence,
+        blacklisted=blacklisted,
+    ).values_list("image_id", "tag_id", "confidence"):
+        confidences.setdefault(image_id, {})[tag_id] = confidence
+    # Summed in tag id order, the same as the threshold, so equal confidences give exactly equal scores
+    return [
+        (image_id, sum(image_confidences[tag_id] for tag_id in tag_ids))
+        for image_id, image_confidences in confidences.items()
+        if len(image_confidences) == len(tag_ids)
+    ]
@@ -1,8 +1,37 @@
 from rest_framework import serializers
-from core.models import Image
+from core.models import Image, SourceType, UploadStatusType, get_variant_urls
+
+# Columns needed by image_values_to_dict, fetched in a single query with `Image.objects.values(*IMAGE_VALUES_FIELDS)`
+IMAGE_VALUES_FIELDS = (
+    "id",
+    "label",
+    "image_upload_id",
+    "image_upload__status",
+    "source_type",
+    "source_url",
+    "source",
+    "date_created",
+    "detected_objects",
+    "uploaded_by_id",
+    "uploaded_by__username",
+    "blacklisted",
+)
+
+# Columns of ImageSerializer, read with `values()` by image_values_to_representation
+IMAGE_REPRESENTATION_FIELDS = (
+    "id",
+    "label",
+    "source_type",
+    "source",
+    "source_url",
+    "detected_objects",
+)
+
+_source_storage = Image._meta.get_field("source").storage
 
 
 class ImageSerializer(serializers.HyperlinkedModelSerializer):
+    variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
@@ -13,8 +42,14 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
             "source",
             "source_url",
             "detected_objects",
+            "variants",
         ]
 
+    def get_variants(self, image):
+        return get_variant_urls(
+            image.id, bool(image.source), self.context.get("request")
+        )
+
     def validate(self, data):
         if data["source_type"] == "UPLOAD" and not data.get("source"):
             raise serializers.ValidationError(
@@ -25,3 +60,57 @@ class ImageSerializer(serializers.HyperlinkedModelSerializer):
                 "source_url is required for source_type=url"
             )
         return data
+
+
+def image_values_to_dict(row: dict):
+    """
+    Build the same dict as Image.to_dict from a row of `Image.objects.values(*IMAGE_VALUES_FIELDS)`, without
+    instantiating the model or its related objects.
+    """
+    source_type = row["source_type"]
+    upload_status = row["image_upload__status"]
+    return {
+        "id": row["id"],
+        "label": row["label"],
+        "image_upload_id": row["image_upload_id"],
+        "source_type": (
+            SourceType[source_type].value
+            if source_type in SourceType.__members__
+            else source_type
+        ),
+        "source_url": row["source_url"],
+        "source": _source_storage.url(row["source"]) if row["source"] else None,
+        "variants": get_variant_urls(row["id"], bool(row["source"])),
+        "date_created": row["date_created"].isoformat(),
+        "detected_objects": row["detected_objects"],
+        "uploaded_by_id": row["uploaded_by_id"],
+        "uploaded_by_username": row["uploaded_by__username"],
+        "blacklisted": row["blacklisted"],
+        "image_upload_status": (
+            UploadStatusType[upload_status].value
+            if upload_status in UploadStatusType.__members__
+            else upload_status
+        ),
+    }
+
+
+def image_values_to_representation(row: dict, request=None):
+    """
+    Build the same dict as ImageSerializer from a row of `Image.objects.values(*IMAGE_REPRESENTATION_FIELDS)`, so
+    large pages are serialized without instantiating a model and serializer field per row.
+
+    :param row: dict of Image values
+    :param request: request used to build an absolute source URL, as ImageSerializer does
+    """
+    source = _source_storage.url(row["source"]) if row["source"] else None
+    if source and request is not None:
+        source = request.build_absolute_uri(source)
+    return {
+        "id": row["id"],
+        "label": row["label"],
+        "source_type": row["source_type"],
+        "source": source,
+        "source_url": row["source_url"],
+        "detected_objects": row["detected_objects"],
+        "variants": get_variant_urls(row["id"], bool(row["source"]), request),
+    }
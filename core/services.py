@@ -1,4 +1,10 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 from core.clients import ImaggaClient
 from core.constants import (
@@ -6,12 +12,68 @@ from core.constants import (
     IMAGGA_NSFW_CHECK_FF_NAME,
     SAFETY_CONFIDENCE_THRESHOLD_APP_CONFIG_KEY,
 )
-from core.models import AppConfig, FeatureFlag, Image, SourceType, ImageUpload
+from core.autocomplete import tag_autocomplete_index
+from core.config import config_cache
+from core.result_cache import IMAGES_GENERATION, bump_generation
+from core.metrics import image_processing, image_processing_stage_duration
+from core.duplicates import find_near_duplicates, index_perceptual_hash
+from core.imaging import get_dhash, prepare_detection_upload
+from core.resilience import CircuitBreaker, ImaggaUnavailable, TokenBucket
+from core.response_cache import ImaggaResponseCache
+from core.models import (
+    Image,
+    ImageTag,
+    SourceType,
+    ImageUpload,
+    Tag,
+)
 from logging import Logger
 
 log = Logger(__name__)
 
-imagga_client = ImaggaClient(settings.IMAGGA_API_KEY, settings.IMAGGA_API_SECRET)
+# Runs Imagga calls for a single image concurrently; sized to the client's connection pool
+imagga_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGGA_POOL_MAXSIZE, thread_name_prefix="imagga"
+)
+
+imagga_client = ImaggaClient(
+    settings.IMAGGA_API_KEY,
+    settings.IMAGGA_API_SECRET,
+    api_url=settings.IMAGGA_API_URL,
+    connect_timeout=settings.IMAGGA_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=settings.IMAGGA_READ_TIMEOUT_SECONDS,
+    pool_maxsize=settings.IMAGGA_POOL_MAXSIZE,
+    max_retries=settings.IMAGGA_MAX_RETRIES,
+    backoff_factor=settings.IMAGGA_RETRY_BACKOFF_FACTOR,
+    backoff_jitter=settings.IMAGGA_RETRY_BACKOFF_JITTER,
+    response_cache=(
+        ImaggaResponseCache(
+            ttl=settings.IMAGGA_RESPONSE_CACHE_TTL_SECONDS,
+            max_entries=settings.IMAGGA_RESPONSE_CACHE_MAX_ENTRIES,
+        )
+        if settings.IMAGGA_RESPONSE_CACHE_TTL_SECONDS
+        else None
+    ),
+    rate_limiter=(
+        TokenBucket(
+            "imagga",
+            rate=settings.IMAGGA_RATE_LIMIT_PER_SECOND,
+            burst=settings.IMAGGA_RATE_LIMIT_BURST,
+            max_wait=settings.IMAGGA_RATE_LIMIT_MAX_WAIT_SECONDS,
+        )
+        if settings.IMAGGA_RATE_LIMIT_PER_SECOND
+        else None
+    ),
+    circuit_breaker=(
+        CircuitBreaker(
+            "imagga",
+            failure_threshold=settings.IMAGGA_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.IMAGGA_CIRCUIT_RESET_TIMEOUT_SECONDS,
+        )
+        if settings.IMAGGA_CIRCUIT_FAILURE_THRESHOLD
+        else None
+    ),
+)
 
 
 def process_image_upload(image: Image):
@@ -21,57 +83,185 @@ def process_image_upload(image: Image):
 
     :param image: Image object
     """
+    outcome = "error"
     try:
-        nsfw_check_ff = FeatureFlag.objects.get(name=IMAGGA_NSFW_CHECK_FF_NAME)
-    except FeatureFlag.DoesNotExist:
+        with image_processing_stage_duration.labels("total").time():
+            outcome = _process_image_upload(image)
+    except ImaggaUnavailable:
+        outcome = "deferred"
+        raise
+    except ValidationError:
+        outcome = "rejected"
+        raise
+    finally:
+        image_processing.labels(outcome).inc()
+
+
+def _process_image_upload(image: Image):
+    """
+    Tag the image, timing each stage.
+
+    :return: "tagged" if Imagga tagged the image, or "reused" if the tags of an identical or near-duplicate image were reused
+    """
+    nsfw_check_active = config_cache.is_feature_active(IMAGGA_NSFW_CHECK_FF_NAME)
+    if nsfw_check_active is None:
         log.warn(
             f"Feature flag {IMAGGA_NSFW_CHECK_FF_NAME} not found. Skipping NSFW check."
         )
-        nsfw_check_ff = None
 
-    if image.source_type == SourceType.UPLOAD.name:
-        image.image_upload = upload_image(image)
-        image_tag_response = imagga_client.get_tag_image_for_upload(
-            image.image_upload.upload_id
-        )
-        image.detected_objects = _process_image_tags(image_tag_response)
-        if (
-            nsfw_check_ff and nsfw_check_ff.active and not validate_nsfw(image)
-        ) or not validate_blacklisted_items(image):
-            log.warn(f"Image {image.id} contains NSFW content. Image blacklisted.")
-            # TODO ensure image artifact is not stored in our system
-            raise ValidationError("Image contains NSFW content.")
-    elif image.source_type == SourceType.URL.name:
-        image_tag_response = imagga_client.get_tag_image(image.source_url)
-        image.detected_objects = _process_image_tags(image_tag_response)
-        if (
-            nsfw_check_ff and nsfw_check_ff.active and not validate_nsfw(image)
-        ) or not validate_blacklisted_items(image):
-            log.warn(f"Image {image.id} contains NSFW content. Image blacklisted.")
-            # TODO ensure image artifact is not stored in our system
-            raise ValidationError("Image contains NSFW content.")
+    if image.source_type not in (SourceType.UPLOAD.name, SourceType.URL.name):
+        raise ValueError("Invalid source type")
+
+    if image.source and not image.perceptual_hash:
+        with image_processing_stage_duration.labels("perceptual_hash").time():
+            image.perceptual_hash = get_dhash(image.source)
+
+    with image_processing_stage_duration.labels("duplicate_lookup").time():
+        previously_tagged_image = get_previously_tagged_image(image)
+        if previously_tagged_image:
+            log.info(
+                f"Image {image.id} has the same content as image {previously_tagged_image.id}. Reusing its detected objects."
+            )
+        elif previously_tagged_image := get_near_duplicate_image(image):
+            log.info(
+                f"Image {image.id} looks the same as image {previously_tagged_image.id}. Reusing its detected objects."
+            )
 
+    if previously_tagged_image:
+        image.detected_objects = previously_tagged_image.detected_objects
+        tag_confidences = get_tag_confidences(previously_tagged_image)
+        passes_nsfw_check = not previously_tagged_image.blacklisted
     else:
-        raise ValueError("Invalid source type")
+        with image_processing_stage_duration.labels("detect_objects").time():
+            passes_nsfw_check, tag_confidences = _detect_objects(
+                image, nsfw_check_active
+            )
+
+    if not passes_nsfw_check or not validate_blacklisted_items(image):
+        log.warn(f"Image {image.id} contains NSFW content. Image blacklisted.")
+        # Blacklisted images stay searchable with `?blacklisted=true`
+        with image_processing_stage_duration.labels("db_write").time():
+            with transaction.atomic():
+                # Indexed before saving, so the save finds the index in step instead of reindexing without confidences
+                index_image_tags(image, tag_confidences)
+                image.save()
+                index_perceptual_hash(image)
+        # TODO ensure image artifact is not stored in our system
+        raise ValidationError("Image contains NSFW content.")
+
+    with image_processing_stage_duration.labels("db_write").time():
+        with transaction.atomic():
+            index_image_tags(image, tag_confidences)
+            image.save()
+            index_perceptual_hash(image)
+    return "reused" if previously_tagged_image else "tagged"
 
-    image.save()
+
+def get_content_hash(file):
+    """
+    Get the SHA-256 of a file, using the digest computed while it was uploaded when available.
+
+    :param file: uploaded or stored file
+    :return: hex digest
+    """
+    if getattr(file, "sha256", None):
+        return file.sha256
+    content_hash = hashlib.sha256()
+    for chunk in file.chunks():
+        content_hash.update(chunk)
+    file.seek(0)
+    return content_hash.hexdigest()
+
+
+def get_stored_file_name(content_hash):
+    """
+    Get the name of a file already in storage with the given content, so a re-upload can share it.
+
+    :param content_hash: SHA-256 hex digest
+    :return: file name, or None if no stored file has this content
+    """
+    stored_file_names = (
+        Image.objects.filter(content_hash=content_hash)
+        .exclude(source="")
+        .exclude(source__isnull=True)
+        .order_by("id")
+        .values_list("source", flat=True)
+    )
+    for name in stored_file_names[:5]:
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+def get_previously_tagged_image(image: Image):
+    """
+    Get an earlier image with the same content that was already tagged, so its results can be reused.
+
+    :param image: Image object
+    :return: Image object, or None
+    """
+    if not image.content_hash:
+        return None
+    return (
+        Image.objects.filter(
+            content_hash=image.content_hash, detected_objects__isnull=False
+        )
+        .exclude(id=image.id)
+        .only("id", "detected_objects", "blacklisted")
+        .order_by("id")
+        .first()
+    )
+
+
+def get_near_duplicate_image(image: Image):
+    """
+    Get the closest earlier image that looks the same (within IMAGE_NEAR_DUPLICATE_MAX_DISTANCE bits of perceptual
+    hash) and was already tagged, so its results can be reused.
+
+    :param image: Image object
+    :return: Image object, or None
+    """
+    if not image.perceptual_hash or not settings.IMAGE_NEAR_DUPLICATE_MAX_DISTANCE:
+        return None
+    near_duplicate_ids = [
+        image_id
+        for image_id, _ in find_near_duplicates(
+            image.perceptual_hash,
+            settings.IMAGE_NEAR_DUPLICATE_MAX_DISTANCE,
+            exclude_id=image.id,
+        )
+    ]
+    tagged_images = Image.objects.filter(
+        id__in=near_duplicate_ids, detected_objects__isnull=False
+    ).only("id", "detected_objects", "blacklisted")
+    tagged_images_by_id = {tagged.id: tagged for tagged in tagged_images}
+    for image_id in near_duplicate_ids:
+        if image_id in tagged_images_by_id:
+            return tagged_images_by_id[image_id]
+    return None
 
 
 def upload_image(image: Image):
     """
-    Upload the image to Imagga and store the ImageUpload model in the database.
+    Upload a downsized copy of the image to Imagga and store the upload id on the image's ImageUpload, creating it if needed.
 
     :param image: Image object
     :return: ImageUpload object
     """
+    # Corrupt files are rejected here, before any call to Imagga
+    with image_processing_stage_duration.labels("preprocess").time():
+        detection_upload = prepare_detection_upload(
+            image.source,
+            max_dimension=settings.IMAGGA_UPLOAD_MAX_DIMENSION,
+            quality=settings.IMAGGA_UPLOAD_JPEG_QUALITY,
+        )
     try:
-        upload_response = imagga_client.upload_image(image.source)
+        upload_response = imagga_client.upload_image(detection_upload)
     except Exception as e:
         raise ValueError(f"Exception while uploading image: {e}")
-    upload_id = upload_response["result"]["upload_id"]
-    image_upload = ImageUpload.objects.create(
-        image=image, upload_id=upload_id, status=upload_response["status"]["type"]
-    )
+    image_upload = image.image_upload or ImageUpload()
+    image_upload.upload_id = upload_response["result"]["upload_id"]
+    image_upload.save()
     return image_upload
 
 
@@ -83,17 +273,14 @@ def validate_nsfw(image: Image):
     :return: False if image contains NSFW content, True otherwise
     """
 
-    SAFETY_CONFIDENCE_THRESHOLD = settings.IMAGE_SAFETY_CONFIDENCE_DEFAULT_THRESHOLD
-    try:
-        SAFETY_CONFIDENCE_THRESHOLD = float(
-            AppConfig.objects.filter(
-                key=SAFETY_CONFIDENCE_THRESHOLD_APP_CONFIG_KEY
-            ).get()
-        )
-    except AppConfig.DoesNotExist:
+    SAFETY_CONFIDENCE_THRESHOLD = config_cache.get_float(
+        SAFETY_CONFIDENCE_THRESHOLD_APP_CONFIG_KEY
+    )
+    if SAFETY_CONFIDENCE_THRESHOLD is None:
         log.warn(
             f"Key of `{SAFETY_CONFIDENCE_THRESHOLD_APP_CONFIG_KEY}` in AppConfig not found. Defaulting to hard-coded value."
         )
+        SAFETY_CONFIDENCE_THRESHOLD = settings.IMAGE_SAFETY_CONFIDENCE_DEFAULT_THRESHOLD
 
     categories_check_response = imagga_client.check_nsfw_categories(image)
 
@@ -111,8 +298,8 @@ def validate_nsfw(image: Image):
                 break
 
         if safety_confidence < SAFETY_CONFIDENCE_THRESHOLD:
+            # Persisted by process_image_upload, as this may run off the request thread
             image.blacklisted = True
-            image.save()
             log.warn(f"Image {image.id} contains NSFW content. Image blacklisted.")
             return False
     else:
@@ -138,8 +325,8 @@ def validate_blacklisted_items(image: Image):
     ).intersection(blacklisted_items)
 
     if detected_objects_blacklisted_items_intersection:
+        # Persisted by process_image_upload, with the detected objects
         image.blacklisted = True
-        image.save()
         log.warn(f"Image {image.id} contains blacklisted items. Image blacklisted.")
         return False
     return True
@@ -149,15 +336,208 @@ def get_blacklisted_items():
     """
     Get blacklisted items from the AppConfig model.
     """
-    try:
-        blacklisted_items_app_config = AppConfig.objects.filter(
-            key=BLACKLISTED_ITEMS_APP_CONFIG_KEY
-        ).get()
-    except AppConfig.DoesNotExist:
+    blacklisted_items = config_cache.get_list(BLACKLISTED_ITEMS_APP_CONFIG_KEY)
+    if blacklisted_items is None:
         log.warn(
             f"Key of `{BLACKLISTED_ITEMS_APP_CONFIG_KEY}` in AppConfig not found. Skipping blacklisted items check."
         )
-    return blacklisted_items_app_config.value.split(",")
+        return []
+    return blacklisted_items
+
+
+def normalize_tag_names(detected_objects):
+    """
+    Normalize detected objects (a list, or a comma-separated string) into unique, lowercased tag names.
+
+    :param detected_objects: list or comma-separated string of object names
+    :return: list of tag names, in their original order
+    """
+    if not detected_objects:
+        return []
+    if isinstance(detected_objects, str):
+        detected_objects = detected_objects.split(",")
+    names = (str(name).strip().lower() for name in detected_objects)
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def index_image_tags(image: Image, tag_confidences=None):
+    """
+    Sync the ImageTag index with the image's detected objects, creating any Tag that does not exist yet. Saving an
+    image calls this when its detected objects changed (see core.signals).
+
+    :param image: Image object
+    :param tag_confidences: dict of tag name to confidence; when given, the confidences of indexed tags are updated too
+    """
+    names = normalize_tag_names(image.detected_objects)
+    # Read by core.signals, so saving the image after indexing it does not index it again
+    image._indexed_tag_names = names
+    tag_ids = _get_or_create_tag_ids(names)
+    blacklisted = bool(image.blacklisted)
+
+    indexed_tags = dict(
+        ImageTag.objects.filter(image_id=image.id).values_list("tag_id", "blacklisted")
+    )
+    stale_tag_ids = set(indexed_tags) - set(tag_ids.values())
+    if stale_tag_ids:
+        # Tag.image_count of the stale tags is decremented by core.signals
+        ImageTag.objects.filter(image_id=image.id, tag_id__in=stale_tag_ids).delete()
+    _set_image_tags_blacklisted(
+        image.id,
+        [
+            tag_id
+            for tag_id in tag_ids.values()
+            if tag_id in indexed_tags and indexed_tags[tag_id] != blacklisted
+        ],
+        blacklisted,
+    )
+    if tag_confidences is None:
+        ImageTag.objects.bulk_create(
+            [
+                ImageTag(image_id=image.id, tag_id=tag_id, blacklisted=blacklisted)
+                for tag_id in tag_ids.values()
+                if tag_id not in indexed_tags
+            ],
+            ignore_conflicts=True,
+        )
+    else:
+        ImageTag.objects.bulk_create(
+            [
+                ImageTag(
+                    image_id=image.id,
+                    tag_id=tag_id,
+                    confidence=tag_confidences.get(name, 0.0),
+                    blacklisted=blacklisted,
+                )
+                for name, tag_id in tag_ids.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["tag", "image"],
+            update_fields=["confidence"],
+        )
+    if not blacklisted:
+        add_to_tag_image_counts(
+            [tag_id for tag_id in tag_ids.values() if tag_id not in indexed_tags], 1
+        )
+    # Searches cached after the image was saved but before its tags were indexed are stale too
+    bump_generation(IMAGES_GENERATION)
+
+
+def sync_image_tags_blacklisted(image: Image):
+    """
+    Copy the image's blacklisted flag to its ImageTag rows, moving their tags' image counts accordingly.
+
+    :param image: Image object
+    """
+    blacklisted = bool(image.blacklisted)
+    _set_image_tags_blacklisted(
+        image.id,
+        list(
+            ImageTag.objects.filter(image_id=image.id)
+            .exclude(blacklisted=blacklisted)
+            .values_list("tag_id", flat=True)
+        ),
+        blacklisted,
+    )
+
+
+def add_to_tag_image_counts(tag_ids, delta):
+    """
+    Add to the image count of tags, stamping them for core.autocomplete.
+
+    :param tag_ids: list of Tag ids
+    :param delta: number of images to add; negative to remove
+    """
+    if not tag_ids:
+        return
+    Tag.objects.filter(id__in=tag_ids).update(
+        image_count=F("image_count") + delta, date_updated=timezone.now()
+    )
+    # Other processes see the new counts within TAG_AUTOCOMPLETE_REFRESH_SECONDS
+    tag_autocomplete_index.invalidate()
+
+
+def _set_image_tags_blacklisted(image_id, tag_ids, blacklisted):
+    if not tag_ids:
+        return
+    ImageTag.objects.filter(image_id=image_id, tag_id__in=tag_ids).update(
+        blacklisted=blacklisted
+    )
+    add_to_tag_image_counts(tag_ids, -1 if blacklisted else 1)
+
+
+def get_tag_confidences(image: Image):
+    """
+    Get the confidences the image's tags were indexed with.
+
+    :param image: Image object
+    :return: dict of tag name to confidence
+    """
+    return dict(
+        ImageTag.objects.filter(image_id=image.id).values_list(
+            "tag__name", "confidence"
+        )
+    )
+
+
+def _get_or_create_tag_ids(names):
+    """
+    Resolve tag names to their Tag ids, creating the missing tags in a single insert.
+    """
+    if not names:
+        return {}
+    tag_ids = dict(Tag.objects.filter(name__in=names).values_list("name", "id"))
+    missing_names = [name for name in names if name not in tag_ids]
+    if missing_names:
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in missing_names], ignore_conflicts=True
+        )
+        tag_ids.update(
+            Tag.objects.filter(name__in=missing_names).values_list("name", "id")
+        )
+    return tag_ids
+
+
+def _detect_objects(image: Image, nsfw_check_active):
+    """
+    Tag the image with Imagga, running the NSFW check (when active) alongside the tag request.
+
+    :return: tuple of False if the image failed the NSFW check (True otherwise) and a dict of tag name to confidence
+    """
+    if image.source_type == SourceType.UPLOAD.name:
+        image.image_upload = upload_image(image)
+
+    # The NSFW check only needs the upload id or source URL, so it runs alongside the tag request
+    nsfw_check = (
+        imagga_executor.submit(_close_db_connections_after, validate_nsfw, image)
+        if nsfw_check_active
+        else None
+    )
+    try:
+        if image.source_type == SourceType.UPLOAD.name:
+            image_tag_response = imagga_client.get_tag_image_for_upload(
+                image.image_upload.upload_id
+            )
+        else:
+            image_tag_response = imagga_client.get_tag_image(image.source_url)
+    except Exception:
+        if nsfw_check:
+            nsfw_check.cancel()
+        raise
+
+    image.detected_objects = _process_image_tags(image_tag_response)
+    tag_confidences = _process_tag_confidences(image_tag_response)
+    return (nsfw_check.result() if nsfw_check else True), tag_confidences
+
+
+def _close_db_connections_after(func, *args):
+    """
+    Run `func` on an executor thread and close any database connection it opened, since executor threads are not
+    covered by Django's request-scoped connection cleanup.
+    """
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
 
 
 def _process_image_tags(image_response: dict, language_encoding="en"):
@@ -167,3 +547,16 @@ def _process_image_tags(image_response: dict, language_encoding="en"):
     return [
         tag["tag"][language_encoding] for tag in image_response["result"]["tags"] or []
     ]
+
+
+def _process_tag_confidences(image_response: dict, language_encoding="en"):
+    """
+    Process the confidence of each tag from the Imagga API response, keyed by normalized tag name.
+    """
+    tag_confidences = {}
+    for tag in image_response["result"]["tags"] or []:
+        name = str(tag["tag"][language_encoding]).strip().lower()
+        tag_confidences[name] = max(
+            float(tag.get("confidence") or 0.0), tag_confidences.get(name, 0.0)
+        )
+    return tag_confidences
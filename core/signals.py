@@ -0,0 +1,76 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from core.config import config_cache
+from core.models import AppConfig, FeatureFlag, Image, ImageTag
+from core.result_cache import IMAGES_GENERATION, bump_generation
+from core.services import (
+    add_to_tag_image_counts,
+    index_image_tags,
+    normalize_tag_names,
+    sync_image_tags_blacklisted,
+)
+
+
+@receiver(post_save, sender=AppConfig)
+@receiver(post_delete, sender=AppConfig)
+@receiver(post_save, sender=FeatureFlag)
+@receiver(post_delete, sender=FeatureFlag)
+def invalidate_config_cache(sender, **kwargs):
+    """
+    Make this process re-read the config tables on its next lookup; other processes notice via the version stamp.
+    """
+    config_cache.invalidate()
+
+
+@receiver(post_delete, sender=ImageTag)
+def decrement_tag_image_count(sender, instance, **kwargs):
+    """
+    Keep Tag.image_count in step when an image loses a tag, including when the image itself is deleted.
+    """
+    if not instance.blacklisted:
+        add_to_tag_image_counts([instance.tag_id], -1)
+
+
+@receiver(post_init, sender=Image)
+def remember_indexed_tag_names(sender, instance, **kwargs):
+    """
+    Remember the tag names an image was loaded with, so saving it only rebuilds its ImageTag rows when they changed.
+    """
+    instance._indexed_tag_names = (
+        normalize_tag_names(instance.detected_objects)
+        # Not loaded by `.only()`/`.defer()`; reading it here would query it
+        if "detected_objects" in instance.__dict__
+        else None
+    )
+
+
+@receiver(post_save, sender=Image)
+def sync_image_tags_on_save(sender, instance, created, raw, update_fields, **kwargs):
+    """
+    Keep the ImageTag index and Tag.image_count in step when an image's detected objects change (e.g. objects sent by
+    the client, or edited through the API or in Django-Admin) and when it is blacklisted or cleared. Objects indexed
+    here have a confidence of 0; the detection path indexes Imagga's confidences before saving. Updates made with
+    `QuerySet.update()` skip this, so call services.index_image_tags or services.sync_image_tags_blacklisted after.
+    """
+    if raw:
+        return
+    if "detected_objects" in instance.__dict__ and (
+        not update_fields or "detected_objects" in update_fields
+    ):
+        names = normalize_tag_names(instance.detected_objects)
+        if names != instance._indexed_tag_names or (created and names):
+            index_image_tags(instance)
+            return
+    if not created and (not update_fields or "blacklisted" in update_fields):
+        sync_image_tags_blacklisted(instance)
+
+
+# Registered after the receivers above, so the index is in step before cached results are invalidated
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def bump_images_generation(sender, **kwargs):
+    """
+    Invalidate the cached GET /images results of every process (see core.result_cache).
+    """
+    bump_generation(IMAGES_GENERATION)
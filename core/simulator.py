@@ -0,0 +1,233 @@
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Tags handed out by the simulator; each image gets a deterministic subset, so repeated runs tag identically
+SIMULATED_TAGS = [
+    "animal",
+    "beach",
+    "building",
+    "car",
+    "cat",
+    "city",
+    "dog",
+    "flower",
+    "food",
+    "forest",
+    "mountain",
+    "people",
+    "sky",
+    "sunset",
+    "tree",
+    "water",
+]
+
+
+class ImaggaSimulator:
+    """
+    Class to imitate the Imagga v2 endpoints used by ImaggaClient (`tags`, `uploads` and `categories/{id}`), with
+    log-normal latency, injected errors and deterministic results, for load testing and offline development.
+
+    Latency is drawn from a log-normal distribution with the given median, so `latency_sigma` controls how long the
+    tail is (0 makes every call take the median). A fraction `error_rate` of calls fail with 503 and a fraction
+    `rate_limit_rate` with 429. Tags and the NSFW verdict depend only on the image URL or uploaded bytes.
+    """
+
+    def __init__(
+        self,
+        latency_median_ms=200.0,
+        latency_sigma=0.5,
+        upload_latency_median_ms=None,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        nsfw_rate=0.0,
+        tag_count=5,
+        seed=None,
+    ):
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.upload_latency_median_ms = (
+            latency_median_ms
+            if upload_latency_median_ms is None
+            else upload_latency_median_ms
+        )
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.nsfw_rate = nsfw_rate
+        self.tag_count = tag_count
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._uploads = {}
+        self._request_count = 0
+
+    def handle(self, method, url, body=b"", content_type=""):
+        """
+        Answer a request to the simulated API, after sleeping for a sampled latency.
+
+        :param method: HTTP method
+        :param url: request path and query string
+        :param body: request body
+        :param content_type: Content-Type header of the request, for uploads
+        :return: (status code, response dict)
+        """
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/")
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+
+        is_upload = method == "POST" and path.endswith("/v2/uploads")
+        time.sleep(
+            self._sample_latency(
+                self.upload_latency_median_ms if is_upload else self.latency_median_ms
+            )
+        )
+        with self._lock:
+            self._request_count += 1
+            roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            return 429, _error("Simulated rate limit.")
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503, _error("Simulated outage.")
+
+        if is_upload:
+            return self._upload(body, content_type)
+        if method == "GET" and path.endswith("/v2/tags"):
+            return self._with_image_key(params, self._tags)
+        if method == "GET" and "/v2/categories/" in path:
+            return self._with_image_key(params, self._categories)
+        return 404, _error("Resource not found.")
+
+    def stats(self):
+        """
+        Get the number of requests handled so far.
+        """
+        with self._lock:
+            return {"requests": self._request_count, "uploads": len(self._uploads)}
+
+    def _sample_latency(self, median_ms):
+        if median_ms <= 0:
+            return 0
+        with self._lock:
+            sample = self._random.lognormvariate(
+                math.log(median_ms), self.latency_sigma
+            )
+        return sample / 1000
+
+    def _upload(self, body, content_type):
+        image = _get_uploaded_image(body, content_type)
+        if image is None:
+            return 400, _error("Missing image.")
+        content_key = hashlib.sha256(image).hexdigest()
+        upload_id = f"sim_{content_key[:24]}"
+        with self._lock:
+            self._uploads[upload_id] = content_key
+        return 200, _success({"upload_id": upload_id})
+
+    def _with_image_key(self, params, build_result):
+        if "image_url" in params:
+            return 200, build_result(params["image_url"])
+        with self._lock:
+            content_key = self._uploads.get(params.get("image_upload_id"))
+        if content_key is None:
+            return 400, _error("Unknown or missing image_upload_id.")
+        return 200, build_result(content_key)
+
+    def _tags(self, image_key):
+        digest = hashlib.sha256(image_key.encode()).digest()
+        tags = []
+        for i, byte in enumerate(digest[: self.tag_count]):
+            name = SIMULATED_TAGS[byte % len(SIMULATED_TAGS)]
+            if name not in [tag["tag"]["en"] for tag in tags]:
+                tags.append(
+                    {"confidence": 100.0 - i * 10 - byte / 64, "tag": {"en": name}}
+                )
+        return _success({"tags": tags})
+
+    def _categories(self, image_key):
+        digest = hashlib.sha256(b"nsfw:" + image_key.encode()).digest()
+        is_nsfw = int.from_bytes(digest[:4], "big") / 2**32 < self.nsfw_rate
+        safe_confidence = 5.0 if is_nsfw else 95.0
+        return _success(
+            {
+                "categories": [
+                    {"confidence": safe_confidence, "name": {"en": "safe"}},
+                    {"confidence": 100.0 - safe_confidence, "name": {"en": "explicit"}},
+                ]
+            }
+        )
+
+
+def build_simulator_server(simulator: ImaggaSimulator, host="127.0.0.1", port=8001):
+    """
+    Build an HTTP server for the simulator; each request is handled on its own thread, like the real API.
+
+    :return: ThreadingHTTPServer; call `serve_forever()` to start it
+    """
+
+    class SimulatorRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._respond()
+
+        def do_POST(self):
+            self._respond()
+
+        def log_message(self, format, *args):
+            pass
+
+        def _respond(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not self.headers.get("Authorization"):
+                status_code, payload = 401, _error("Missing credentials.")
+            else:
+                status_code, payload = simulator.handle(
+                    self.command,
+                    self.path,
+                    body,
+                    self.headers.get("Content-Type", ""),
+                )
+            content = json.dumps(payload).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            if status_code == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer((host, port), SimulatorRequestHandler)
+    server.daemon_threads = True
+    return server
+
+
+def _get_uploaded_image(body, content_type):
+    """
+    Get the bytes of the `image` field of a multipart/form-data body. Only the file is hashed, as the body also holds a
+    boundary that is random for every request.
+
+    :return: bytes, or None if the body has no `image` field
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    if not message.is_multipart():
+        return None
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == "image":
+            return part.get_payload(decode=True)
+    return None
+
+
+def _success(result):
+    return {"result": result, "status": {"text": "", "type": "success"}}
+
+
+def _error(text):
+    return {"status": {"text": text, "type": "error"}}
@@ -1,15 +1,76 @@
+import hashlib
 import io
+import json
+import os
+import random
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
 from logging import Logger
+from urllib.parse import urlencode
 from rest_framework.exceptions import ValidationError, ErrorDetail
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import LiveServerTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 import mock
+import requests
 import pytest
 
 from core.clients import ImaggaClient
-from core.models import AppConfig, FeatureFlag, Image, SourceType
+from core.benchmark import (
+    delete_benchmark_images,
+    run_workload,
+    seed_benchmark_images,
+    summarize_samples,
+)
+from core.autocomplete import TagAutocompleteIndex
+from core.config import ConfigCache
+from core.metrics import Counter, Gauge, Histogram, MetricsRegistry
+from core.duplicates import find_near_duplicates, index_perceptual_hash
+from core.imaging import get_dhash, prepare_detection_upload
+from core.pagination import ImageCursorPagination
+from core.simulator import ImaggaSimulator, build_simulator_server
+from core.search import rank_images_by_tags
+from core.query import (
+    And,
+    Not,
+    Or,
+    QuerySyntaxError,
+    Term,
+    parse_object_query,
+    plan_object_query,
+)
+from core.resilience import CircuitBreaker, ImaggaUnavailable, TokenBucket
+from core.response_cache import ImaggaResponseCache, normalize_image_url
+from core.result_cache import (
+    IMAGES_GENERATION,
+    ResultCache,
+    get_generation,
+    image_result_cache,
+)
+from core.jobs import enqueue_tagging_job, process_next_tagging_job
+from core.export import parse_export_filters
+from core.models import (
+    AppConfig,
+    CachedImaggaResponse,
+    CircuitBreakerState,
+    CircuitState,
+    FeatureFlag,
+    Image,
+    ImageTag,
+    SourceType,
+    Tag,
+    TaggingJob,
+    TokenBucketState,
+    UploadStatusType,
+)
 from core.constants import IMAGGA_NSFW_CHECK_FF_NAME
 from core.services import (
     get_blacklisted_items,
+    index_image_tags,
     process_image_upload,
     validate_blacklisted_items,
     validate_nsfw,
@@ -22,11 +83,13 @@ from core.serializers import ImageSerializer
 from django.contrib.auth.models import User
 
 
-@mock.patch("core.views.process_image_upload")
+@mock.patch("core.jobs.process_image_upload")
 @mock.patch.object(Logger, "info")
 @mock.patch.object(Logger, "warn")
 class ImageViewTests(APITestCase):
     def setUp(self):
+        # The test database is rolled back between tests, and with it the generation the cache is keyed on
+        image_result_cache.clear()
         self.user = User.objects.create_user(username="testuser", password="testpass")
         self.client.login(username="testuser", password="testpass")
         self.image_data = {
@@ -47,12 +110,198 @@ class ImageViewTests(APITestCase):
 
         # Assert
         result_image = Image.objects.get(id=response.data["id"])
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         self.assertEqual(response.data, result_image.to_dict())
-        mock_process_image_upload.assert_called_with(result_image)
+        self.assertEqual(
+            response["Location"], reverse("image-status", args=[result_image.id])
+        )
+        self.assertEqual(
+            result_image.image_upload.status, UploadStatusType.PENDING.name
+        )
+        self.assertTrue(TaggingJob.objects.filter(image=result_image).exists())
+        # Object detection is left to the `process_tagging_jobs` worker
+        mock_process_image_upload.assert_not_called()
         mock_info.assert_not_called()
         mock_warn.assert_not_called()
 
+    def test_objects_sent_by_the_client_are_searchable_after_create_and_update(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-list")
+        image_data = {
+            "label": "Dog",
+            "source_type": "URL",
+            "source_url": "https://example.com/dog.jpg",
+            "detected_objects": ["Dog", "ball"],
+            "detect_objects": "false",
+        }
+
+        # Act
+        image_id = self.client.post(url, image_data, format="json").data["id"]
+        bulk_response = self.client.post(
+            reverse("image-bulk"),
+            [{**image_data, "detected_objects": ["dog"]}],
+            format="json",
+        )
+        dog_ids_after_create = [
+            image["id"]
+            for image in self.client.get(url, {"objects": "dog"}).data["results"]
+        ]
+        image_data["detected_objects"] = ["cat", "ball"]
+        del image_data["detect_objects"]
+        update_response = self.client.put(
+            reverse("image-detail", args=[image_id]), image_data, format="json"
+        )
+        dog_ids_after_update = [
+            image["id"]
+            for image in self.client.get(url, {"objects": "dog"}).data["results"]
+        ]
+        cat_ids_after_update = [
+            image["id"]
+            for image in self.client.get(url, {"objects": "cat"}).data["results"]
+        ]
+
+        # Assert
+        bulk_image_id = bulk_response.data["results"][0]["image"]["id"]
+        self.assertEqual(dog_ids_after_create, [image_id, bulk_image_id])
+        self.assertEqual(update_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(dog_ids_after_update, [bulk_image_id])
+        self.assertEqual(cat_ids_after_update, [image_id])
+        self.assertEqual(
+            dict(Tag.objects.values_list("name", "image_count")),
+            {"dog": 1, "ball": 1, "cat": 1},
+        )
+        self.assertEqual(
+            set(
+                ImageTag.objects.filter(image_id=image_id).values_list(
+                    "tag__name", "confidence"
+                )
+            ),
+            {("cat", 0.0), ("ball", 0.0)},
+        )
+
+    def test_bulk_create_reports_per_item_results_with_partial_failures(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-bulk")
+        items = [
+            {
+                "label": "Dog",
+                "source_type": "URL",
+                "source_url": "https://example.com/dog.jpg",
+                "detect_objects": True,
+            },
+            {"label": "Missing url", "source_type": "URL"},
+            {
+                "label": "Cat",
+                "source_type": "URL",
+                "source_url": "https://example.com/cat.jpg",
+            },
+        ]
+
+        # Act
+        with self.assertNumQueries(11):
+            response = self.client.post(url, items, format="json")
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data["results"]
+        self.assertEqual(
+            [result["status"] for result in results], ["accepted", "invalid", "created"]
+        )
+        self.assertIn("non_field_errors", results[1]["errors"])
+        dog_image = Image.objects.get(id=results[0]["image"]["id"])
+        cat_image = Image.objects.get(id=results[2]["image"]["id"])
+        self.assertEqual(dog_image.uploaded_by, self.user)
+        self.assertEqual(dog_image.image_upload.status, UploadStatusType.PENDING.name)
+        self.assertTrue(TaggingJob.objects.filter(image=dog_image).exists())
+        self.assertIsNone(cat_image.image_upload)
+        mock_process_image_upload.assert_not_called()
+
+    def test_bulk_create_accepts_uploaded_files_referenced_by_field_name(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-bulk")
+        data = {
+            "images": json.dumps(
+                [
+                    {
+                        "label": "Upload",
+                        "source_type": "UPLOAD",
+                        "source": "file0",
+                        "detect_objects": "true",
+                    }
+                ]
+            ),
+            "file0": self._generate_photo_file(),
+        }
+
+        # Act
+        response = self.client.post(url, data, format="multipart")
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        image = Image.objects.get(id=response.data["results"][0]["image"]["id"])
+        self.assertTrue(image.source.name.endswith(".png"))
+        self.assertIsNotNone(image.content_hash)
+
+    def test_bulk_create_rejects_too_many_items(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-bulk")
+        items = [{"source_type": "URL", "source_url": "https://example.com/a.jpg"}] * 3
+
+        # Act
+        with self.settings(IMAGE_BULK_MAX_ITEMS=2):
+            response = self.client.post(url, items, format="json")
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+    def test_detection_status_reports_the_image_upload_status(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        image = Image.objects.create(
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+            uploaded_by=self.user,
+        )
+        enqueue_tagging_job(image)
+        url = reverse("image-status", args=[image.id])
+
+        # Act
+        response = self.client.get(url)
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], UploadStatusType.PENDING.value)
+        self.assertIsNone(response.data["detected_objects"])
+
+    def test_create_image_hashes_the_upload_and_shares_the_stored_file(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-list")
+        content = self.image_data["source"].getvalue()
+        self.client.post(url, self.image_data, format="multipart")
+        self.image_data["source"] = self._generate_photo_file()
+
+        # Act
+        response = self.client.post(url, self.image_data, format="multipart")
+
+        # Assert
+        first_image, second_image = Image.objects.order_by("id")
+        self.assertEqual(second_image.id, response.data["id"])
+        self.assertEqual(second_image.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(second_image.content_hash, first_image.content_hash)
+        self.assertEqual(second_image.source.name, first_image.source.name)
+
     def test_skip_object_detection(
         self, mock_warn, mock_info, mock_process_image_upload
     ):
@@ -76,11 +325,15 @@ class ImageViewTests(APITestCase):
         self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
-        Image.objects.create(
-            label="Image 1", detected_objects="cat,dog", uploaded_by=self.user
+        index_image_tags(
+            Image.objects.create(
+                label="Image 1", detected_objects="cat,dog", uploaded_by=self.user
+            )
         )
-        Image.objects.create(
-            label="Image 2", detected_objects="dog", uploaded_by=self.user
+        index_image_tags(
+            Image.objects.create(
+                label="Image 2", detected_objects="dog", uploaded_by=self.user
+            )
         )
         url = reverse("image-list")
 
@@ -89,217 +342,661 @@ class ImageViewTests(APITestCase):
 
         # Assert
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data["results"]), 1)
         mock_process_image_upload.assert_not_called()
         mock_info.assert_not_called()
         mock_warn.assert_not_called()
 
-    def test_handle_validation_error(
+    def test_list_images_with_objects_only_matches_whole_tags(
         self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
+        index_image_tags(
+            Image.objects.create(
+                label="Image 1", detected_objects=["catamaran"], uploaded_by=self.user
+            )
+        )
+        cat_image = Image.objects.create(
+            label="Image 2", detected_objects=["Cat", "sofa"], uploaded_by=self.user
+        )
+        index_image_tags(cat_image)
         url = reverse("image-list")
-        self.image_data["source"] = ""
 
         # Act
-        response = self.client.post(url, self.image_data, format="multipart")
+        response = self.client.get(url, {"objects": "cat"})
 
         # Assert
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn("detail", response.data)
-        mock_process_image_upload.assert_not_called()
-        mock_info.assert_not_called()
-        mock_warn.assert_not_called()
-
-    def _generate_photo_file(self):
-        file = io.BytesIO()
-        from PIL import Image as PILImage
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [image["id"] for image in response.data["results"]], [cat_image.id]
+        )
 
-        image = PILImage.new("RGBA", size=(100, 100), color=(155, 0, 0))
-        image.save(file, "png")
-        file.name = "test.png"
-        file.seek(0)
-        return file
+    def test_list_images_pages_with_cursors_and_without_counting(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        images = [
+            Image.objects.create(label=f"Image {i}", detected_objects=["dog"])
+            for i in range(5)
+        ]
+        for image in images:
+            index_image_tags(image)
+        url = reverse("image-list")
 
+        for params in [{}, {"objects": "dog"}]:
+            # Act
+            page_ids = []
+            next_url = f"{url}?{urlencode({**params, 'page_size': 2})}"
+            with CaptureQueriesContext(connection) as queries:
+                while next_url:
+                    response = self.client.get(next_url)
+                    page_ids.append([image["id"] for image in response.data["results"]])
+                    next_url = response.data["next"]
 
-@pytest.mark.django_db
-class TestProcessImageUpload(TestCase):
-    def setUp(self):
-        FeatureFlag.objects.create(name=IMAGGA_NSFW_CHECK_FF_NAME, active=True)
+            # Assert
+            self.assertEqual(
+                page_ids,
+                [
+                    [images[0].id, images[1].id],
+                    [images[2].id, images[3].id],
+                    [images[4].id],
+                ],
+            )
+            self.assertFalse(
+                any("COUNT(*)" in query["sql"] for query in queries.captured_queries)
+            )
 
-    @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
-    @mock.patch("core.services.validate_nsfw", return_value=True)
-    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
-    def test_process_image_upload_when_image_source_type_is_upload_and_passes_nsfw_checks(
-        self,
-        mock_blacklisted_items,
-        mock_validate_nsfw,
-        mock_get_tag_image_for_upload,
-        mock_upload_image,
+    def test_list_images_with_objects_ranks_by_relevance_above_min_confidence(
+        self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
-        mock_upload_image.return_value = {
-            "result": {"upload_id": "12345"},
-            "status": {"text": "", "type": "success"},
-        }
-        mock_get_tag_image_for_upload.return_value = {
-            "result": {
-                "tags": [
-                    {"confidence": 25.1324, "tag": {"en": "dog"}},
-                    {"confidence": 15.1324, "tag": {"en": "cat"}},
-                ]
-            }
-        }
-
-        image = Image(id=1, source_type=SourceType.UPLOAD.name)
+        confidences = [
+            {"dog": 40.0, "cat": 30.0},
+            {"dog": 90.0, "cat": 10.0},
+            {"dog": 95.0, "cat": 60.0},
+            {"dog": 20.0, "cat": 50.0},
+            {"dog": 99.0},
+        ]
+        images = []
+        for tag_confidences in confidences:
+            image = Image.objects.create(detected_objects=list(tag_confidences))
+            index_image_tags(image, tag_confidences)
+            images.append(image)
+        url = reverse("image-list")
 
-        # Act
-        process_image_upload(image)
+        for params, expected_images in [
+            ({"objects": "dog,cat"}, [images[2], images[1], images[0], images[3]]),
+            ({"objects": "dog,cat", "min_confidence": 25}, [images[2], images[0]]),
+            (
+                {"objects": "dog,cat", "ordering": "id"},
+                [images[0], images[1], images[2], images[3]],
+            ),
+        ]:
+            # Act
+            results = []
+            next_url = f"{url}?{urlencode({**params, 'page_size': 1})}"
+            while next_url:
+                response = self.client.get(next_url)
+                results.extend(response.data["results"])
+                next_url = response.data["next"]
 
-        # assert
-        self.assertEqual(image.detected_objects, ["dog", "cat"])
-        self.assertEqual(image.image_upload.upload_id, "12345")
+            # Assert
+            self.assertEqual(
+                [image["id"] for image in results],
+                [image.id for image in expected_images],
+            )
+        self.assertEqual(
+            self.client.get(url, {"objects": "dog"}).data["results"][0]["relevance"],
+            99.0,
+        )
+        self.assertEqual(
+            self.client.get(url, {"objects": "dog", "min_confidence": 101}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
 
-    @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
-    @mock.patch("core.services.validate_nsfw", return_value=False)
-    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
-    @mock.patch.object(Logger, "warn")
-    def test_process_image_upload_when_image_source_type_is_upload_but_fails_nsfw_check(
-        self,
-        mock_warn_logger,
-        mock_blacklisted_items,
-        mock_validate_nsfw,
-        mock_get_tag_image_for_upload,
-        mock_upload_image,
+    def test_list_images_with_an_objects_query_combines_and_or_not(
+        self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
-        mock_upload_image.return_value = {
-            "result": {"upload_id": "12345"},
-            "status": {"text": "", "type": "success"},
-        }
-        mock_get_tag_image_for_upload.return_value = {
-            "result": {
-                "tags": [
-                    {"confidence": 25.1324, "tag": {"en": "dog"}},
-                    {"confidence": 15.1324, "tag": {"en": "cat"}},
-                ]
-            }
-        }
-
-        image = Image(id=1, source_type=SourceType.UPLOAD.name)
+        images = {}
+        for label, detected_objects in [
+            ("dog outdoors", ["dog", "ball"]),
+            ("dog indoors", ["dog", "indoor"]),
+            ("cat indoors", ["cat", "indoor"]),
+            ("golden retriever", ["golden retriever", "frisbee"]),
+        ]:
+            images[label] = Image.objects.create(
+                label=label, detected_objects=detected_objects
+            )
+            index_image_tags(images[label])
+        url = reverse("image-list")
 
-        # Act
-        with self.assertRaises(ValidationError) as ve:
-            process_image_upload(image)
+        for objects, expected_labels in [
+            ("dog AND NOT indoor", ["dog outdoors"]),
+            (
+                "(dog OR golden retriever) AND (ball OR frisbee)",
+                ["dog outdoors", "golden retriever"],
+            ),
+            ("indoor AND NOT (cat OR unicorn)", ["dog indoors"]),
+            ("NOT unicorn AND cat", ["cat indoors"]),
+            ("unicorn OR cat", ["cat indoors"]),
+        ]:
+            # Act
+            response = self.client.get(url, {"objects": objects})
 
-        # assert
-        self.assertEqual(image.detected_objects, ["dog", "cat"])
-        self.assertIsNotNone(image.image_upload)
-        mock_warn_logger.assert_called_once_with(
-            f"Image {image.id} contains NSFW content. Image blacklisted."
-        )
+            # Assert
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [image["id"] for image in response.data["results"]],
+                [images[label].id for label in expected_labels],
+            )
         self.assertEqual(
-            ve.exception.detail,
-            [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
+            self.client.get(url, {"objects": "dog AND (cat"}).status_code,
+            status.HTTP_400_BAD_REQUEST,
         )
 
-    @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
-    @mock.patch("core.services.validate_nsfw", return_value=True)
-    @mock.patch("core.services.validate_blacklisted_items", return_value=False)
-    @mock.patch.object(Logger, "warn")
-    def test_process_image_upload_when_image_source_type_is_upload_but_fails_blacklisted_items_check(
-        self,
-        mock_warn_logger,
-        mock_blacklisted_items,
-        mock_validate_nsfw,
-        mock_get_tag_image_for_upload,
-        mock_upload_image,
+    def test_list_images_with_facets_counts_the_objects_of_every_match(
+        self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
-        mock_upload_image.return_value = {
-            "result": {"upload_id": "12345"},
-            "status": {"text": "", "type": "success"},
-        }
-        mock_get_tag_image_for_upload.return_value = {
-            "result": {
-                "tags": [
-                    {"confidence": 25.1324, "tag": {"en": "dog"}},
-                    {"confidence": 15.1324, "tag": {"en": "cat"}},
-                ]
-            }
-        }
+        for detected_objects, blacklisted in [
+            (["dog", "grass", "ball"], False),
+            (["dog", "grass"], False),
+            (["dog", "sofa"], False),
+            (["cat", "sofa"], False),
+            (["dog", "knife"], True),
+        ]:
+            index_image_tags(
+                Image.objects.create(
+                    detected_objects=detected_objects, blacklisted=blacklisted
+                )
+            )
+        url = reverse("image-list")
 
-        image = Image(id=1, source_type=SourceType.UPLOAD.name)
+        for params, expected_facets in [
+            (
+                {"objects": "dog", "page_size": 1},
+                [("grass", 2), ("ball", 1), ("sofa", 1)],
+            ),
+            (
+                {"objects": "dog AND NOT ball", "page_size": 1},
+                [("grass", 1), ("sofa", 1)],
+            ),
+            ({"objects": "dog", "blacklisted": "true"}, [("knife", 1)]),
+            (
+                {},
+                [("dog", 3), ("grass", 2), ("sofa", 2), ("ball", 1), ("cat", 1)],
+            ),
+        ]:
+            # Act
+            response = self.client.get(url, {**params, "facets": "true"})
+
+            # Assert
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [
+                    (facet["name"], facet["image_count"])
+                    for facet in response.data["facets"]
+                ],
+                expected_facets,
+            )
+        self.assertNotIn("facets", self.client.get(url, {"objects": "dog"}).data)
+
+    def test_list_images_serves_repeated_searches_from_the_result_cache(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        image = Image.objects.create(detected_objects=["dog", "cat"])
+        index_image_tags(image)
+        url = reverse("image-list")
+        first_response = self.client.get(url, {"objects": "dog,cat"})
 
         # Act
-        with self.assertRaises(ValidationError) as ve:
-            process_image_upload(image)
+        with CaptureQueriesContext(connection) as queries:
+            cached_response = self.client.get(url, {"objects": "cat AND dog"})
+        new_image = Image.objects.create(detected_objects=["cat", "dog"])
+        index_image_tags(new_image)
+        response_after_write = self.client.get(url, {"objects": "dog,cat"})
 
-        # assert
-        self.assertEqual(image.detected_objects, ["dog", "cat"])
-        self.assertIsNotNone(image.image_upload)
-        mock_warn_logger.assert_called_once_with(
-            f"Image {image.id} contains NSFW content. Image blacklisted."
+        # Assert
+        self.assertEqual(cached_response.data, first_response.data)
+        self.assertFalse(
+            any(
+                "core_image" in query["sql"]
+                and "core_cachegeneration" not in query["sql"]
+                for query in queries.captured_queries
+            )
         )
         self.assertEqual(
-            ve.exception.detail,
-            [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
+            [image["id"] for image in response_after_write.data["results"]],
+            [image.id, new_image.id],
         )
 
-    @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image")
-    @mock.patch("core.services.validate_nsfw", return_value=True)
-    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
-    def test_process_image_upload_when_image_source_type_is_url_and_passes_nsfw_checks(
-        self,
-        mock_blacklisted_items,
-        mock_validate_nsfw,
-        mock_get_tag_image,
-        mock_upload_image,
+    def test_retrieve_image_answers_conditional_requests_with_not_modified(
+        self, mock_warn, mock_info, mock_process_image_upload
     ):
         # Arrange
-        mock_get_tag_image.return_value = {
-            "result": {
-                "tags": [
+        image = Image.objects.create(detected_objects=["dog"])
+        url = reverse("image-detail", args=[image.id])
+        response = self.client.get(url)
+
+        # Act
+        etag_response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        date_response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        image.label = "updated"
+        image.save()
+        response_after_write = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(etag_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(etag_response["ETag"], response["ETag"])
+        self.assertEqual(etag_response.content, b"")
+        self.assertEqual(date_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response_after_write.status_code, status.HTTP_200_OK)
+        self.assertEqual(response_after_write.data["label"], "updated")
+        self.assertNotEqual(response_after_write["ETag"], response["ETag"])
+
+    def test_list_images_answers_conditional_requests_with_not_modified(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        image = Image.objects.create(detected_objects=["dog"])
+        index_image_tags(image)
+        url = reverse("image-list")
+        response = self.client.get(url, {"objects": "dog"})
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            not_modified_response = self.client.get(
+                url, {"objects": "dog"}, HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        other_search_response = self.client.get(
+            url, {"objects": "cat"}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        index_image_tags(Image.objects.create(detected_objects=["dog"]))
+        response_after_write = self.client.get(
+            url, {"objects": "dog"}, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+
+        # Assert
+        self.assertEqual(
+            not_modified_response.status_code, status.HTTP_304_NOT_MODIFIED
+        )
+        self.assertFalse(
+            any("core_image" in query["sql"] for query in queries.captured_queries)
+        )
+        self.assertEqual(other_search_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response_after_write.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response_after_write.data["results"]), 2)
+
+    def test_tags_suggests_the_most_common_tags_for_a_prefix(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        for detected_objects in [
+            ["dog", "dock"],
+            ["dog", "door"],
+            ["dog", "door"],
+            ["cat"],
+        ]:
+            index_image_tags(Image.objects.create(detected_objects=detected_objects))
+        url = reverse("tag-autocomplete")
+
+        # Act
+        response = self.client.get(url, {"prefix": "Do", "limit": 2})
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["results"],
+            [{"name": "dog", "image_count": 3}, {"name": "door", "image_count": 2}],
+        )
+        self.assertEqual(
+            self.client.get(url, {"prefix": "doc"}).data["results"],
+            [{"name": "dock", "image_count": 1}],
+        )
+        self.assertEqual(
+            self.client.get(url, {"limit": 0}).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_list_images_caps_the_page_size(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        for i in range(3):
+            Image.objects.create(label=f"Image {i}")
+        url = reverse("image-list")
+
+        # Act
+        with mock.patch.object(ImageCursorPagination, "max_page_size", 2):
+            response = self.client.get(url, {"page_size": 100})
+
+        # Assert
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_list_images_uses_the_same_number_of_queries_for_any_page_size(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        for i in range(20):
+            image = Image.objects.create(
+                label=f"Image {i}",
+                source_type=SourceType.UPLOAD.name,
+                source="2024/01/01/test.png",
+                detected_objects=["dog"],
+                uploaded_by=self.user,
+            )
+            index_image_tags(image)
+        url = reverse("image-list")
+        self.client.get(url)  # Load the session before counting
+
+        for params in [{}, {"objects": "dog"}]:
+            query_counts = []
+            for page_size in [1, 20]:
+                # Act
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, {**params, "page_size": page_size})
+
+                # Assert
+                self.assertEqual(len(response.data["results"]), page_size)
+                query_counts.append(len(queries))
+            self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_list_and_retrieve_image_match_the_serializer(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        image = Image.objects.create(
+            label="Image 1",
+            source_type=SourceType.UPLOAD.name,
+            source="2024/01/01/test.png",
+            detected_objects=["dog"],
+            uploaded_by=self.user,
+        )
+        list_response = self.client.get(reverse("image-list"))
+        request = list_response.wsgi_request
+
+        # Act
+        response = self.client.get(reverse("image-detail", args=[image.id]))
+
+        # Assert
+        expected = ImageSerializer(image, context={"request": request}).data
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, expected)
+        self.assertEqual(list_response.data["results"], [expected])
+        self.assertEqual(
+            self.client.get(reverse("image-detail", args=[0])).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_image_variant_is_generated_once_and_served_from_disk(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        self.image_data["detect_objects"] = False
+        image_id = self.client.post(
+            reverse("image-list"), self.image_data, format="multipart"
+        ).data["id"]
+        url = reverse("image-variant", args=[image_id, "small", "webp"])
+        # Images uploaded before content hashing are hashed on first use
+        Image.objects.filter(id=image_id).update(content_hash=None)
+        date_updated = Image.objects.get(id=image_id).date_updated
+        generation = get_generation(IMAGES_GENERATION)
+
+        with tempfile.TemporaryDirectory() as variant_root, override_settings(
+            IMAGE_VARIANT_ROOT=variant_root
+        ):
+            # Act
+            response = self.client.get(url)
+            with mock.patch("core.variants.resize_image") as mock_resize_image:
+                second_response = self.client.get(url)
+                second_response.close()
+
+            # Assert
+            from PIL import Image as PILImage
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response["Content-Type"], "image/webp")
+            with PILImage.open(
+                io.BytesIO(b"".join(response.streaming_content))
+            ) as variant:
+                self.assertEqual(variant.size, (100, 100))
+            response.close()
+            self.assertEqual(second_response.status_code, status.HTTP_200_OK)
+            mock_resize_image.assert_not_called()
+            image = Image.objects.get(id=image_id)
+            content_hash = image.content_hash
+            self.assertEqual(image.date_updated, date_updated)
+            self.assertEqual(get_generation(IMAGES_GENERATION), generation)
+            self.assertTrue(
+                os.path.exists(
+                    os.path.join(
+                        variant_root, content_hash[:2], content_hash, "128.webp"
+                    )
+                )
+            )
+        self.assertEqual(
+            self.client.get(
+                reverse("image-variant", args=[image_id, "huge", "webp"])
+            ).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_media_is_served_with_caching_conditional_and_range_support(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        self.image_data["detect_objects"] = False
+        source_url = self.client.post(
+            reverse("image-list"), self.image_data, format="multipart"
+        ).data["source"]
+        size = Image.objects.get().source.size
+
+        # Act
+        response = self.client.get(source_url)
+        body = b"".join(response.streaming_content)
+        not_modified_response = self.client.get(
+            source_url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        range_response = self.client.get(source_url, HTTP_RANGE="bytes=0-9")
+        suffix_range_response = self.client.get(source_url, HTTP_RANGE="bytes=-5")
+        unsatisfiable_response = self.client.get(
+            source_url, HTTP_RANGE=f"bytes={size}-"
+        )
+        invalid_range_response = self.client.get(source_url, HTTP_RANGE="bytes=5-2")
+        with override_settings(MEDIA_SENDFILE_BACKEND="x-accel-redirect"):
+            accel_response = self.client.get(source_url)
+        self.client.logout()
+        anonymous_response = self.client.get(source_url)
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(len(body), size)
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(not_modified_response.status_code, 304)
+        self.assertEqual(not_modified_response["ETag"], response["ETag"])
+        self.assertEqual(range_response.status_code, 206)
+        self.assertEqual(range_response["Content-Range"], f"bytes 0-9/{size}")
+        self.assertEqual(b"".join(range_response.streaming_content), body[:10])
+        self.assertEqual(b"".join(suffix_range_response.streaming_content), body[-5:])
+        self.assertEqual(unsatisfiable_response.status_code, 416)
+        self.assertEqual(invalid_range_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(invalid_range_response.streaming_content), body)
+        self.assertEqual(
+            accel_response["X-Accel-Redirect"],
+            "/protected/images/" + Image.objects.get().source.name,
+        )
+        self.assertEqual(accel_response.content, b"")
+        self.assertIn(anonymous_response.status_code, (401, 403))
+
+    def test_export_images_streams_ndjson_matching_to_dict(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        cat_image = Image.objects.create(
+            label="Image 1", detected_objects=["cat"], uploaded_by=self.user
+        )
+        index_image_tags(cat_image)
+        index_image_tags(
+            Image.objects.create(label="Image 2", detected_objects=["dog"])
+        )
+        url = reverse("image-export")
+
+        # Act
+        response = self.client.get(url, {"objects": "cat"})
+        gzip_response = self.client.get(url, {"compress": "gzip"})
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [json.loads(json.dumps(cat_image.to_dict()))],
+        )
+        self.assertEqual(gzip_response["Content-Type"], "application/gzip")
+        gzip_lines = zlib.decompress(
+            b"".join(gzip_response.streaming_content), wbits=zlib.MAX_WBITS | 16
+        ).splitlines()
+        self.assertEqual(len(gzip_lines), 2)
+
+    def test_export_images_rejects_invalid_dates(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-export")
+
+        # Act
+        response = self.client.get(url, {"created_after": "yesterday"})
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("detail", response.data)
+
+    def test_export_filters_read_dates_without_an_offset_in_the_current_time_zone(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Act
+        filters = parse_export_filters(
+            created_after="2024-07-24T10:00:00",
+            created_before="2024-07-25T10:00:00+02:00",
+        )
+
+        # Assert
+        self.assertEqual(
+            filters["created_after"],
+            timezone.make_aware(datetime(2024, 7, 24, 10)),
+        )
+        self.assertEqual(
+            filters["created_before"],
+            datetime(2024, 7, 25, 8, tzinfo=dt_timezone.utc),
+        )
+
+    def test_handle_validation_error(
+        self, mock_warn, mock_info, mock_process_image_upload
+    ):
+        # Arrange
+        url = reverse("image-list")
+        self.image_data["source"] = ""
+
+        # Act
+        response = self.client.post(url, self.image_data, format="multipart")
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("detail", response.data)
+        mock_process_image_upload.assert_not_called()
+        mock_info.assert_not_called()
+        mock_warn.assert_not_called()
+
+    def _generate_photo_file(self):
+        file = io.BytesIO()
+        from PIL import Image as PILImage
+
+        image = PILImage.new("RGBA", size=(100, 100), color=(155, 0, 0))
+        image.save(file, "png")
+        file.name = "test.png"
+        file.seek(0)
+        return file
+
+
+@pytest.mark.django_db
+class TestProcessImageUpload(TestCase):
+    def setUp(self):
+        FeatureFlag.objects.create(name=IMAGGA_NSFW_CHECK_FF_NAME, active=True)
+
+    @mock.patch("core.services.prepare_detection_upload")
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
+    @mock.patch("core.services.validate_nsfw", return_value=True)
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    def test_process_image_upload_when_image_source_type_is_upload_and_passes_nsfw_checks(
+        self,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image_for_upload,
+        mock_upload_image,
+        mock_prepare_detection_upload,
+    ):
+        # Arrange
+        mock_upload_image.return_value = {
+            "result": {"upload_id": "12345"},
+            "status": {"text": "", "type": "success"},
+        }
+        mock_get_tag_image_for_upload.return_value = {
+            "result": {
+                "tags": [
                     {"confidence": 25.1324, "tag": {"en": "dog"}},
                     {"confidence": 15.1324, "tag": {"en": "cat"}},
                 ]
             }
         }
 
-        image = Image(
-            id=1,
-            source_type=SourceType.URL.name,
-            source_url="https://example.com/image.jpg",
-        )
+        image = Image(id=1, source_type=SourceType.UPLOAD.name)
 
         # Act
         process_image_upload(image)
 
         # assert
-        mock_upload_image.assert_not_called()
         self.assertEqual(image.detected_objects, ["dog", "cat"])
-        # image_upload should only be created when the system has to upload the image to Imagga first
-        self.assertIsNone(image.image_upload)
+        self.assertEqual(image.image_upload.upload_id, "12345")
+        self.assertEqual(
+            dict(
+                ImageTag.objects.filter(image=image).values_list(
+                    "tag__name", "confidence"
+                )
+            ),
+            {"dog": 25.1324, "cat": 15.1324},
+        )
 
+    @mock.patch("core.services.prepare_detection_upload")
     @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
     @mock.patch("core.services.validate_nsfw", return_value=False)
     @mock.patch("core.services.validate_blacklisted_items", return_value=True)
     @mock.patch.object(Logger, "warn")
-    def test_process_image_upload_when_image_source_type_is_url_but_fails_nsfw_check(
+    def test_process_image_upload_when_image_source_type_is_upload_but_fails_nsfw_check(
         self,
         mock_warn_logger,
         mock_blacklisted_items,
         mock_validate_nsfw,
-        mock_get_tag_image,
+        mock_get_tag_image_for_upload,
         mock_upload_image,
+        mock_prepare_detection_upload,
     ):
         # Arrange
-        mock_get_tag_image.return_value = {
+        mock_upload_image.return_value = {
+            "result": {"upload_id": "12345"},
+            "status": {"text": "", "type": "success"},
+        }
+        mock_get_tag_image_for_upload.return_value = {
             "result": {
                 "tags": [
                     {"confidence": 25.1324, "tag": {"en": "dog"}},
@@ -308,21 +1005,15 @@ class TestProcessImageUpload(TestCase):
             }
         }
 
-        image = Image(
-            id=1,
-            source_type=SourceType.URL.name,
-            source_url="https://example.com/image.jpg",
-        )
+        image = Image(id=1, source_type=SourceType.UPLOAD.name)
 
         # Act
         with self.assertRaises(ValidationError) as ve:
             process_image_upload(image)
 
         # assert
-        mock_upload_image.assert_not_called()
         self.assertEqual(image.detected_objects, ["dog", "cat"])
-        # image_upload should only be created when the system has to upload the image to Imagga first
-        self.assertIsNone(image.image_upload)
+        self.assertIsNotNone(image.image_upload)
         mock_warn_logger.assert_called_once_with(
             f"Image {image.id} contains NSFW content. Image blacklisted."
         )
@@ -331,21 +1022,27 @@ class TestProcessImageUpload(TestCase):
             [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
         )
 
+    @mock.patch("core.services.prepare_detection_upload")
     @mock.patch.object(ImaggaClient, "upload_image")
-    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
     @mock.patch("core.services.validate_nsfw", return_value=True)
     @mock.patch("core.services.validate_blacklisted_items", return_value=False)
     @mock.patch.object(Logger, "warn")
-    def test_process_image_upload_when_image_source_type_is_url_but_fails_blacklisted_item_check(
+    def test_process_image_upload_when_image_source_type_is_upload_but_fails_blacklisted_items_check(
         self,
         mock_warn_logger,
         mock_blacklisted_items,
         mock_validate_nsfw,
-        mock_get_tag_image,
+        mock_get_tag_image_for_upload,
         mock_upload_image,
+        mock_prepare_detection_upload,
     ):
         # Arrange
-        mock_get_tag_image.return_value = {
+        mock_upload_image.return_value = {
+            "result": {"upload_id": "12345"},
+            "status": {"text": "", "type": "success"},
+        }
+        mock_get_tag_image_for_upload.return_value = {
             "result": {
                 "tags": [
                     {"confidence": 25.1324, "tag": {"en": "dog"}},
@@ -354,21 +1051,15 @@ class TestProcessImageUpload(TestCase):
             }
         }
 
-        image = Image(
-            id=1,
-            source_type=SourceType.URL.name,
-            source_url="https://example.com/image.jpg",
-        )
+        image = Image(id=1, source_type=SourceType.UPLOAD.name)
 
         # Act
         with self.assertRaises(ValidationError) as ve:
             process_image_upload(image)
 
         # assert
-        mock_upload_image.assert_not_called()
         self.assertEqual(image.detected_objects, ["dog", "cat"])
-        # image_upload should only be created when the system has to upload the image to Imagga first
-        self.assertIsNone(image.image_upload)
+        self.assertIsNotNone(image.image_upload)
         mock_warn_logger.assert_called_once_with(
             f"Image {image.id} contains NSFW content. Image blacklisted."
         )
@@ -377,21 +1068,262 @@ class TestProcessImageUpload(TestCase):
             [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
         )
 
-    @mock.patch.object(Logger, "warn")
-    @mock.patch.object(ImaggaClient, "check_nsfw_categories")
-    def test_validate_nsfw_returns_false_if_image_contains_nsfw_content(
-        self, mock_check_nsfw_categories, mock_warn_log
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch("core.services.validate_nsfw", return_value=True)
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    def test_process_image_upload_when_image_source_type_is_url_and_passes_nsfw_checks(
+        self,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image,
+        mock_upload_image,
     ):
         # Arrange
-        image = mock.Mock(Image)
-
-        mock_check_nsfw_categories.return_value = {
+        mock_get_tag_image.return_value = {
             "result": {
-                "categories": [
-                    {"confidence": 50, "name": {"en": "safe"}},
-                    {"confidence": 50, "name": {"en": "naughty_stuff"}},
+                "tags": [
+                    {"confidence": 25.1324, "tag": {"en": "dog"}},
+                    {"confidence": 15.1324, "tag": {"en": "cat"}},
                 ]
-            },
+            }
+        }
+
+        image = Image(
+            id=1,
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+        )
+
+        # Act
+        process_image_upload(image)
+
+        # assert
+        mock_upload_image.assert_not_called()
+        self.assertEqual(image.detected_objects, ["dog", "cat"])
+        # image_upload should only be created when the system has to upload the image to Imagga first
+        self.assertIsNone(image.image_upload)
+
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch("core.services.validate_nsfw", return_value=False)
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    @mock.patch.object(Logger, "warn")
+    def test_process_image_upload_when_image_source_type_is_url_but_fails_nsfw_check(
+        self,
+        mock_warn_logger,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image,
+        mock_upload_image,
+    ):
+        # Arrange
+        mock_get_tag_image.return_value = {
+            "result": {
+                "tags": [
+                    {"confidence": 25.1324, "tag": {"en": "dog"}},
+                    {"confidence": 15.1324, "tag": {"en": "cat"}},
+                ]
+            }
+        }
+
+        image = Image(
+            id=1,
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+        )
+
+        # Act
+        with self.assertRaises(ValidationError) as ve:
+            process_image_upload(image)
+
+        # assert
+        mock_upload_image.assert_not_called()
+        self.assertEqual(image.detected_objects, ["dog", "cat"])
+        # image_upload should only be created when the system has to upload the image to Imagga first
+        self.assertIsNone(image.image_upload)
+        mock_warn_logger.assert_called_once_with(
+            f"Image {image.id} contains NSFW content. Image blacklisted."
+        )
+        self.assertEqual(
+            ve.exception.detail,
+            [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
+        )
+
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch("core.services.validate_nsfw", return_value=True)
+    @mock.patch("core.services.validate_blacklisted_items", return_value=False)
+    @mock.patch.object(Logger, "warn")
+    def test_process_image_upload_when_image_source_type_is_url_but_fails_blacklisted_item_check(
+        self,
+        mock_warn_logger,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image,
+        mock_upload_image,
+    ):
+        # Arrange
+        mock_get_tag_image.return_value = {
+            "result": {
+                "tags": [
+                    {"confidence": 25.1324, "tag": {"en": "dog"}},
+                    {"confidence": 15.1324, "tag": {"en": "cat"}},
+                ]
+            }
+        }
+
+        image = Image(
+            id=1,
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+        )
+
+        # Act
+        with self.assertRaises(ValidationError) as ve:
+            process_image_upload(image)
+
+        # assert
+        mock_upload_image.assert_not_called()
+        self.assertEqual(image.detected_objects, ["dog", "cat"])
+        # image_upload should only be created when the system has to upload the image to Imagga first
+        self.assertIsNone(image.image_upload)
+        mock_warn_logger.assert_called_once_with(
+            f"Image {image.id} contains NSFW content. Image blacklisted."
+        )
+        self.assertEqual(
+            ve.exception.detail,
+            [ErrorDetail(string="Image contains NSFW content.", code="invalid")],
+        )
+
+    @mock.patch.object(ImaggaClient, "get_tag_image")
+    @mock.patch("core.services.validate_nsfw")
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    def test_process_image_upload_runs_nsfw_check_concurrently_with_tagging(
+        self,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image,
+    ):
+        # Arrange
+        nsfw_check_started = threading.Event()
+
+        def validate_nsfw(image):
+            nsfw_check_started.set()
+            return True
+
+        def get_tag_image(image_url):
+            # Only returns once the NSFW check is running at the same time
+            self.assertTrue(nsfw_check_started.wait(timeout=5))
+            return {"result": {"tags": [{"confidence": 25.1, "tag": {"en": "dog"}}]}}
+
+        mock_validate_nsfw.side_effect = validate_nsfw
+        mock_get_tag_image.side_effect = get_tag_image
+        image = Image(
+            id=1,
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+        )
+
+        # Act
+        process_image_upload(image)
+
+        # Assert
+        mock_validate_nsfw.assert_called_once_with(image)
+        self.assertEqual(image.detected_objects, ["dog"])
+
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
+    @mock.patch("core.services.validate_nsfw")
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    @mock.patch.object(Logger, "info")
+    def test_process_image_upload_reuses_detected_objects_of_an_identical_upload(
+        self,
+        mock_info_logger,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image_for_upload,
+        mock_upload_image,
+    ):
+        # Arrange
+        previous_image = Image.objects.create(
+            source_type=SourceType.UPLOAD.name,
+            content_hash="a" * 64,
+            detected_objects=["dog", "cat"],
+        )
+        image = Image.objects.create(
+            source_type=SourceType.UPLOAD.name, content_hash="a" * 64
+        )
+
+        # Act
+        process_image_upload(image)
+
+        # Assert
+        mock_upload_image.assert_not_called()
+        mock_get_tag_image_for_upload.assert_not_called()
+        mock_validate_nsfw.assert_not_called()
+        self.assertEqual(image.detected_objects, ["dog", "cat"])
+        mock_info_logger.assert_called_once_with(
+            f"Image {image.id} has the same content as image {previous_image.id}. Reusing its detected objects."
+        )
+
+    @mock.patch.object(ImaggaClient, "upload_image")
+    @mock.patch.object(ImaggaClient, "get_tag_image_for_upload")
+    @mock.patch("core.services.validate_nsfw")
+    @mock.patch("core.services.validate_blacklisted_items", return_value=True)
+    @mock.patch.object(Logger, "info")
+    def test_process_image_upload_reuses_detected_objects_of_a_near_duplicate(
+        self,
+        mock_info_logger,
+        mock_blacklisted_items,
+        mock_validate_nsfw,
+        mock_get_tag_image_for_upload,
+        mock_upload_image,
+    ):
+        # Arrange
+        Image.objects.create(
+            source_type=SourceType.UPLOAD.name,
+            perceptual_hash="ffff000000000000",
+            detected_objects=["tree"],
+        )
+        previous_image = Image.objects.create(
+            source_type=SourceType.UPLOAD.name,
+            perceptual_hash="f0f0f0f0f0f0f0f0",
+            detected_objects=["dog", "cat"],
+        )
+        for indexed_image in Image.objects.all():
+            index_perceptual_hash(indexed_image)
+        image = Image.objects.create(
+            source_type=SourceType.UPLOAD.name, perceptual_hash="f0f0f0f0f0f0f0f3"
+        )
+
+        # Act
+        process_image_upload(image)
+
+        # Assert
+        mock_upload_image.assert_not_called()
+        mock_get_tag_image_for_upload.assert_not_called()
+        self.assertEqual(image.detected_objects, ["dog", "cat"])
+        mock_info_logger.assert_called_once_with(
+            f"Image {image.id} looks the same as image {previous_image.id}. Reusing its detected objects."
+        )
+        self.assertEqual(image.hash_bands.count(), 4)
+
+    @mock.patch.object(Logger, "warn")
+    @mock.patch.object(ImaggaClient, "check_nsfw_categories")
+    def test_validate_nsfw_returns_false_if_image_contains_nsfw_content(
+        self, mock_check_nsfw_categories, mock_warn_log
+    ):
+        # Arrange
+        image = mock.Mock(Image)
+
+        mock_check_nsfw_categories.return_value = {
+            "result": {
+                "categories": [
+                    {"confidence": 50, "name": {"en": "safe"}},
+                    {"confidence": 50, "name": {"en": "naughty_stuff"}},
+                ]
+            },
             "status": {"text": "en", "type": "success"},
         }
 
@@ -422,6 +1354,7 @@ class TestProcessImageUpload(TestCase):
         # Assert
         self.assertFalse(result)
         self.assertTrue(image.blacklisted)
+        image.save.assert_not_called()
 
     @mock.patch("core.services.get_blacklisted_items", return_value=["cow"])
     def test_images_detected_objects_does_not_contain_blacklisted_items(
@@ -439,6 +1372,25 @@ class TestProcessImageUpload(TestCase):
         self.assertTrue(result)
         self.assertIsNone(image.blacklisted)
 
+    def test_index_image_tags_syncs_index_with_detected_objects(self):
+        # Arrange
+        image = Image.objects.create(
+            source_type=SourceType.URL.name, detected_objects=["dog", "cat"]
+        )
+        index_image_tags(image)
+        image.detected_objects = ["dog", "ball"]
+
+        # Act
+        index_image_tags(image)
+
+        # Assert
+        self.assertEqual(
+            set(
+                ImageTag.objects.filter(image=image).values_list("tag__name", flat=True)
+            ),
+            {"dog", "ball"},
+        )
+
     def test_get_blacklisted_items(self):
         # Arrange
         AppConfig.objects.create(key="blacklisted_items", value="dog,cat")
@@ -446,3 +1398,1039 @@ class TestProcessImageUpload(TestCase):
         # Act
         result = get_blacklisted_items()
         self.assertEqual(result, ["dog", "cat"])
+
+
+@pytest.mark.django_db
+class TestRankImagesByTags(TestCase):
+    @mock.patch("core.search.RANKING_MIN_BATCH_SIZE", 1)
+    def test_rank_images_by_tags_matches_sorting_every_match(self):
+        # Arrange
+        rng = random.Random(7)
+        images = Image.objects.bulk_create(Image() for _ in range(60))
+        for image in images:
+            # Few distinct confidences, so many images tie on score
+            image.detected_objects = rng.sample(["dog", "cat", "ball"], 2)
+            index_image_tags(
+                image,
+                {
+                    name: rng.choice([10.0, 50.0, 90.0])
+                    for name in image.detected_objects
+                },
+            )
+        confidences = {}
+        for image_id, name, confidence in ImageTag.objects.values_list(
+            "image_id", "tag__name", "confidence"
+        ):
+            confidences.setdefault(image_id, {})[name] = confidence
+        expected = sorted(
+            (
+                (image_id, tags["dog"] + tags["cat"])
+                for image_id, tags in confidences.items()
+                if "dog" in tags and "cat" in tags
+            ),
+            key=lambda result: (-result[1], result[0]),
+        )
+
+        # Act
+        first_page = rank_images_by_tags(["dog", "cat"], 5)
+        next_page = rank_images_by_tags(["dog", "cat"], 5, after=first_page[-1][::-1])
+        everything = rank_images_by_tags(["dog", "cat"], 1000)
+        paged = []
+        while page := rank_images_by_tags(
+            ["dog", "cat"], 3, after=paged[-1][::-1] if paged else None
+        ):
+            paged += page
+
+        # Assert
+        self.assertEqual(first_page, expected[:5])
+        self.assertEqual(next_page, expected[5:10])
+        self.assertEqual(everything, expected)
+        self.assertEqual(paged, expected)
+        self.assertEqual(rank_images_by_tags(["dog", "unicorn"], 5), [])
+
+    @mock.patch("core.search.RANKING_MIN_BATCH_SIZE", 1)
+    def test_rank_images_by_tags_reads_deep_pages_from_the_cursor(self):
+        # Arrange
+        for i in range(40):
+            index_image_tags(
+                Image.objects.create(detected_objects=["dog"]), {"dog": i % 4 * 10.0}
+            )
+        expected = sorted(
+            ImageTag.objects.values_list("image_id", "confidence"),
+            key=lambda result: (-result[1], result[0]),
+        )
+        with CaptureQueriesContext(connection) as first_page_queries:
+            first_page = rank_images_by_tags(["dog"], 5)
+
+        # Act
+        with self.assertNumQueries(len(first_page_queries)):
+            deep_page = rank_images_by_tags(["dog"], 5, after=expected[29][::-1])
+
+        # Assert
+        self.assertEqual(first_page, expected[:5])
+        self.assertEqual(deep_page, expected[30:35])
+
+
+class TestObjectQuery(TestCase):
+    def test_parse_object_query(self):
+        for text, expected_query in [
+            ("dog, cat", And((Term("dog"), Term("cat")))),
+            (
+                "Golden Retriever AND NOT indoor",
+                And((Term("golden retriever"), Not(Term("indoor")))),
+            ),
+            (
+                'dog OR cat AND "and"',
+                Or((Term("dog"), And((Term("cat"), Term("and"))))),
+            ),
+            (
+                "(dog OR cat) AND NOT NOT ball",
+                And((Or((Term("dog"), Term("cat"))), Not(Not(Term("ball"))))),
+            ),
+            ("  ", None),
+        ]:
+            # Act
+            query = parse_object_query(text)
+
+            # Assert
+            self.assertEqual(query, expected_query)
+
+    def test_parse_object_query_rejects_invalid_queries(self):
+        for text in ["dog AND", "(dog", "dog)", "OR cat", '""', "NOT " * 20 + "dog"]:
+            # Act / Assert
+            with self.assertRaises(QuerySyntaxError):
+                parse_object_query(text)
+
+    def test_plan_object_query_drives_from_the_rarest_tag(self):
+        # Arrange
+        for i in range(5):
+            image = Image.objects.create(
+                detected_objects=["indoor", "dog"] if i == 0 else ["indoor"]
+            )
+            index_image_tags(image)
+        dog = Tag.objects.get(name="dog")
+        indoor = Tag.objects.get(name="indoor")
+
+        # Act
+        sql = str(
+            Image.objects.filter(
+                plan_object_query(parse_object_query("indoor AND NOT dog"))
+            ).query
+        )
+        rare_first_sql = str(
+            Image.objects.filter(
+                plan_object_query(parse_object_query("indoor AND dog"))
+            ).query
+        )
+
+        # Assert
+        self.assertEqual((dog.image_count, indoor.image_count), (1, 5))
+        # `indoor` has to drive when the only other operand is negated
+        self.assertIn(f'"tag_id" IN ({indoor.id})', sql.split("EXISTS")[0])
+        self.assertIn(f'"tag_id" IN ({dog.id})', sql.split("EXISTS")[1])
+        self.assertIn(f'"tag_id" IN ({dog.id})', rare_first_sql.split("EXISTS")[0])
+        self.assertIsNone(plan_object_query(parse_object_query("dog AND unicorn")))
+
+    def test_tag_image_count_leaves_out_blacklisted_images(self):
+        # Arrange
+        image = Image.objects.create(detected_objects=["dog", "knife"])
+        index_image_tags(image)
+        index_image_tags(Image.objects.create(detected_objects=["dog"]))
+
+        # Act
+        image.blacklisted = True
+        image.save()
+        counts_after_blacklisting = dict(Tag.objects.values_list("name", "image_count"))
+        image.delete()
+
+        # Assert
+        self.assertEqual(counts_after_blacklisting, {"dog": 1, "knife": 0})
+        self.assertEqual(
+            dict(Tag.objects.values_list("name", "image_count")),
+            {"dog": 1, "knife": 0},
+        )
+
+    def test_tag_image_count_follows_indexed_and_deleted_images(self):
+        # Arrange
+        image = Image.objects.create(detected_objects=["dog", "cat"])
+        index_image_tags(image)
+        index_image_tags(Image.objects.create(detected_objects=["dog"]))
+        image.detected_objects = ["dog", "ball"]
+
+        # Act
+        index_image_tags(image)
+        counts_after_reindex = dict(Tag.objects.values_list("name", "image_count"))
+        image.delete()
+
+        # Assert
+        self.assertEqual(counts_after_reindex, {"dog": 2, "cat": 0, "ball": 1})
+        self.assertEqual(
+            dict(Tag.objects.values_list("name", "image_count")),
+            {"dog": 1, "cat": 0, "ball": 0},
+        )
+
+
+class TestResultCache(TestCase):
+    def test_result_cache_evicts_least_recently_used_entries_and_older_generations(
+        self,
+    ):
+        # Arrange
+        cache = ResultCache(max_entries=2, max_bytes=100)
+        cache.set("a", 1, "A", size=10)
+        cache.set("b", 1, "B", size=10)
+        cache.get("a", 1)
+
+        # Act
+        cache.set("c", 1, "C", size=10)
+        after_entry_limit = [cache.get(key, 1) for key in "abc"]
+        cache.set("d", 1, "D", size=95)
+        after_size_limit = [cache.get(key, 1) for key in "acd"]
+        cache.set("too large", 1, "X", size=101)
+
+        # Assert
+        self.assertEqual(after_entry_limit, ["A", None, "C"])
+        self.assertEqual(after_size_limit, [None, None, "D"])
+        self.assertIsNone(cache.get("too large", 1))
+        self.assertIsNone(cache.get("d", 2))
+        cache.set("e", 1, "E", size=10)
+        self.assertIsNone(cache.get("e", 1))
+
+    def test_bump_generation(self):
+        # Arrange
+        generation = get_generation(IMAGES_GENERATION)
+
+        # Act
+        Image.objects.create()
+
+        # Assert
+        self.assertGreater(get_generation(IMAGES_GENERATION), generation)
+
+
+class TestTagAutocompleteIndex(TestCase):
+    def test_suggest_reloads_only_the_tags_updated_since_the_last_load(self):
+        # Arrange
+        index = TagAutocompleteIndex(ttl=0, max_limit=5)
+        Tag.objects.bulk_create(
+            [Tag(name=f"tag-{i}", image_count=i) for i in range(20)]
+        )
+        self.assertEqual(
+            index.suggest("tag-1", 3), [("tag-19", 19), ("tag-18", 18), ("tag-17", 17)]
+        )
+        image = Image.objects.create(detected_objects=["tag-1", "tag-new"])
+
+        # Act
+        index_image_tags(image)
+        with CaptureQueriesContext(connection) as queries:
+            suggestions = index.suggest("tag-", 2)
+        image.delete()
+
+        # Assert
+        self.assertEqual(suggestions, [("tag-19", 19), ("tag-18", 18)])
+        # The version stamp, then only the tags updated since the last load
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertIn("date_updated", queries.captured_queries[1]["sql"])
+        self.assertEqual(index.suggest("tag-n", 5), [])
+        self.assertEqual(index.suggest("tag-1", 5)[-1], ("tag-15", 15))
+        self.assertEqual(index.suggest("t", 1), [("tag-19", 19)])
+
+
+class TestPrepareDetectionUpload(TestCase):
+    def test_large_image_is_rotated_and_downsized_to_a_jpeg(self):
+        # Arrange
+        from PIL import Image as PILImage
+
+        exif = PILImage.Exif()
+        exif[0x0112] = 6  # Rotate 90 degrees clockwise when displayed
+        file = io.BytesIO()
+        PILImage.new("RGB", size=(400, 200), color=(155, 0, 0)).save(
+            file, "JPEG", exif=exif
+        )
+        image_file = ContentFile(file.getvalue(), name="photo.jpeg")
+
+        # Act
+        result = prepare_detection_upload(image_file, max_dimension=100, quality=80)
+
+        # Assert
+        self.assertEqual(result.name, "photo.jpg")
+        with PILImage.open(io.BytesIO(result.read())) as prepared:
+            self.assertEqual(prepared.format, "JPEG")
+            self.assertEqual(prepared.size, (50, 100))
+
+    def test_small_image_is_uploaded_as_is(self):
+        # Arrange
+        from PIL import Image as PILImage
+
+        file = io.BytesIO()
+        PILImage.new("RGBA", size=(50, 50)).save(file, "PNG")
+        image_file = ContentFile(file.getvalue(), name="small.png")
+
+        # Act
+        result = prepare_detection_upload(image_file, max_dimension=100, quality=80)
+
+        # Assert
+        self.assertIs(result, image_file)
+
+    def test_corrupt_image_is_rejected(self):
+        # Arrange
+        image_file = ContentFile(b"\x89PNG\r\n\x1a\nnot an image", name="bad.png")
+
+        # Act / Assert
+        with self.assertRaises(ValidationError):
+            prepare_detection_upload(image_file, max_dimension=100, quality=80)
+
+
+class TestNearDuplicates(TestCase):
+    def test_dhash_is_close_for_a_resized_copy_and_far_for_another_image(self):
+        # Arrange
+        from PIL import Image as PILImage
+
+        def to_file(pil_image, image_format, name):
+            file = io.BytesIO()
+            pil_image.save(file, image_format)
+            return ContentFile(file.getvalue(), name=name)
+
+        photo = PILImage.radial_gradient("L").convert("RGB")
+        other = PILImage.linear_gradient("L").rotate(90).convert("RGB")
+
+        # Act
+        original_hash = get_dhash(to_file(photo, "PNG", "photo.png"))
+        resized_hash = get_dhash(to_file(photo.resize((90, 90)), "JPEG", "small.jpg"))
+        other_hash = get_dhash(to_file(other, "PNG", "other.png"))
+
+        # Assert
+        def distance(a, b):
+            return (int(a, 16) ^ int(b, 16)).bit_count()
+
+        self.assertLessEqual(distance(original_hash, resized_hash), 5)
+        self.assertGreater(distance(original_hash, other_hash), 20)
+
+    def test_find_near_duplicates_matches_a_full_scan(self):
+        # Arrange
+        import random
+
+        rng = random.Random(7)
+        target = rng.getrandbits(64)
+        hashes = [target ^ (1 << bit) ^ (1 << (bit + 20)) for bit in range(10)]
+        hashes += [target ^ rng.getrandbits(64) for _ in range(20)]
+        hashes += [target ^ 0b111111 for _ in range(2)]
+        for perceptual_hash in hashes:
+            index_perceptual_hash(
+                Image.objects.create(perceptual_hash=f"{perceptual_hash:016x}")
+            )
+
+        for max_distance in [0, 2, 6]:
+            # Act
+            matches = find_near_duplicates(f"{target:016x}", max_distance)
+
+            # Assert
+            expected = sorted(
+                (
+                    (image.id, (int(image.perceptual_hash, 16) ^ target).bit_count())
+                    for image in Image.objects.all()
+                    if (int(image.perceptual_hash, 16) ^ target).bit_count()
+                    <= max_distance
+                ),
+                key=lambda match: (match[1], match[0]),
+            )
+            self.assertEqual(matches, expected)
+        self.assertEqual(len(find_near_duplicates(f"{target:016x}", 6)), 12)
+
+    def test_duplicates_endpoint_lists_near_duplicates_closest_first(self):
+        # Arrange
+        user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_login(user)
+        image = Image.objects.create(
+            source="2024/01/01/a.png", perceptual_hash="00000000000000ff"
+        )
+        closest = Image.objects.create(perceptual_hash="00000000000000fe")
+        further = Image.objects.create(perceptual_hash="00000000000000f0")
+        Image.objects.create(perceptual_hash="00000000000000f0", blacklisted=True)
+        Image.objects.create(perceptual_hash="ffffffff00000000")
+        for indexed_image in Image.objects.all():
+            index_perceptual_hash(indexed_image)
+        url = reverse("image-duplicates", args=[image.id])
+
+        # Act
+        response = self.client.get(url, {"max_distance": 4})
+        invalid_response = self.client.get(url, {"max_distance": 64})
+
+        # Assert
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(match["id"], match["distance"]) for match in response.data["results"]],
+            [(closest.id, 1), (further.id, 4)],
+        )
+        self.assertEqual(invalid_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("core.views.get_dhash", return_value="00000000000000ff")
+    def test_duplicates_endpoint_hashes_unhashed_images_without_a_write(
+        self, mock_get_dhash
+    ):
+        # Arrange
+        user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.force_login(user)
+        image = Image.objects.create(source="2024/01/01/a.png")
+        duplicate = Image.objects.create(perceptual_hash="00000000000000fe")
+        index_perceptual_hash(duplicate)
+        date_updated = image.date_updated
+        generation = get_generation(IMAGES_GENERATION)
+
+        # Act
+        response = self.client.get(reverse("image-duplicates", args=[image.id]))
+
+        # Assert
+        self.assertEqual(
+            [match["id"] for match in response.data["results"]], [duplicate.id]
+        )
+        image.refresh_from_db()
+        self.assertEqual(image.perceptual_hash, "00000000000000ff")
+        self.assertEqual(image.date_updated, date_updated)
+        self.assertEqual(get_generation(IMAGES_GENERATION), generation)
+
+
+@override_settings(QUERY_COUNT_HEADER_ENABLED=True)
+class TestBenchmark(LiveServerTestCase):
+    def test_workloads_report_latency_throughput_and_queries(self):
+        # Arrange
+        User.objects.create_user(username="benchmark", password="benchmark")
+        image_ids, tag_names = seed_benchmark_images(
+            20, tag_vocabulary_size=5, tags_per_image=2
+        )
+
+        for workload in ["list", "search", "detail", "create"]:
+            # Act
+            summary, created_ids = run_workload(
+                self.live_server_url,
+                workload,
+                ("benchmark", "benchmark"),
+                image_ids,
+                tag_names,
+                concurrency=1,
+                request_count=4,
+            )
+
+            # Assert
+            self.assertEqual(summary["requests"], 4)
+            self.assertEqual(summary["errors"], 0, summary["status_codes"])
+            self.assertGreater(summary["throughput_rps"], 0)
+            self.assertLessEqual(
+                summary["latency_ms"]["p50"], summary["latency_ms"]["p99"]
+            )
+            self.assertGreater(summary["db_queries_per_request"]["mean"], 0)
+            self.assertEqual(len(created_ids), 4 if workload == "create" else 0)
+
+    def test_delete_benchmark_images_deletes_the_seeded_tags(self):
+        # Arrange
+        image_ids, tag_names = seed_benchmark_images(
+            10, tag_vocabulary_size=3, tags_per_image=2
+        )
+        other_image = Image.objects.create(detected_objects=[tag_names[0]])
+        index_image_tags(other_image)
+
+        # Act
+        delete_benchmark_images(image_ids, tag_names)
+
+        # Assert
+        self.assertFalse(Image.objects.filter(id__in=image_ids).exists())
+        self.assertEqual(
+            list(
+                Tag.objects.filter(name__in=tag_names).values_list(
+                    "name", "image_count"
+                )
+            ),
+            [(tag_names[0], 1)],
+        )
+
+    def test_summarize_samples_uses_nearest_rank_percentiles(self):
+        # Arrange
+        samples = [(i / 1000, 200, 3) for i in range(1, 101)] + [(0.5, None, None)]
+
+        # Act
+        summary = summarize_samples(samples, duration=2.0)
+
+        # Assert
+        self.assertEqual(summary["latency_ms"]["p50"], 51.0)
+        self.assertEqual(summary["latency_ms"]["p99"], 100.0)
+        self.assertEqual(summary["errors"], 1)
+        self.assertEqual(summary["status_codes"], {"200": 100, "failed": 1})
+        self.assertEqual(summary["throughput_rps"], 50.5)
+        self.assertEqual(summary["db_queries_per_request"], {"mean": 3.0, "max": 3})
+
+
+class TestMetrics(TestCase):
+    def test_registry_renders_prometheus_text_format(self):
+        # Arrange
+        registry = MetricsRegistry()
+        calls = Counter("calls", "Calls", ["status"], registry=registry)
+        in_flight = Gauge("in_flight", "In flight", registry=registry)
+        latency = Histogram(
+            "latency_seconds",
+            "Latency",
+            ["stage"],
+            buckets=(0.1, 1.0),
+            registry=registry,
+        )
+
+        # Act
+        calls.labels(status='say "hi"').inc()
+        calls.labels(status='say "hi"').inc(2)
+        with in_flight.labels().track_in_progress():
+            in_flight_value = registry.render()
+        for value in [0.05, 0.5, 5.0]:
+            latency.labels("upload").observe(value)
+        rendered = registry.render()
+
+        # Assert
+        self.assertIn("in_flight 1\n", in_flight_value)
+        self.assertIn("# TYPE calls counter\n", rendered)
+        self.assertIn('calls_total{status="say \\"hi\\""} 3\n', rendered)
+        self.assertIn("in_flight 0\n", rendered)
+        self.assertIn('latency_seconds_bucket{stage="upload",le="0.1"} 1\n', rendered)
+        self.assertIn('latency_seconds_bucket{stage="upload",le="1"} 2\n', rendered)
+        self.assertIn('latency_seconds_bucket{stage="upload",le="+Inf"} 3\n', rendered)
+        self.assertIn('latency_seconds_count{stage="upload"} 3\n', rendered)
+        self.assertIn('latency_seconds_sum{stage="upload"} 5.55\n', rendered)
+
+    @mock.patch("requests.Session.request")
+    def test_metrics_endpoint_reports_requests_and_imagga_calls(self, mock_request):
+        # Arrange
+        mock_request.return_value = mock.Mock(status_code=503, text="Unavailable")
+        with self.assertRaises(ValueError):
+            ImaggaClient("key", "secret").get_tag_image_for_upload("upload")
+        self.client.get(reverse("image-list"))
+        anonymous_response = self.client.get(reverse("metrics"))
+        self.client.force_login(
+            User.objects.create_user(username="prometheus", password="prometheus")
+        )
+
+        # Act
+        response = self.client.get(reverse("metrics"))
+
+        # Assert
+        content = response.content.decode()
+        self.assertEqual(anonymous_response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertNotIn("imagesearch_", anonymous_response.content.decode())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'imagesearch_http_request_duration_seconds_count{view="image-list",method="GET",status="403"}',
+            content,
+        )
+        self.assertIn(
+            'imagesearch_imagga_request_duration_seconds_count{endpoint="tags",status="503"}',
+            content,
+        )
+
+
+class TestConfigCache(TestCase):
+    def test_serves_lookups_from_memory_until_the_ttl_expires(self):
+        # Arrange
+        cache = ConfigCache(ttl=60)
+        AppConfig.objects.create(key="blacklisted_items", value="dog,cat")
+        FeatureFlag.objects.create(name=IMAGGA_NSFW_CHECK_FF_NAME, active=True)
+        cache.get_value("blacklisted_items")
+
+        # Act
+        with self.assertNumQueries(0):
+            blacklisted_items = cache.get_list("blacklisted_items")
+            nsfw_check_active = cache.is_feature_active(IMAGGA_NSFW_CHECK_FF_NAME)
+            missing_value = cache.get_float("missing_key")
+
+        # Assert
+        self.assertEqual(blacklisted_items, ["dog", "cat"])
+        self.assertTrue(nsfw_check_active)
+        self.assertIsNone(missing_value)
+
+    def test_reloads_when_the_version_stamp_changes(self):
+        # Arrange
+        cache = ConfigCache(ttl=0)
+        app_config = AppConfig.objects.create(
+            key="safety_confidence_threshold", value="51.0"
+        )
+        cache.get_float("safety_confidence_threshold")
+        app_config.value = "25.0"
+        app_config.save()
+
+        # Act
+        result = cache.get_float("safety_confidence_threshold")
+
+        # Assert
+        self.assertEqual(result, 25.0)
+
+    def test_skips_reload_when_the_version_stamp_is_unchanged(self):
+        # Arrange
+        cache = ConfigCache(ttl=0)
+        AppConfig.objects.create(key="blacklisted_items", value="dog")
+        cache.get_list("blacklisted_items")
+
+        # Act
+        with self.assertNumQueries(2):
+            result = cache.get_list("blacklisted_items")
+
+        # Assert
+        self.assertEqual(result, ["dog"])
+
+
+class TestImaggaClient(TestCase):
+    def setUp(self):
+        self.imagga_client = ImaggaClient(
+            "key", "secret", connect_timeout=1.0, read_timeout=5.0, max_retries=2
+        )
+
+    @mock.patch("requests.Session.request")
+    def test_requests_reuse_the_session_with_timeouts_and_encoded_params(
+        self, mock_request
+    ):
+        # Arrange
+        mock_request.return_value = mock.Mock(
+            status_code=200, json=mock.Mock(return_value={"result": {"tags": []}})
+        )
+
+        # Act
+        result = self.imagga_client.get_tag_image(
+            "https://example.com/a.jpg?size=large&x=1"
+        )
+
+        # Assert
+        self.assertEqual(result, {"result": {"tags": []}})
+        mock_request.assert_called_once_with(
+            "GET",
+            "https://api.imagga.com/v2/tags",
+            auth=("key", "secret"),
+            timeout=(1.0, 5.0),
+            params={"image_url": "https://example.com/a.jpg?size=large&x=1"},
+        )
+
+    @mock.patch("requests.Session.request")
+    def test_upload_image_closes_the_file_after_uploading(self, mock_request):
+        # Arrange
+        mock_request.return_value = mock.Mock(
+            status_code=200,
+            json=mock.Mock(return_value={"result": {"upload_id": "12345"}}),
+        )
+        image_file = mock.MagicMock(name="image_file")
+        image_file.name = "2024/07/24/test.png"
+
+        # Act
+        result = self.imagga_client.upload_image(image_file)
+
+        # Assert
+        self.assertEqual(result, {"result": {"upload_id": "12345"}})
+        image_file.open.assert_called_once_with("rb")
+        image_file.open.return_value.__exit__.assert_called_once()
+        self.assertEqual(
+            mock_request.call_args.kwargs["files"],
+            {
+                "image": (
+                    "test.png",
+                    image_file.open.return_value.__enter__.return_value,
+                )
+            },
+        )
+
+    @mock.patch("core.clients.time.sleep")
+    @mock.patch("requests.Session.request")
+    def test_throttled_and_failed_calls_are_retried_with_a_token_per_attempt(
+        self, mock_request, mock_sleep
+    ):
+        # Arrange
+        rate_limiter = mock.Mock()
+        client = ImaggaClient("key", "secret", max_retries=2, rate_limiter=rate_limiter)
+        mock_request.side_effect = [
+            mock.Mock(status_code=429, headers={"Retry-After": "3"}),
+            requests.ConnectionError(),
+            mock.Mock(
+                status_code=200, json=mock.Mock(return_value={"result": {"tags": []}})
+            ),
+        ]
+
+        # Act
+        result = client.get_tag_image_for_upload("upload")
+
+        # Assert
+        self.assertEqual(result, {"result": {"tags": []}})
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(rate_limiter.acquire.call_count, 3)
+        self.assertEqual(mock_sleep.call_args_list[0], mock.call(3.0))
+        self.assertEqual(
+            self.imagga_client.session.get_adapter(
+                "https://api.imagga.com/v2/tags"
+            ).max_retries.total,
+            0,
+        )
+
+    def test_error_response_handler_raises_with_response_text(self):
+        # Arrange
+        response = mock.Mock(status_code=502, text="Bad Gateway")
+
+        # Act
+        with self.assertRaises(ValueError) as ve:
+            self.imagga_client._error_response_handler(response)
+
+        # Assert
+        self.assertIn("Bad Gateway", str(ve.exception))
+
+
+class TestImaggaSimulator(TestCase):
+    def _start_simulator(self, **kwargs):
+        server = build_simulator_server(
+            ImaggaSimulator(latency_median_ms=0, seed=1, **kwargs), port=0
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return ImaggaClient(
+            "key",
+            "secret",
+            api_url=f"http://127.0.0.1:{server.server_port}/v2/",
+            max_retries=0,
+        )
+
+    def test_client_tags_urls_and_uploads_deterministically(self):
+        # Arrange
+        client = self._start_simulator(nsfw_rate=1.0)
+
+        # Act
+        url_tags = client.get_tag_image("https://example.com/dog.jpg")
+        repeated_url_tags = client.get_tag_image("https://example.com/dog.jpg")
+        upload_ids = [
+            client.upload_image(ContentFile(b"image bytes", name=name))["result"][
+                "upload_id"
+            ]
+            for name in ["test.png", "copy.png"]
+        ]
+        upload_tags = client.get_tag_image_for_upload(upload_ids[0])
+        repeated_upload_tags = client.get_tag_image_for_upload(upload_ids[1])
+        categories = client.check_nsfw_categories(
+            Image(source_url="https://example.com/dog.jpg")
+        )
+
+        # Assert
+        self.assertEqual(url_tags, repeated_url_tags)
+        self.assertTrue(url_tags["result"]["tags"])
+        self.assertEqual(url_tags["status"]["type"], "success")
+        self.assertTrue(upload_tags["result"]["tags"])
+        self.assertEqual(upload_ids[0], upload_ids[1])
+        self.assertEqual(upload_tags, repeated_upload_tags)
+        self.assertEqual(
+            categories["result"]["categories"][0],
+            {"confidence": 5.0, "name": {"en": "safe"}},
+        )
+
+    def test_simulated_errors_reach_the_client(self):
+        # Arrange
+        client = self._start_simulator(error_rate=1.0)
+
+        # Act / Assert
+        with self.assertRaises(ValueError):
+            client.get_tag_image("https://example.com/dog.jpg")
+        with self.assertRaises(ValueError):
+            client.get_tag_image_for_upload("unknown")
+
+
+class TestImaggaResilience(TestCase):
+    @mock.patch("requests.Session.request")
+    def test_circuit_opens_after_consecutive_failures_and_closes_after_a_probe(
+        self, mock_request
+    ):
+        # Arrange
+        circuit_breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        client = ImaggaClient(
+            "key", "secret", max_retries=0, circuit_breaker=circuit_breaker
+        )
+        mock_request.return_value = mock.Mock(status_code=503, text="Unavailable")
+
+        # Act
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                client.get_tag_image_for_upload("upload")
+        with self.assertRaises(ImaggaUnavailable) as open_error:
+            client.get_tag_image_for_upload("upload")
+        calls_while_open = mock_request.call_count
+        CircuitBreakerState.objects.filter(name="test").update(
+            opened_at=timezone.now() - timedelta(seconds=61)
+        )
+        mock_request.return_value = mock.Mock(
+            status_code=200, json=mock.Mock(return_value={"result": {"tags": []}})
+        )
+        probe_result = client.get_tag_image_for_upload("upload")
+
+        # Assert
+        self.assertEqual(calls_while_open, 2)
+        self.assertGreater(open_error.exception.retry_after, 0)
+        self.assertEqual(probe_result, {"result": {"tags": []}})
+        state = CircuitBreakerState.objects.get(name="test")
+        self.assertEqual(state.state, CircuitState.CLOSED.name)
+        self.assertEqual(state.consecutive_failures, 0)
+
+    @mock.patch("requests.Session.request")
+    def test_failed_probe_reopens_the_circuit(self, mock_request):
+        # Arrange
+        circuit_breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=60)
+        CircuitBreakerState.objects.create(
+            name="test",
+            state=CircuitState.OPEN.name,
+            consecutive_failures=5,
+            opened_at=timezone.now() - timedelta(seconds=61),
+        )
+        mock_request.side_effect = requests.Timeout()
+        client = ImaggaClient(
+            "key", "secret", max_retries=0, circuit_breaker=circuit_breaker
+        )
+
+        # Act
+        with self.assertRaises(requests.Timeout):
+            client.get_tag_image_for_upload("upload")
+
+        # Assert
+        self.assertEqual(
+            CircuitBreakerState.objects.get(name="test").state, CircuitState.OPEN.name
+        )
+        with self.assertRaises(ImaggaUnavailable):
+            client.get_tag_image_for_upload("upload")
+        self.assertEqual(mock_request.call_count, 1)
+
+    @mock.patch("core.clients.time.sleep")
+    @mock.patch("requests.Session.request")
+    def test_retries_stop_once_the_circuit_opens(self, mock_request, mock_sleep):
+        # Arrange
+        circuit_breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        client = ImaggaClient(
+            "key", "secret", max_retries=5, circuit_breaker=circuit_breaker
+        )
+        mock_request.return_value = mock.Mock(status_code=429, headers={})
+
+        # Act
+        with self.assertRaises(ImaggaUnavailable):
+            client.get_tag_image_for_upload("upload")
+
+        # Assert
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(
+            CircuitBreakerState.objects.get(name="test").consecutive_failures, 2
+        )
+
+    @mock.patch("requests.Session.request")
+    def test_probe_is_released_when_no_token_is_available(self, mock_request):
+        # Arrange
+        circuit_breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=60)
+        CircuitBreakerState.objects.create(
+            name="test",
+            state=CircuitState.OPEN.name,
+            consecutive_failures=5,
+            opened_at=timezone.now() - timedelta(seconds=61),
+        )
+        rate_limiter = mock.Mock()
+        rate_limiter.acquire.side_effect = ImaggaUnavailable("limited", retry_after=1)
+        client = ImaggaClient(
+            "key",
+            "secret",
+            max_retries=0,
+            rate_limiter=rate_limiter,
+            circuit_breaker=circuit_breaker,
+        )
+
+        # Act
+        with self.assertRaises(ImaggaUnavailable):
+            client.get_tag_image_for_upload("upload")
+        rate_limiter.acquire.side_effect = None
+        mock_request.return_value = mock.Mock(
+            status_code=200, json=mock.Mock(return_value={"result": {"tags": []}})
+        )
+        probe_result = client.get_tag_image_for_upload("upload")
+
+        # Assert
+        self.assertEqual(probe_result, {"result": {"tags": []}})
+        self.assertEqual(
+            CircuitBreakerState.objects.get(name="test").state,
+            CircuitState.CLOSED.name,
+        )
+
+    def test_token_bucket_allows_bursts_then_rejects(self):
+        # Arrange
+        token_bucket = TokenBucket("test", rate=1.0, burst=2, max_wait=0)
+
+        # Act
+        token_bucket.acquire()
+        token_bucket.acquire()
+        with self.assertRaises(ImaggaUnavailable) as error:
+            token_bucket.acquire()
+
+        # Assert
+        self.assertAlmostEqual(error.exception.retry_after, 1.0, delta=0.1)
+        state = TokenBucketState.objects.get(name="test")
+        self.assertLess(state.tokens, 1)
+        self.assertEqual(state.version, 2)
+
+
+@mock.patch("core.jobs.process_image_upload")
+class TestTaggingJobs(TestCase):
+    def setUp(self):
+        self.image = Image.objects.create(
+            source_type=SourceType.URL.name,
+            source_url="https://example.com/image.jpg",
+        )
+        self.job = enqueue_tagging_job(self.image)
+
+    def test_successful_job_marks_image_upload_success(self, mock_process_image_upload):
+        # Act
+        result = process_next_tagging_job()
+
+        # Assert
+        self.assertTrue(result)
+        mock_process_image_upload.assert_called_once_with(self.job.image)
+        self.job.refresh_from_db()
+        self.image.image_upload.refresh_from_db()
+        self.assertEqual(self.job.status, UploadStatusType.SUCCESS.name)
+        self.assertEqual(self.job.attempts, 1)
+        self.assertEqual(self.image.image_upload.status, UploadStatusType.SUCCESS.name)
+        self.assertFalse(process_next_tagging_job())
+
+    def test_job_is_deferred_without_using_an_attempt_while_imagga_is_unavailable(
+        self, mock_process_image_upload
+    ):
+        # Arrange
+        mock_process_image_upload.side_effect = ImaggaUnavailable(
+            "Imagga is unavailable.", retry_after=30
+        )
+
+        # Act
+        result = process_next_tagging_job()
+
+        # Assert
+        self.assertTrue(result)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, UploadStatusType.PENDING.name)
+        self.assertEqual(self.job.attempts, 0)
+        self.assertIsNone(self.job.locked_at)
+        self.assertGreater(self.job.run_after, timezone.now())
+        self.assertFalse(process_next_tagging_job())
+
+    def test_rejected_image_marks_image_upload_rejected(
+        self, mock_process_image_upload
+    ):
+        # Arrange
+        mock_process_image_upload.side_effect = ValidationError(
+            "Image contains NSFW content."
+        )
+
+        # Act
+        process_next_tagging_job()
+
+        # Assert
+        self.image.image_upload.refresh_from_db()
+        self.assertEqual(self.image.image_upload.status, UploadStatusType.REJECTED.name)
+        self.assertEqual(
+            self.image.image_upload.error_message, "Image contains NSFW content."
+        )
+
+    @mock.patch.object(Logger, "warn")
+    def test_failed_job_is_retried_until_max_attempts(
+        self, mock_warn, mock_process_image_upload
+    ):
+        # Arrange
+        mock_process_image_upload.side_effect = ValueError("Imagga is down")
+
+        # Act
+        with self.settings(
+            TAGGING_JOB_MAX_ATTEMPTS=2, TAGGING_JOB_RETRY_DELAY_SECONDS=0
+        ):
+            first_attempt_ran = process_next_tagging_job()
+            self.job.refresh_from_db()
+            status_after_first_attempt = self.job.status
+            second_attempt_ran = process_next_tagging_job()
+
+        # Assert
+        self.assertTrue(first_attempt_ran)
+        self.assertTrue(second_attempt_ran)
+        self.assertEqual(status_after_first_attempt, UploadStatusType.PENDING.name)
+        self.job.refresh_from_db()
+        self.image.image_upload.refresh_from_db()
+        self.assertEqual(self.job.status, UploadStatusType.ERROR.name)
+        self.assertEqual(self.job.attempts, 2)
+        self.assertEqual(self.image.image_upload.status, UploadStatusType.ERROR.name)
+        self.assertEqual(self.image.image_upload.error_message, "Imagga is down")
+
+    def test_locked_job_is_not_claimed_twice(self, mock_process_image_upload):
+        # Arrange
+        TaggingJob.objects.filter(id=self.job.id).update(locked_at=timezone.now())
+
+        # Act
+        result = process_next_tagging_job()
+
+        # Assert
+        self.assertFalse(result)
+        mock_process_image_upload.assert_not_called()
+
+
+class TestImaggaResponseCache(TestCase):
+    def setUp(self):
+        self.cache = ImaggaResponseCache(ttl=60, max_entries=2, eviction_interval=1)
+
+    def test_returns_cached_response_for_an_equivalent_url(self):
+        # Arrange
+        self.cache.set("tags", "https://Example.com:443/a.jpg?b=2&a=1#top", {"tags": 1})
+
+        # Act
+        result = self.cache.get("tags", "https://example.com/a.jpg?a=1&b=2")
+
+        # Assert
+        self.assertEqual(result, {"tags": 1})
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 0})
+
+    def test_misses_for_another_categorizer_or_an_expired_entry(self):
+        # Arrange
+        self.cache.set("categories", "https://example.com/a.jpg", {}, "nsfw_beta")
+        expired_cache = ImaggaResponseCache(ttl=0, max_entries=2)
+
+        # Act
+        other_categorizer = self.cache.get(
+            "categories", "https://example.com/a.jpg", "other"
+        )
+        expired = expired_cache.get(
+            "categories", "https://example.com/a.jpg", "nsfw_beta"
+        )
+
+        # Assert
+        self.assertIsNone(other_categorizer)
+        self.assertIsNone(expired)
+        self.assertEqual(self.cache.stats(), {"hits": 0, "misses": 1})
+
+    def test_evicts_least_recently_used_entries_beyond_max_entries(self):
+        # Arrange
+        self.cache.set("tags", "https://example.com/1.jpg", {"id": 1})
+        self.cache.set("tags", "https://example.com/2.jpg", {"id": 2})
+        self.cache.get("tags", "https://example.com/1.jpg")
+
+        # Act
+        self.cache.set("tags", "https://example.com/3.jpg", {"id": 3})
+
+        # Assert
+        self.assertEqual(
+            set(CachedImaggaResponse.objects.values_list("image_url", flat=True)),
+            {"https://example.com/1.jpg", "https://example.com/3.jpg"},
+        )
+
+    @mock.patch("requests.Session.request")
+    def test_client_skips_the_network_call_on_a_cache_hit(self, mock_request):
+        # Arrange
+        mock_request.return_value = mock.Mock(
+            status_code=200, json=mock.Mock(return_value={"result": {"tags": []}})
+        )
+        imagga_client = ImaggaClient("key", "secret", response_cache=self.cache)
+        imagga_client.get_tag_image("https://example.com/a.jpg")
+
+        # Act
+        result = imagga_client.get_tag_image("https://example.com/a.jpg")
+
+        # Assert
+        self.assertEqual(result, {"result": {"tags": []}})
+        mock_request.assert_called_once()
+        self.assertEqual(imagga_client.cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_normalize_image_url(self):
+        self.assertEqual(
+            normalize_image_url("HTTP://Example.COM:80?b=1&a=2#frag"),
+            "http://example.com/?a=2&b=1",
+        )
@@ -0,0 +1,40 @@
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class Sha256UploadHandlerMixin:
+    """
+    Mixin to compute the SHA-256 of an uploaded file while its chunks are received, exposing it as `file.sha256`
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Set first, as the handler that takes the file stops the others by raising from new_file
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining_data = super().receive_data_chunk(raw_data, start)
+        if remaining_data is None:
+            # This handler kept the chunk; otherwise the next handler hashes it
+            self.sha256.update(raw_data)
+        return remaining_data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(Sha256UploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(
+    Sha256UploadHandlerMixin, TemporaryFileUploadHandler
+):
+    pass
@@ -0,0 +1,71 @@
+import os
+import tempfile
+from django.conf import settings
+
+from core.imaging import resize_image
+from core.models import Image
+from core.services import get_content_hash
+
+CONTENT_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def get_image_variant(image: Image, size: str, image_format: str):
+    """
+    Get the path of a resized variant of an uploaded image, generating it on first use.
+
+    Variants are stored by the content hash of the original under IMAGE_VARIANT_ROOT, so identical uploads share
+    them and a variant never needs invalidating.
+
+    :param image: Image object with a source file
+    :param size: name of a size in IMAGE_VARIANT_SIZES
+    :param image_format: name of a format in IMAGE_VARIANT_FORMATS
+    :return: (path, content type)
+    """
+    if not image.content_hash:
+        image.content_hash = get_content_hash(image.source)
+        # Without save(), so viewing an image neither fires post_save (emptying the result cache) nor moves its ETag
+        Image.objects.filter(id=image.id).update(content_hash=image.content_hash)
+
+    max_dimension = settings.IMAGE_VARIANT_SIZES[size]
+    pil_format = settings.IMAGE_VARIANT_FORMATS[image_format]
+    path = os.path.join(
+        settings.IMAGE_VARIANT_ROOT,
+        image.content_hash[:2],
+        image.content_hash,
+        f"{max_dimension}.{image_format}",
+    )
+    if not os.path.exists(path):
+        content = resize_image(
+            image.source, max_dimension, pil_format, settings.IMAGE_VARIANT_QUALITY
+        )
+        _write_atomically(path, content)
+    return path, CONTENT_TYPES[pil_format]
+
+
+def generate_image_variants(image: Image):
+    """
+    Generate every variant of an uploaded image up front, so its first requests are served from disk.
+
+    :param image: Image object
+    """
+    if not image.source:
+        return
+    for size in settings.IMAGE_VARIANT_SIZES:
+        for image_format in settings.IMAGE_VARIANT_FORMATS:
+            get_image_variant(image, size, image_format)
+
+
+def _write_atomically(path, content):
+    """
+    Write to a temporary file and rename it into place, so concurrent requests never read a partial variant.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
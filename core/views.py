@@ -1,28 +1,80 @@
-from functools import reduce
-from django.db.models import Q
+import hashlib
+import json
+import os
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.urls import reverse
 from rest_framework import permissions, viewsets
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from core.models import Image
-from core.serializers import ImageSerializer
+from core.pagination import ImageCursorPagination, ImageRelevancePagination
+from core.serializers import (
+    IMAGE_REPRESENTATION_FIELDS,
+    ImageSerializer,
+    image_values_to_representation,
+)
 from logging import Logger
 from rest_framework import status
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 
-from core.services import process_image_upload
+from core.export import gzip_stream, iter_image_export, parse_export_filters
+from core.media import serve_file
+from core.autocomplete import tag_autocomplete_index
+from core.metrics import image_result_cache as image_result_cache_lookups
+from core.metrics import metrics_registry
+from core.result_cache import (
+    IMAGES_GENERATION,
+    bump_generation,
+    get_generation,
+    image_result_cache,
+)
+from core.jobs import enqueue_tagging_job, enqueue_tagging_jobs
+from core.duplicates import find_near_duplicates, index_perceptual_hash
+from core.imaging import get_dhash
+from core.variants import get_image_variant
+from core.search import rank_images_by_tags
+from core.facets import get_tag_facets
+from core.query import (
+    QuerySyntaxError,
+    get_canonical_query,
+    get_conjunction_terms,
+    get_term_names,
+    parse_object_query,
+    plan_object_query,
+)
+from core.services import get_content_hash, get_stored_file_name, index_image_tags
 
 log = Logger(__name__)
 
+# Image metadata changes, so clients keep it but revalidate it with the ETag on every use
+METADATA_CACHE_CONTROL = "private, no-cache"
+
 
 class ImageViewSet(viewsets.ModelViewSet):
     """
     API endpoint that allows images to be fetched and uploaded
     """
 
-    queryset = Image.objects.all().order_by("id")
+    # Related rows are joined in, so to_dict and the status view never query them one by one
+    queryset = Image.objects.select_related("image_upload", "uploaded_by").order_by(
+        "id"
+    )
     serializer_class = ImageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ImageCursorPagination
 
     # TODO: Allow uppercase and lowercase source_type
     def create(self, request, *args, **kwargs):
@@ -33,46 +85,546 @@ class ImageViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
 
-        try:
+        self._hash_source(serializer.validated_data)
+
+        with transaction.atomic():
             image = Image.objects.create(
                 **{"uploaded_by": self.request.user}, **serializer.validated_data
             )
             if detect_objects:
-                process_image_upload(image)
-            else:
-                log.info(f"Skipping object detection for image: {image.id}")
+                # Detection runs in the `process_tagging_jobs` worker; clients poll the status endpoint
+                enqueue_tagging_job(image)
 
-            headers = self.get_success_headers(serializer.data)
+        if not detect_objects:
+            log.info(f"Skipping object detection for image: {image.id}")
+            headers = self.get_success_headers(serializer.validated_data)
             return Response(image.to_dict(), status=status.HTTP_200_OK, headers=headers)
-        except ValidationError as e:
-            log.warn(f"Exception while processing image: {e.detail}")
-            raise
+
+        headers = {"Location": reverse("image-status", args=[image.id])}
+        return Response(
+            image.to_dict(), status=status.HTTP_202_ACCEPTED, headers=headers
+        )
+
+    @action(detail=False, methods=["post"], url_path="bulk", url_name="bulk")
+    def bulk_create(self, request):
+        """
+        A view that accepts POST with a list of images, created in a single insert. Invalid items are reported per
+        item without failing the valid ones.
+
+        The body is either a JSON list (or `{"images": [...]}`) of URL items, or multipart form data with an `images`
+        field holding that JSON, where an upload item's `source` names the form field of its file.
+        """
+        items = self._get_bulk_items(request)
+
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                self._hash_source(serializer.validated_data)
+                valid_items.append(
+                    (
+                        index,
+                        serializer.validated_data,
+                        str(item.get("detect_objects", "false")).lower() == "true",
+                    )
+                )
+            else:
+                results[index] = {
+                    "index": index,
+                    "status": "invalid",
+                    "errors": serializer.errors,
+                }
+
+        with transaction.atomic():
+            images = Image.objects.bulk_create(
+                [
+                    Image(uploaded_by=request.user, **validated_data)
+                    for _, validated_data, _ in valid_items
+                ]
+            )
+            # bulk_create skips the post_save signals that index objects sent by the client and invalidate cached
+            # results
+            for image in images:
+                if image.detected_objects:
+                    index_image_tags(image)
+            bump_generation(IMAGES_GENERATION)
+            # Detection runs in the `process_tagging_jobs` worker, which bounds how many images are tagged at once
+            enqueue_tagging_jobs(
+                [
+                    image
+                    for image, (_, _, detect_objects) in zip(images, valid_items)
+                    if detect_objects
+                ]
+            )
+
+        for image, (index, _, detect_objects) in zip(images, valid_items):
+            results[index] = {
+                "index": index,
+                "status": "accepted" if detect_objects else "created",
+                "image": image.to_dict(),
+            }
+
+        if not valid_items:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(valid_items) < len(items):
+            response_status = status.HTTP_207_MULTI_STATUS
+        elif any(detect_objects for _, _, detect_objects in valid_items):
+            response_status = status.HTTP_202_ACCEPTED
+        else:
+            response_status = status.HTTP_200_OK
+        return Response({"results": results}, status=response_status)
+
+    @action(detail=True, methods=["get"], url_path="status", url_name="status")
+    def detection_status(self, request, pk=None):
+        """
+        A view to poll the object detection status of an image created with `detect_objects`
+        """
+        image = self.get_object()
+        image_upload = image.image_upload
+        return Response(
+            {
+                "id": image.id,
+                "status": image_upload.get_status_display() if image_upload else None,
+                "error_message": image_upload.error_message if image_upload else None,
+                "date_updated": (
+                    image_upload.date_updated.isoformat() if image_upload else None
+                ),
+                "detected_objects": image.detected_objects,
+                "blacklisted": image.blacklisted,
+            }
+        )
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path=r"variants/(?P<size>[^/.]+)/(?P<image_format>[^/.]+)",
+        url_name="variant",
+    )
+    def variant(self, request, pk=None, size=None, image_format=None):
+        """
+        A view that serves a resized copy of an uploaded image, generating it on first request
+        """
+        if (
+            size not in settings.IMAGE_VARIANT_SIZES
+            or image_format not in settings.IMAGE_VARIANT_FORMATS
+        ):
+            raise NotFound("Unknown image variant.")
+        image = self.get_object()
+        if not image.source:
+            raise NotFound("Image has no uploaded file.")
+        path, content_type = get_image_variant(image, size, image_format)
+        return serve_file(
+            request,
+            path,
+            content_type,
+            accel_redirect_url=settings.IMAGE_VARIANT_ACCEL_REDIRECT_URL
+            + quote(os.path.relpath(path, settings.IMAGE_VARIANT_ROOT)),
+        )
+
+    @action(detail=True, methods=["get"], url_path="duplicates", url_name="duplicates")
+    def duplicates(self, request, pk=None):
+        """
+        A view that lists the images that look the same as an uploaded image, closest first. Accepts the optional
+        query parameter "max_distance", the most bits (of 64) their perceptual hashes may differ in.
+        """
+        try:
+            max_distance = int(
+                request.query_params.get(
+                    "max_distance", settings.IMAGE_NEAR_DUPLICATE_MAX_DISTANCE
+                )
+            )
+        except ValueError:
+            raise ValidationError("max_distance must be an integer.")
+        if not 0 <= max_distance <= settings.IMAGE_DUPLICATES_MAX_DISTANCE:
+            raise ValidationError(
+                f"max_distance must be between 0 and {settings.IMAGE_DUPLICATES_MAX_DISTANCE}."
+            )
+
+        image = self.get_object()
+        if not image.source:
+            raise NotFound("Image has no uploaded file.")
+        if not image.perceptual_hash:
+            # Images created without object detection are hashed on first lookup
+            image.perceptual_hash = get_dhash(image.source)
+            # Without save(), so a lookup neither empties the result cache nor moves the image's ETag
+            Image.objects.filter(id=image.id).update(
+                perceptual_hash=image.perceptual_hash
+            )
+            index_perceptual_hash(image)
+
+        distances = dict(
+            find_near_duplicates(
+                image.perceptual_hash, max_distance, exclude_id=image.id
+            )
+        )
+        rows = {
+            row["id"]: row
+            for row in Image.objects.filter(
+                id__in=distances.keys(), blacklisted=False
+            ).values(*IMAGE_REPRESENTATION_FIELDS)
+        }
+        return Response(
+            {
+                "results": [
+                    {
+                        **image_values_to_representation(rows[image_id], request),
+                        "distance": distance,
+                    }
+                    for image_id, distance in distances.items()
+                    if image_id in rows
+                ]
+            }
+        )
+
+    @action(detail=False, methods=["get"], url_path="export", url_name="export")
+    def export(self, request):
+        """
+        A view that streams every image as newline-delimited JSON. Accepts the optional query parameters "objects",
+        "created_after" and "created_before" to filter the images, and "compress=gzip" to download a gzip file.
+        """
+        try:
+            filters = parse_export_filters(
+                objects=request.query_params.get("objects"),
+                created_after=request.query_params.get("created_after"),
+                created_before=request.query_params.get("created_before"),
+            )
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+        lines = iter_image_export(**filters)
+        if request.query_params.get("compress") == "gzip":
+            response = StreamingHttpResponse(
+                gzip_stream(lines), content_type="application/gzip"
+            )
+            response["Content-Disposition"] = 'attachment; filename="images.ndjson.gz"'
+        else:
+            response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+        return response
 
     def list(self, request, *args, **kwargs):
         """
-        A view that accepts GET with a query parameter of "objects" detected in the image
+        A view that accepts GET with a query parameter of "objects" detected in the image: object names combined with
+        AND (or a comma), OR, NOT and parentheses, e.g. `dog AND (ball OR frisbee) AND NOT indoor` (see core.query).
+
+        Images matching only ANDed objects are ordered by relevance, the sum of their confidences for the objects,
+        unless "ordering=id" is given; other queries are ordered by id. The optional query parameter "min_confidence"
+        (0-100) only counts objects detected with at least that confidence, and "facets=true" adds the most common
+        other objects of all the matching images (see core.facets).
+
+        Pages are read with `values()` and serialized without model instances, in a single query whatever the page size.
         """
+        # Read before the results, so results read after a concurrent write are never kept as current
+        generation = get_generation(IMAGES_GENERATION)
+        cache_key = self._get_list_cache_key(request)
+        # A page only changes when an image is written, which bumps the generation
+        etag = f'W/"{generation:x}-{hashlib.sha256(repr(cache_key).encode()).hexdigest()[:16]}"'
+        headers = {"ETag": etag, "Cache-Control": METADATA_CACHE_CONTROL}
+        conditional_response = get_conditional_response(request, etag=etag)
+        if conditional_response is not None:
+            return self._set_headers(conditional_response, headers)
+
+        if not settings.IMAGE_RESULT_CACHE_MAX_ENTRIES:
+            return self._set_headers(self._list(request), headers)
+
+        data = image_result_cache.get(cache_key, generation)
+        if data is not None:
+            image_result_cache_lookups.labels("hit").inc()
+            return Response(data, headers=headers)
+
+        image_result_cache_lookups.labels("miss").inc()
+        response = self._list(request)
+        image_result_cache.set(
+            cache_key,
+            generation,
+            response.data,
+            size=len(JSONRenderer().render(response.data)),
+        )
+        return self._set_headers(response, headers)
+
+    def _get_list_cache_key(self, request):
+        """
+        Key GET /images responses by what they depend on, with the objects query in canonical form. Every
+        authenticated user sees the same images, so users share entries.
+        """
+        params = request.query_params
+        objects = params.get("objects")
+        try:
+            query = parse_object_query(objects) if objects is not None else None
+        except QuerySyntaxError as e:
+            raise ValidationError(f"Invalid objects query: {e}")
+        return (
+            # Links in the response are absolute
+            request.build_absolute_uri(request.path),
+            objects is not None,
+            get_canonical_query(query),
+            self._get_blacklisted(request),
+            self._get_min_confidence(request),
+            params.get("ordering") == "id",
+            self._get_facets(request),
+            params.get("page_size"),
+            params.get("cursor"),
+        )
+
+    def _list(self, request):
         objects = request.query_params.get("objects", None)
-        blacklisted = request.query_params.get("blacklisted", False)
-
-        if objects is not None:
-            queryset = Image.objects.filter(blacklisted=blacklisted).filter(
-                reduce(
-                    lambda x, y: x & y,
-                    [
-                        Q(detected_objects__icontains=object)
-                        for object in objects.split(",")
-                    ],
-                )
+        blacklisted = self._get_blacklisted(request)
+        facets = self._get_facets(request)
+
+        if objects is None:
+            response = self._list_values(
+                request, self.filter_queryset(self.get_queryset())
             )
-            serializer = ImageSerializer(queryset, many=True)
-            return Response(
-                data=serializer.data,
+            if facets:
+                # Over every image that is not blacklisted
+                self._add_facets(response, Q(), blacklisted=False)
+            return response
+
+        try:
+            query = parse_object_query(objects)
+        except QuerySyntaxError as e:
+            raise ValidationError(f"Invalid objects query: {e}")
+        min_confidence = self._get_min_confidence(request)
+        tag_names = get_conjunction_terms(query)
+        condition = None
+        if tag_names and request.query_params.get("ordering") != "id":
+            response = self._list_by_relevance(
+                request, tag_names, min_confidence, blacklisted
             )
         else:
-            return super().list(request, *args, **kwargs)
+            condition = (
+                plan_object_query(query, min_confidence) if query is not None else Q()
+            )
+            queryset = Image.objects.filter(blacklisted=blacklisted).order_by("id")
+            response = self._list_values(
+                request,
+                (
+                    queryset.filter(condition)
+                    if condition is not None
+                    else queryset.none()
+                ),
+            )
+
+        if facets:
+            if tag_names and condition is None:
+                condition = plan_object_query(query, min_confidence)
+            self._add_facets(
+                response,
+                condition,
+                blacklisted,
+                exclude_names=get_term_names(query) if query is not None else (),
+            )
+        return response
+
+    def _list_values(self, request, queryset):
+        page = self.paginate_queryset(queryset.values(*IMAGE_REPRESENTATION_FIELDS))
+        return self.get_paginated_response(
+            [image_values_to_representation(row, request) for row in page]
+        )
+
+    def _add_facets(self, response, condition, blacklisted, exclude_names=()):
+        response.data["facets"] = [
+            {"name": name, "image_count": image_count}
+            for name, image_count in get_tag_facets(
+                condition,
+                blacklisted=blacklisted,
+                exclude_names=exclude_names,
+                limit=settings.IMAGE_FACET_LIMIT,
+            )
+        ]
+
+    def _list_by_relevance(self, request, tag_names, min_confidence, blacklisted):
+        paginator = ImageRelevancePagination()
+        page = paginator.paginate_ranking(
+            lambda limit, after: rank_images_by_tags(
+                tag_names,
+                limit,
+                min_confidence=min_confidence,
+                blacklisted=blacklisted,
+                after=after,
+            ),
+            request,
+        )
+        rows = {
+            row["id"]: row
+            for row in Image.objects.filter(
+                id__in=[image_id for image_id, _ in page]
+            ).values(*IMAGE_REPRESENTATION_FIELDS)
+        }
+        return paginator.get_paginated_response(
+            [
+                {
+                    **image_values_to_representation(rows[image_id], request),
+                    "relevance": score,
+                }
+                for image_id, score in page
+                if image_id in rows
+            ]
+        )
+
+    def _get_blacklisted(self, request):
+        return request.query_params.get("blacklisted", "false").lower() in ("true", "1")
+
+    def _get_facets(self, request):
+        return request.query_params.get("facets", "false").lower() == "true"
+
+    def _get_min_confidence(self, request):
+        try:
+            min_confidence = float(request.query_params.get("min_confidence", 0))
+        except ValueError:
+            raise ValidationError("min_confidence must be a number.")
+        if not 0 <= min_confidence <= 100:
+            raise ValidationError("min_confidence must be between 0 and 100.")
+        return min_confidence
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        A view that returns an image, answering `If-None-Match`/`If-Modified-Since` with 304 Not Modified from its
+        `date_updated` before serializing it.
+        """
+        row = get_object_or_404(
+            self.get_queryset().values(*IMAGE_REPRESENTATION_FIELDS, "date_updated"),
+            pk=kwargs["pk"],
+        )
+        updated = row["date_updated"].timestamp()
+        etag = f'W/"{row["id"]:x}-{round(updated * 1_000_000):x}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": http_date(updated),
+            "Cache-Control": METADATA_CACHE_CONTROL,
+        }
+        conditional_response = get_conditional_response(
+            request, etag=etag, last_modified=int(updated)
+        )
+        if conditional_response is not None:
+            return self._set_headers(conditional_response, headers)
+        return Response(image_values_to_representation(row, request), headers=headers)
+
+    def _set_headers(self, response, headers):
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    def _hash_source(self, validated_data):
+        """
+        Store the uploaded file's content hash and, when enabled, point it at an identical file already stored.
+        """
+        source = validated_data.get("source")
+        if not source:
+            return
+        content_hash = get_content_hash(source)
+        validated_data["content_hash"] = content_hash
+        stored_file_name = (
+            get_stored_file_name(content_hash)
+            if settings.IMAGE_DEDUPLICATE_STORED_FILES
+            else None
+        )
+        if stored_file_name:
+            validated_data["source"] = stored_file_name
+
+    def _get_bulk_items(self, request):
+        items = request.data
+        if hasattr(items, "getlist"):
+            # Multipart form data; the item list is sent as JSON next to the files
+            try:
+                items = json.loads(items.get("images", ""))
+            except ValueError:
+                raise ValidationError("images must be a JSON list of images.")
+        if isinstance(items, dict):
+            items = items.get("images")
+        if not isinstance(items, list) or not all(
+            isinstance(item, dict) for item in items
+        ):
+            raise ValidationError("Expected a list of images.")
+        if not items:
+            raise ValidationError("At least one image is required.")
+        if len(items) > settings.IMAGE_BULK_MAX_ITEMS:
+            raise ValidationError(
+                f"At most {settings.IMAGE_BULK_MAX_ITEMS} images can be submitted at once."
+            )
+
+        items = [dict(item) for item in items]
+        for item in items:
+            if isinstance(item.get("source"), str):
+                item["source"] = request.FILES.get(item["source"])
+        return items
 
     def handle_exception(self, exc):
         if isinstance(exc, ValidationError):
             return Response({"detail": exc.detail}, status=exc.status_code)
         return super().handle_exception(exc)
+
+
+class TagAutocompleteView(APIView):
+    """
+    API endpoint that suggests the tags starting with a prefix, most common first
+    """
+
+    permission_classes = ImageViewSet.permission_classes
+
+    def get(self, request):
+        try:
+            limit = int(
+                request.query_params.get(
+                    "limit", settings.TAG_AUTOCOMPLETE_DEFAULT_LIMIT
+                )
+            )
+        except ValueError:
+            raise ValidationError("limit must be an integer.")
+        if not 1 <= limit <= settings.TAG_AUTOCOMPLETE_MAX_LIMIT:
+            raise ValidationError(
+                f"limit must be between 1 and {settings.TAG_AUTOCOMPLETE_MAX_LIMIT}."
+            )
+
+        tags = tag_autocomplete_index.suggest(
+            request.query_params.get("prefix", ""), limit
+        )
+        return Response(
+            {
+                "results": [
+                    {"name": name, "image_count": image_count}
+                    for name, image_count in tags
+                ]
+            }
+        )
+
+    def handle_exception(self, exc):
+        if isinstance(exc, ValidationError):
+            return Response({"detail": exc.detail}, status=exc.status_code)
+        return super().handle_exception(exc)
+
+
+class MediaView(APIView):
+    """
+    API endpoint that serves uploaded image files to the users allowed to fetch images
+    """
+
+    permission_classes = ImageViewSet.permission_classes
+
+    def get(self, request, path):
+        try:
+            file_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise NotFound()
+        if not os.path.isfile(file_path):
+            raise NotFound()
+        return serve_file(
+            request,
+            file_path,
+            accel_redirect_url=settings.MEDIA_ACCEL_REDIRECT_URL + quote(path),
+        )
+
+
+class MetricsView(APIView):
+    """
+    A view that exposes the metrics of this process in the Prometheus text format, to authenticated users like the
+    rest of the API (e.g. `basic_auth` in the Prometheus scrape config)
+    """
+
+    permission_classes = ImageViewSet.permission_classes
+
+    def get(self, request):
+        return HttpResponse(
+            metrics_registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -14,7 +14,6 @@ from pathlib import Path
 
 from dotenv import dotenv_values
 
-
 env_config = dotenv_values(
     "local.env"
 )  # With no intention of deploying this in a public way (ie "Production") always assume local environment
@@ -51,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.QueryCountMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -63,6 +64,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "imageSearch.urls"
 
+# Report the DB queries of each request in an X-DB-Query-Count header, for `python manage.py benchmark_images`
+QUERY_COUNT_HEADER_ENABLED = env_config.get("QUERY_COUNT_HEADER_ENABLED") == "true"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -139,8 +143,69 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_ROOT = BASE_DIR / "images"
 MEDIA_URL = "/images/"
 
+# Uploaded images and their variants are served by Django after the same permission check as GET /images. Set to
+# "x-sendfile" (Apache mod_xsendfile) or "x-accel-redirect" (nginx) to let the front proxy send the file instead.
+MEDIA_SENDFILE_BACKEND = None
+# nginx `internal` locations aliasing MEDIA_ROOT and IMAGE_VARIANT_ROOT, used by "x-accel-redirect"
+MEDIA_ACCEL_REDIRECT_URL = "/protected/images/"
+IMAGE_VARIANT_ACCEL_REDIRECT_URL = "/protected/image_variants/"
+MEDIA_CACHE_MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+
+# Same as Django's defaults, but also compute each uploaded file's SHA-256 while it streams in
+FILE_UPLOAD_HANDLERS = [
+    "core.uploadhandlers.HashingMemoryFileUploadHandler",
+    "core.uploadhandlers.HashingTemporaryFileUploadHandler",
+]
+
+# Point a re-uploaded file at the copy already in MEDIA_ROOT instead of storing it again
+IMAGE_DEDUPLICATE_STORED_FILES = True
+
+# Resized copies of uploaded images, served by GET /images/{id}/variants/{size}/{format}/. They are stored by the
+# content hash of the original next to MEDIA_ROOT, generated on first request or by the tagging worker when eager.
+IMAGE_VARIANT_ROOT = BASE_DIR / "image_variants"
+IMAGE_VARIANT_SIZES = {"small": 128, "medium": 512}
+IMAGE_VARIANT_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANTS_EAGER = True
+
+# Reuse the detected objects of an earlier upload whose perceptual hash is at most this many bits (of 64) away,
+# i.e. the same photo resized or re-encoded; 0 disables it. GET /images/{id}/duplicates accepts up to the maximum.
+IMAGE_NEAR_DUPLICATE_MAX_DISTANCE = 5
+IMAGE_DUPLICATES_MAX_DISTANCE = 12
+
 IMAGGA_API_KEY = env_config.get("IMAGGA_API_KEY")
 IMAGGA_API_SECRET = env_config.get("IMAGGA_AUTH_KEY")
+# Point at `python manage.py run_imagga_simulator` (e.g. http://127.0.0.1:8001/v2/) to develop or load test offline
+IMAGGA_API_URL = env_config.get("IMAGGA_API_URL") or "https://api.imagga.com/v2/"
+
+# Imagga HTTP transport; timeouts are in seconds
+IMAGGA_CONNECT_TIMEOUT_SECONDS = 3.05
+IMAGGA_READ_TIMEOUT_SECONDS = 30.0
+# Also bounds how many Imagga calls run concurrently for a single process
+IMAGGA_POOL_MAXSIZE = 10
+# Retries of throttled or failed calls; each one takes its own rate limit token
+IMAGGA_MAX_RETRIES = 3
+IMAGGA_RETRY_BACKOFF_FACTOR = 0.5
+IMAGGA_RETRY_BACKOFF_JITTER = 0.5
+
+# Calls to Imagga per second shared by every process, with bursts of up to IMAGGA_RATE_LIMIT_BURST; match these to
+# the Imagga plan. A call waits up to IMAGGA_RATE_LIMIT_MAX_WAIT_SECONDS for its turn. 0 disables the limit.
+IMAGGA_RATE_LIMIT_PER_SECOND = 5.0
+IMAGGA_RATE_LIMIT_BURST = 10
+IMAGGA_RATE_LIMIT_MAX_WAIT_SECONDS = 10.0
+# Stop calling Imagga for IMAGGA_CIRCUIT_RESET_TIMEOUT_SECONDS after this many failed calls in a row (timeouts,
+# 429s and 5xx, each retry counting as a call); tagging jobs are deferred meanwhile. 0 disables the circuit breaker.
+IMAGGA_CIRCUIT_FAILURE_THRESHOLD = 5
+IMAGGA_CIRCUIT_RESET_TIMEOUT_SECONDS = 30.0
+
+# Cache of Imagga responses for image URLs; set the TTL to 0 to disable it
+IMAGGA_RESPONSE_CACHE_TTL_SECONDS = 24 * 60 * 60
+IMAGGA_RESPONSE_CACHE_MAX_ENTRIES = 100_000
+
+# Uploaded images are sent to Imagga as a JPEG copy no larger than this many pixels per side (0 sends the original).
+# The original file is kept in storage as-is.
+IMAGGA_UPLOAD_MAX_DIMENSION = 1024
+IMAGGA_UPLOAD_JPEG_QUALITY = 85
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
@@ -181,3 +246,34 @@ CORS_ALLOW_HEADERS.append("authorization")
 #     ]
 
 IMAGE_SAFETY_CONFIDENCE_DEFAULT_THRESHOLD = 51.0
+
+# Background object detection (see `python manage.py process_tagging_jobs`)
+TAGGING_JOB_MAX_ATTEMPTS = 3
+TAGGING_JOB_RETRY_DELAY_SECONDS = 30
+TAGGING_JOB_LOCK_TIMEOUT_SECONDS = 300
+TAGGING_WORKER_POLL_INTERVAL_SECONDS = 1.0
+TAGGING_WORKER_CLAIM_BATCH_SIZE = 10
+
+# Default and largest page sizes for GET /images (`?page_size=`)
+IMAGE_PAGE_SIZE = 50
+IMAGE_MAX_PAGE_SIZE = 500
+
+# GET /tags?prefix= suggestions: default and largest number of tags returned, and how often (in seconds) each worker
+# process reloads the tags whose image counts changed
+TAG_AUTOCOMPLETE_DEFAULT_LIMIT = 10
+TAG_AUTOCOMPLETE_MAX_LIMIT = 50
+TAG_AUTOCOMPLETE_REFRESH_SECONDS = 5.0
+
+# Per-process LRU cache of GET /images responses, emptied whenever an image is created, re-tagged, blacklisted or
+# deleted. Bounded by entries and by the size of the rendered JSON; set the entries to 0 to disable it.
+IMAGE_RESULT_CACHE_MAX_ENTRIES = 1000
+IMAGE_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Most objects returned by GET /images?facets=true
+IMAGE_FACET_LIMIT = 10
+
+# Most images accepted by a single POST /images/bulk request
+IMAGE_BULK_MAX_ITEMS = 500
+
+# How often (in seconds) each worker process checks whether AppConfig/FeatureFlag rows changed
+CONFIG_CACHE_TTL_SECONDS = 5.0
@@ -18,8 +18,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import include, path
 from django.conf import settings
-from django.conf.urls.static import static
-from core.views import ImageViewSet
+from core.views import ImageViewSet, MediaView, MetricsView, TagAutocompleteView
 from imageSearch.views import UserViewSet
 from rest_framework import routers
 
@@ -31,6 +30,11 @@ urlpatterns = [
     path("", include(router.urls)),
     path("admin/", admin.site.urls),
     path("api-auth/", include("rest_framework.urls")),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("tags", TagAutocompleteView.as_view(), name="tag-autocomplete"),
+    path(
+        f"{settings.MEDIA_URL.lstrip('/')}<path:path>",
+        MediaView.as_view(),
+        name="media",
+    ),
 ]
-
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)